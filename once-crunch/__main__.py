@@ -14,9 +14,12 @@ def configure():
         description='A toolchain for data mining games.')
     parser.add_argument('-v', '--verbose', action='store_true')
     parser.add_argument('-f', '--force', action='store_true')
+    parser.add_argument('--log-format', choices=['auto','ansi','plain'], default='auto', help='Write colored output with a live progress line (ansi), or timestamped lines without escape codes (plain). `auto` uses ansi when stdout is a terminal.')
     parser.add_argument('--img-format', choices=['png','webp','jpg'], help='Convert supported images to specified file format.')
     parser.add_argument('--recolor', action='store_true', help='Recolor supported images.')
-    parser.add_argument('--exclude', type=str, help='Specify exclusions as a CSV list.')
+    parser.add_argument('--img-engine', choices=['auto','magick'], default='auto', help='Process images in-process where possible (auto), or always with ImageMagick (magick).')
+    parser.add_argument('--include', type=str, help='Specify inclusions as a CSV list, only matching entries are processed. Items are substrings, globs (`*.pyc`), regular expressions (`re:...`), whole paths (`=...`), or `@FILE` to read patterns from FILE, one per line.')
+    parser.add_argument('--exclude', type=str, help='Specify exclusions as a CSV list. Items are substrings, globs (`*.pvr`), regular expressions (`re:...`), whole paths (`=...`), or `@FILE` to read patterns from FILE, one per line.')
     # `commands` sub-parsers
     subparsers = parser.add_subparsers(title='commands',dest='command',required=True)
     commands_package = importlib.import_module('once-crunch.commands')
@@ -33,15 +36,18 @@ def try_execute_command(args):
     for command in _commands:
         if args.command == command:
             fn = _commands[args.command]
-            fn(args)
+            return fn(args)
 
 if '__main__' == __name__:
     try:
         args = configure()
+        _log.set_format(args.log_format)
         if args.verbose:
             _log.set_loglevel(LogLevel.TRACE)
             _log.debug(args)
-        try_execute_command(args)
+        # commands return `False` on failure, ie. `verify` finding mismatches, so `verify && unpack` works
+        if False == try_execute_command(args):
+            exit(1)
     except KeyboardInterrupt:
         _log.info('^C\x1b[0J\r\n\n\a')
         exit(0x4d)
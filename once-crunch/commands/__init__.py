@@ -1,5 +1,14 @@
 # SPDX-FileCopyrightText: © 2024 Shaun Wilson
 # SPDX-License-Identifier: MIT
 __all__ = [
-    'unpack'
+    'bench',
+    'bindicts',
+    'cat',
+    'diff',
+    'extract',
+    'ls',
+    'pyc',
+    'stitch',
+    'unpack',
+    'verify'
 ]
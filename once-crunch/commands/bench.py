@@ -0,0 +1,192 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import copy
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from ..formats.NXFNFormatHandler import NXFNFormatHandler
+from ..formats.NXPKFormatHandler import NXPKFormatHandler, compression_names
+from ..util import synth
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'Benchmark the unpack path against a synthetic archive.'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'bench',
+        description=f'{help} Indexing, decompression, writing and image post-processing are measured separately, followed by a full unpack. No game files are required.',
+        help=help)
+    parser.add_argument('--entries', type=int, default=2000, help='Number of entries in the synthetic archive.')
+    parser.add_argument('--median-size', type=int, default=16 * 1024, help='Median entry size in bytes, sizes are log-normally distributed.')
+    parser.add_argument('--max-size', type=int, default=4 * 1024 * 1024, help='Maximum entry size in bytes.')
+    parser.add_argument('--compression', default='1,1,1,1', help='Relative weights of compression types none,zlib,lz4,zstd.')
+    parser.add_argument('--images', type=float, default=0.1, help='Fraction of entries which are (fake) PVR/PNG textures.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic archive, equal seeds produce equal archives.')
+    parser.add_argument('--repeat', type=int, default=3, help='Each stage is run this many times, the fastest run is reported.')
+    parser.add_argument('--mmap', action='store_true', help='Memory-map the archive, as `unpack --mmap` does.')
+    parser.add_argument('--workdir', help='Directory for the archive and outputs, defaults to a temporary directory which is removed afterwards.')
+    parser.add_argument('--baseline', help='Compare results against a baseline saved by `--save-baseline`.')
+    parser.add_argument('--save-baseline', help='Save results as a baseline for later comparison.')
+
+def execute(args: argparse.Namespace):
+    config = {
+        'entries': args.entries,
+        'median_size': args.median_size,
+        'max_size': args.max_size,
+        'compression': [float(weight) for weight in args.compression.split(',')],
+        'images': args.images,
+        'seed': args.seed,
+        'mmap': True == args.mmap,
+        'img_format': args.img_format if None != args.img_format else 'png',
+        'recolor': True == args.recolor
+    }
+    if 4 != len(config['compression']):
+        _log.error(f'Expected four compression weights, found: {args.compression}')
+        return False
+    baseline = None
+    if None != args.baseline:
+        with open(args.baseline, 'rt') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('config') != config:
+            _log.warn(f'Baseline `{args.baseline}` was recorded with a different configuration, results are not comparable.')
+    workdir = args.workdir if None != args.workdir else tempfile.mkdtemp(prefix='once-crunch-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    # progress output would be measured along with everything else
+    _log.set_progress(False)
+    try:
+        archive_filepath = os.path.join(workdir, f'synth-{args.seed}.npk')
+        _log.info(f'..generating `{archive_filepath}` ({args.entries} entries)')
+        entries = synth.generate_nxpk(
+            archive_filepath,
+            args.entries,
+            args.median_size,
+            args.max_size,
+            config['compression'],
+            args.images,
+            args.seed)
+        stages = _run_stages(args, config, archive_filepath, entries, workdir)
+    finally:
+        if None == args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        _log.set_progress(True)
+    _report(stages, baseline)
+    if None != args.save_baseline:
+        with open(args.save_baseline, 'wt') as baseline_file:
+            json.dump({
+                'config': config,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'stages': stages
+            }, baseline_file, indent='\t')
+        _log.info(f'Baseline saved to: {args.save_baseline}')
+    return True
+
+def _best_of(repeat:int, fn):
+    seconds = None
+    for _ in range(max(1, repeat)):
+        elapsed = fn()
+        seconds = elapsed if None == seconds else min(seconds, elapsed)
+    return seconds
+
+def _run_stages(args: argparse.Namespace, config:dict, archive_filepath:str, entries:list, workdir:str):
+    stages = {}
+    out_directory = os.path.join(workdir, 'out')
+    uncompressed_size = sum(entry[2] for entry in entries)
+    unpack_args = copy.copy(args)
+    unpack_args.SOURCE = archive_filepath
+    unpack_args.DESTINATION = out_directory
+    unpack_args.fileformat = 'nxpk'
+    unpack_args.force = True
+    unpack_args.img_format = config['img_format']
+    unpack_args.dedup = False
+    unpack_args.jobs = 1
+    unpack_args.img_jobs = 1
+    unpack_args.stream_threshold = NXPKFormatHandler._stream_threshold
+    with open(archive_filepath, 'rb') as archive_file:
+        handler = NXPKFormatHandler(archive_file, 0)
+        if args.mmap:
+            handler.map_file()
+        try:
+            # indexing, the header, entry table and name table
+            def index():
+                start_time = time.perf_counter()
+                handler._header = handler.extract_header()
+                handler.read_table()
+                NXFNFormatHandler(archive_file, handler._header['table_offset'] + handler._table_size, handler._map).read_names()
+                return time.perf_counter() - start_time
+            stages['index'] = { 'entries': len(entries), 'bytes': len(entries) * 28, 'seconds': _best_of(args.repeat, index) }
+            table = handler.read_table()
+            # decompression, in memory, overall and per compression type
+            for compression_type in [None, 0, 1, 2, 3]:
+                indices = [i for i in range(len(table)) if None == compression_type or compression_type == table.compression_type[i]]
+                if 0 == len(indices):
+                    continue
+                def decompress():
+                    start_time = time.perf_counter()
+                    for i in indices:
+                        handler.decompress_entry(table.data_offset[i], table.data_size[i], table.compression_type[i], table.uncompressed_data_size[i])
+                    return time.perf_counter() - start_time
+                name = 'decompress' if None == compression_type else f'decompress:{compression_names[compression_type]}'
+                stages[name] = { 'entries': len(indices), 'bytes': sum(table.uncompressed_data_size[i] for i in indices), 'seconds': _best_of(args.repeat, decompress) }
+            # writing, only the time spent in `save_binary()` is counted
+            def write():
+                shutil.rmtree(out_directory, ignore_errors=True)
+                seconds = 0.0
+                for i, (name, compression_type, size, crc) in enumerate(entries):
+                    data = handler.decompress_entry(table.data_offset[i], table.data_size[i], table.compression_type[i], table.uncompressed_data_size[i])
+                    start_time = time.perf_counter()
+                    handler.save_binary(data, os.path.join(out_directory, name), True)
+                    seconds += time.perf_counter() - start_time
+                return seconds
+            stages['write'] = { 'entries': len(entries), 'bytes': uncompressed_size, 'seconds': _best_of(args.repeat, write) }
+            # image post-processing of the files written above, re-extracted before every run
+            images = [(i, entry) for i, entry in enumerate(entries) if entry[0].endswith('.pvr') or entry[0].endswith('.png')]
+            if 0 < len(images):
+                def postprocess():
+                    seconds = 0.0
+                    for i, (name, compression_type, size, crc) in images:
+                        filepath = os.path.join(out_directory, name)
+                        handler.save_binary(handler.decompress_entry(table.data_offset[i], table.data_size[i], table.compression_type[i], table.uncompressed_data_size[i]), filepath, True)
+                        start_time = time.perf_counter()
+                        handler.postprocess_image(filepath, os.path.basename(name), i, unpack_args, True)
+                        seconds += time.perf_counter() - start_time
+                    return seconds
+                stages['postprocess'] = { 'entries': len(images), 'bytes': sum(entry[2] for i, entry in images), 'seconds': _best_of(args.repeat, postprocess) }
+        finally:
+            handler.unmap_file()
+    # everything together, as `unpack` would run it
+    def unpack():
+        shutil.rmtree(out_directory, ignore_errors=True)
+        os.makedirs(out_directory)
+        with open(archive_filepath, 'rb') as archive_file:
+            handler = NXPKFormatHandler(archive_file, 0)
+            if args.mmap:
+                handler.map_file()
+            try:
+                start_time = time.perf_counter()
+                handler.decode(unpack_args)
+                return time.perf_counter() - start_time
+            finally:
+                handler.unmap_file()
+    stages['unpack'] = { 'entries': len(entries), 'bytes': uncompressed_size, 'seconds': _best_of(args.repeat, unpack) }
+    return stages
+
+def _report(stages:dict, baseline:dict):
+    _log.info(f'{"stage":<18} {"entries":>8} {"MB":>9} {"seconds":>9} {"entries/s":>11} {"MB/s":>9}{"  vs baseline" if None != baseline else ""}')
+    for name, stage in stages.items():
+        seconds = max(stage['seconds'], 1e-9)
+        megabytes = stage['bytes'] / (1024 * 1024)
+        line = f'{name:<18} {stage["entries"]:>8} {megabytes:>9.1f} {stage["seconds"]:>9.3f} {stage["entries"] / seconds:>11.0f} {megabytes / seconds:>9.1f}'
+        if None != baseline:
+            previous = baseline.get('stages', {}).get(name)
+            if None != previous and 0 < previous['seconds']:
+                # positive is faster than the baseline
+                change = (previous['seconds'] / seconds - 1.0) * 100.0
+                line += f'  {change:+.1f}%'
+        _log.info(line)
@@ -0,0 +1,214 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+from ..util import bindict
+from ..util.bindictindex import BindictIndex
+from ..util.containers import ContainerReader, default_output_directory, is_container
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+# the container read by a worker process, see `_worker_init()`
+_container:ContainerReader = None
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'Extract and decode "bindict" data.'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'bindicts',
+        description=f'{help}',
+        help=help)
+    actions = parser.add_subparsers(title='actions', dest='action', required=True)
+    extract_parser: argparse.ArgumentParser = actions.add_parser(
+        'extract',
+        description='Extract `bindict(b\'...\')` blobs from `.py` files beneath PATH, each blob is written next to its source as `.py.bindict`.',
+        help='Extract bindict blobs from python files.')
+    extract_parser.add_argument('-j', '--jobs', type=int, default=0, help='Number of worker processes, `0` (the default) uses all cores.')
+    extract_parser.add_argument('-o', '--output', help='When PATH is a container, the directory blobs are written to, defaults to the container path without its extension.')
+    extract_parser.add_argument('PATH', help='the directory to scan, or a container written by `unpack --output-format`')
+    decode_parser: argparse.ArgumentParser = actions.add_parser(
+        'decode',
+        description='Decode the entry tables of `.bindict` files beneath PATH, each table is written next to its source as `.bindict.tab` (an offsets array plus a utf-8 value blob, see `util/bindict.py`.)',
+        help='Decode extracted bindict blobs.')
+    decode_parser.add_argument('--json', action='store_true', help='Also write a `.bindict.json` summary of each table.')
+    decode_parser.add_argument('-j', '--jobs', type=int, default=0, help='Number of worker processes, `0` (the default) uses all cores.')
+    decode_parser.add_argument('-o', '--output', help='When PATH is a container, the directory tables are written to, defaults to the container path without its extension.')
+    decode_parser.add_argument('PATH', help='the directory to scan, a single `.bindict` file, or a container written by `unpack --output-format`')
+    index_parser: argparse.ArgumentParser = actions.add_parser(
+        'index',
+        description='Index every entry of every `.bindict` file beneath PATH, only new and changed files are read.',
+        help='Index decoded bindict entries for `query`.')
+    index_parser.add_argument('--index', help='the index file, defaults to `__bindicts.sqlite` beneath PATH')
+    index_parser.add_argument('PATH', help='the directory to scan')
+    query_parser: argparse.ArgumentParser = actions.add_parser(
+        'query',
+        description='Find bindict entries by value, using the index built by `index`.',
+        help='Find bindict entries by value.')
+    query_parser.add_argument('--index', help='the index file, defaults to `__bindicts.sqlite` beneath PATH')
+    query_parser.add_argument('--exact', action='store_true', help='Match whole values (case-sensitive), rather than substrings (case-insensitive.)')
+    query_parser.add_argument('--limit', type=int, default=100, help='Maximum number of results.')
+    query_parser.add_argument('--json', action='store_true', help='Write results as JSON lines.')
+    query_parser.add_argument('PATH', help='the indexed directory')
+    query_parser.add_argument('TERM', help='the value to find')
+
+def execute(args: argparse.Namespace):
+    match (args.action):
+        case 'extract':
+            return extract(args)
+        case 'decode':
+            return decode(args)
+        case 'index':
+            return index(args)
+        case 'query':
+            return query(args)
+    return False
+
+def extract(args: argparse.Namespace):
+    container = is_container(args.PATH)
+    if not container and not os.path.isdir(args.PATH):
+        _log.error(f'Provided path is invalid: {args.PATH}')
+        return False
+    start_time = time.time()
+    tasks = []
+    if container:
+        output_directory = _output_directory(args)
+        with ContainerReader(args.PATH) as reader:
+            for name in reader.names():
+                out_filepath = os.path.join(output_directory, f'{name}.bindict')
+                if name.endswith('.py') and (args.force or not os.path.isfile(out_filepath)):
+                    tasks.append((name, out_filepath))
+    for dname, dlist, flist in os.walk(args.PATH) if not container else []:
+        for fname in flist:
+            if not fname.endswith('.py'):
+                continue
+            filepath = os.path.join(dname, fname)
+            out_filepath = f'{filepath}.bindict'
+            if not args.force and os.path.isfile(out_filepath):
+                continue
+            tasks.append((filepath, out_filepath))
+    jobs = args.jobs if 0 < args.jobs else (os.cpu_count() or 1)
+    _log.info(f'..scanning {len(tasks)} python files in `{args.PATH}` using {jobs} worker(s)')
+    extracted = 0
+    problem_files = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_worker_init, initargs=(args.PATH if container else None,)) as executor:
+        results = executor.map(_extract_worker, tasks, chunksize=max(1, min(64, len(tasks) // (jobs * 4))))
+        for i, (filepath, size, error) in enumerate(results):
+            if None != error:
+                problem_files.append(filepath)
+                _log.warn(f'Error loading file: {filepath}, {error}')
+            elif None != size:
+                extracted += 1
+            _log.progress(os.path.basename(filepath), i+1, len(tasks), False)
+    elapsed_time = time.time() - start_time
+    _log.activity(f'Done. `{extracted}` bindicts extracted from `{len(tasks)}` files, took `{elapsed_time:.1f}` seconds.')
+    if 0 < len(problem_files):
+        _log.info(f'\nProblem Files: {len(problem_files)}')
+        for filepath in problem_files:
+            _log.info(f'\t{filepath}')
+    return 0 == len(problem_files)
+
+def decode(args: argparse.Namespace):
+    if not os.path.isdir(args.PATH) and not os.path.isfile(args.PATH):
+        _log.error(f'Provided path is invalid: {args.PATH}')
+        return False
+    start_time = time.time()
+    container = is_container(args.PATH)
+    if container:
+        output_directory = _output_directory(args)
+        with ContainerReader(args.PATH) as reader:
+            filepaths = [(name, os.path.join(output_directory, name)) for name in reader.names() if name.endswith('.bindict')]
+    elif os.path.isfile(args.PATH):
+        filepaths = [(args.PATH, args.PATH)]
+    else:
+        filepaths = [(os.path.join(dname, fname), os.path.join(dname, fname)) for dname, dlist, flist in os.walk(args.PATH) for fname in flist if fname.endswith('.bindict')]
+    tasks = []
+    for filepath, out_prefix in filepaths:
+        if not args.force and os.path.isfile(f'{out_prefix}.tab') and (not args.json or os.path.isfile(f'{out_prefix}.json')):
+            continue
+        tasks.append((filepath, out_prefix, args.json))
+    jobs = args.jobs if 0 < args.jobs else (os.cpu_count() or 1)
+    _log.info(f'..decoding {len(tasks)} bindicts in `{args.PATH}` using {jobs} worker(s)')
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_worker_init, initargs=(args.PATH if container else None,)) as executor:
+        results = executor.map(_decode_worker, tasks, chunksize=max(1, min(64, len(tasks) // (jobs * 4))))
+        for i, (filepath, count, error) in enumerate(results):
+            if None != error:
+                failed += 1
+                _log.warn(f'Decode Error: {filepath}, {error}')
+            _log.progress(os.path.basename(filepath), i+1, len(tasks), False)
+    elapsed_time = time.time() - start_time
+    _log.activity(f'Done. count={len(tasks)}, failed={failed}, took={elapsed_time:.1f}s')
+    return 0 == failed
+
+def index(args: argparse.Namespace):
+    if not os.path.isdir(args.PATH):
+        _log.error(f'Provided path is invalid: {args.PATH}')
+        return False
+    start_time = time.time()
+    with BindictIndex(args.PATH, args.index) as bindict_index:
+        indexed, unchanged, removed, failed = bindict_index.update(
+            args.force,
+            lambda path, value, max_value: _log.progress(path, value, max_value, False))
+    elapsed_time = time.time() - start_time
+    _log.activity(f'Done. indexed={indexed}, unchanged={unchanged}, removed={removed}, failed={failed}, took={elapsed_time:.1f}s')
+    return 0 == failed
+
+def query(args: argparse.Namespace):
+    index_filepath = args.index if None != args.index else os.path.join(args.PATH, '__bindicts.sqlite')
+    if not os.path.isfile(index_filepath):
+        _log.error(f'Index not found, run `bindicts index` first: {index_filepath}')
+        return False
+    # stdout carries results, nothing else may be written to it
+    _log.set_progress(False)
+    with BindictIndex(args.PATH, index_filepath) as bindict_index:
+        for path, i, v, z, b, e in bindict_index.query(args.TERM, args.exact, args.limit):
+            if args.json:
+                print(json.dumps({ 'path': path, 'i': i, 'v': v, 'z': z, 'b': b, 'e': e }))
+            else:
+                print(f'{path}:{i}\t{v}')
+    return True
+
+def _output_directory(args: argparse.Namespace):
+    output_directory = args.output if None != args.output else default_output_directory(args.PATH)
+    os.makedirs(output_directory, exist_ok=True)
+    return output_directory
+
+def _worker_init(container_filepath:str = None):
+    global _container
+    # only the orchestrator reports progress
+    _log.set_progress(False)
+    if None != container_filepath:
+        # each worker reads the container through its own handle, entries are never extracted to disk
+        _container = ContainerReader(container_filepath)
+
+def _read(filepath:str):
+    if None != _container:
+        return _container.read(filepath)
+    with open(filepath, 'rb') as in_file:
+        return in_file.read()
+
+def _decode_worker(task:tuple):
+    filepath, out_prefix, write_json = task
+    try:
+        buf = _read(filepath)
+        table = bindict.BindictTable.decode(buf)
+        os.makedirs(os.path.dirname(os.path.abspath(out_prefix)), exist_ok=True)
+        table.save(f'{out_prefix}.tab')
+        if write_json:
+            with open(f'{out_prefix}.json', 'wt') as out_file:
+                json.dump(table.summary(buf), out_file, indent='  ')
+        return filepath, len(table), None
+    except Exception as ex:
+        return filepath, None, f'{type(ex).__name__}: {ex}'
+
+def _extract_worker(task:tuple):
+    filepath, out_filepath = task
+    try:
+        if None != _container:
+            return filepath, bindict.extract_data(_container.read(filepath), out_filepath), None
+        return filepath, bindict.extract_file(filepath, out_filepath), None
+    except Exception as ex:
+        return filepath, None, f'{type(ex).__name__}: {ex}'
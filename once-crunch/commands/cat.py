@@ -0,0 +1,34 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import os
+import sys
+from ..util.logging import Logger
+from ..formats.NpkArchive import NpkArchive
+
+_log = Logger(__name__)
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'Write archive entries to stdout.'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'cat',
+        description=f'{help} Only the named entries are decompressed.',
+        help=help)
+    parser.add_argument('ARCHIVE', help='the `.npk` file')
+    parser.add_argument('NAME', nargs='+', help='entry names within the archive')
+
+def execute(args: argparse.Namespace):
+    if not os.path.isfile(args.ARCHIVE):
+        _log.error(f'File not found: {args.ARCHIVE}')
+        return False
+    # stdout carries entry data, nothing else may be written to it
+    _log.set_progress(False)
+    with NpkArchive(args.ARCHIVE) as archive:
+        for name in args.NAME:
+            if not name in archive:
+                print(f'No such entry in `{args.ARCHIVE}`: {name}', file=sys.stderr)
+                return False
+            sys.stdout.buffer.write(archive.read(name))
+        sys.stdout.buffer.flush()
+    return True
@@ -0,0 +1,134 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+from ..formats.NXFNFormatHandler import NXFNFormatHandler
+from ..formats.NXPKFormatHandler import NXPKFormatHandler
+from ..util.filtering import PathFilter
+from ..util.logging import Logger
+from .unpack import discover_archives
+
+_log = Logger(__name__)
+_status_codes = {
+    'added': 'A',
+    'removed': 'D',
+    'changed': 'M',
+    'repacked': 'R'
+}
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'Compare the entries of two game installs (or two archives.)'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'diff',
+        description=f'{help} Only headers, entry tables and name tables are read, no entry is read or decompressed. Entries are matched by name across all archives, and compared by their size and CRCs.',
+        help=help)
+    parser.add_argument('--include-out', help='Write the names of added and changed entries to this file, for `unpack --include @FILE`.')
+    parser.add_argument('--json', action='store_true', help='Write results as JSON lines, including the table values of both sides.')
+    parser.add_argument('--repacked', action='store_true', help='Also list entries whose content is unchanged but which were recompressed (their compressed CRC differs.)')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='Number of archives indexed concurrently, `0` (the default) uses all cores.')
+    parser.add_argument('OLD', help='the previous game directory, or `.npk` file')
+    parser.add_argument('NEW', help='the current game directory, or `.npk` file')
+
+def execute(args: argparse.Namespace):
+    for path in (args.OLD, args.NEW):
+        if not os.path.isdir(path) and not os.path.isfile(path):
+            _log.error(f'File not found: {path}')
+            return False
+    # stdout carries results, nothing else may be written to it
+    _log.set_progress(False)
+    start_time = time.time()
+    path_filter = PathFilter.from_args(args)
+    jobs = args.jobs if 0 < args.jobs else (os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        old_entries, old_archives = _index_entries(executor, args.OLD, path_filter)
+        new_entries, new_archives = _index_entries(executor, args.NEW, path_filter)
+    changes = _compare(old_entries, new_entries)
+    counts = dict.fromkeys(_status_codes, 0)
+    for status, name, old, new in changes:
+        counts[status] += 1
+        if 'repacked' == status and not args.repacked:
+            continue
+        if args.json:
+            print(json.dumps({ 'status': status, 'name': name, 'old': old, 'new': new }))
+        else:
+            print(f'{_status_codes[status]}\t{name}')
+    if None != args.include_out:
+        _save_include_list(args.include_out, args, [name for status, name, old, new in changes if 'added' == status or 'changed' == status])
+    elapsed_time = time.time() - start_time
+    unchanged = len(new_entries) - counts['added'] - counts['changed'] - counts['repacked']
+    _log.info(f'Done. `{old_archives}` and `{new_archives}` archives compared, added={counts["added"]}, removed={counts["removed"]}, changed={counts["changed"]}, repacked={counts["repacked"]}, unchanged={unchanged}, took={elapsed_time:.1f}s')
+    return True
+
+def _index_entries(executor:concurrent.futures.Executor, path:str, path_filter:PathFilter):
+    """
+    returns `({ name: entry }, archive count)` for every entry beneath `path`, entries are named as
+    `unpack` names them, and a name present in several archives is taken from the last one.
+    """
+    if os.path.isfile(path):
+        archives = [path]
+    else:
+        archives = sorted(filepath for filepath, size in discover_archives(path, NXPKFormatHandler, path_filter))
+    entries = {}
+    for filepath, names, table in executor.map(_read_index, archives):
+        archive = os.path.relpath(filepath, path) if os.path.isdir(path) else os.path.basename(filepath)
+        for i, name in enumerate(names):
+            if path_filter and not path_filter.accepts(name):
+                continue
+            entries[name] = {
+                'archive': archive,
+                'index': i,
+                'checksum': table.checksum[i],
+                'data_size': table.data_size[i],
+                'uncompressed_data_size': table.uncompressed_data_size[i],
+                'data_crc': table.data_crc[i],
+                'uncompressed_data_crc': table.uncompressed_data_crc[i],
+                'compression_type': table.compression_type[i]
+            }
+    return entries, len(archives)
+
+def _read_index(filepath:str):
+    with open(filepath, 'rb') as archive_file:
+        handler = NXPKFormatHandler(archive_file, 0)
+        if not handler.is_compatible():
+            raise ValueError(f'File `{filepath}` is not compatible with format `{NXPKFormatHandler.__format_id__}`.')
+        table = handler.read_table()
+        nxfn_formatter = NXFNFormatHandler(archive_file, handler._header['table_offset'] + handler._table_size)
+        if nxfn_formatter.is_compatible():
+            names = nxfn_formatter.read_names()[:len(table)]
+        else:
+            names = []
+        # entries without a name are named after the archive, as `unpack` does
+        source_filename = os.path.basename(filepath)
+        names += [os.path.join(source_filename, f'{i}') for i in range(len(names), len(table))]
+    return filepath, names, table
+
+def _compare(old_entries:dict, new_entries:dict):
+    """
+    returns `(status, name, old, new)` for every difference, ordered by name. content is compared
+    by uncompressed size and CRC, `repacked` entries have equal content but a different encoding.
+    """
+    changes = []
+    for name in sorted(old_entries.keys() | new_entries.keys()):
+        old = old_entries.get(name)
+        new = new_entries.get(name)
+        if None == old:
+            changes.append(('added', name, old, new))
+        elif None == new:
+            changes.append(('removed', name, old, new))
+        elif old['uncompressed_data_crc'] != new['uncompressed_data_crc'] or old['uncompressed_data_size'] != new['uncompressed_data_size']:
+            changes.append(('changed', name, old, new))
+        elif old['data_crc'] != new['data_crc'] or old['checksum'] != new['checksum']:
+            changes.append(('repacked', name, old, new))
+    return changes
+
+def _save_include_list(filepath:str, args: argparse.Namespace, names:list):
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    with open(filepath, 'wt', encoding='utf-8') as list_file:
+        list_file.write(f'# added and changed entries, {args.OLD} -> {args.NEW}\n')
+        for name in names:
+            list_file.write(f'={name}\n')
+    _log.info(f'Include list of `{len(names)}` entries written to: {filepath}')
@@ -0,0 +1,45 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import os
+import time
+from ..util.logging import Logger
+from ..formats.NpkArchive import NpkArchive
+
+_log = Logger(__name__)
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'Extract matching entries from an archive.'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'extract',
+        description=f'{help} Only matching entries are read and decompressed, no post-processing is performed.',
+        help=help)
+    parser.add_argument('-o', '--output', default='.', help='the output directory, defaults to the current directory')
+    parser.add_argument('ARCHIVE', help='the `.npk` file')
+    parser.add_argument('PATTERN', nargs='+', help='entry names or globs (`*` also matches `/`), eg. `*.pyc`')
+
+def execute(args: argparse.Namespace):
+    if not os.path.isfile(args.ARCHIVE):
+        _log.error(f'File not found: {args.ARCHIVE}')
+        return False
+    start_time = time.time()
+    with NpkArchive(args.ARCHIVE) as archive:
+        # ordered and de-duplicated across patterns
+        names = {}
+        for pattern in args.PATTERN:
+            matches = archive.glob(pattern)
+            if 0 == len(matches):
+                _log.warn(f'No entries match `{pattern}` in: {args.ARCHIVE}')
+            names.update(dict.fromkeys(matches))
+        names = list(names)
+        total_size = 0
+        for i, name in enumerate(names):
+            filepath = os.path.join(args.output, name)
+            _log.progress(f'(extract) {name}', i+1, len(names))
+            if os.path.exists(filepath) and not args.force:
+                continue
+            total_size += archive.extract(name, filepath, args.force)
+    elapsed_time = time.time() - start_time
+    _log.activity(f'Done. `{len(names)}` entries ({total_size} bytes) took `{elapsed_time:.3f}` seconds.')
+    return True
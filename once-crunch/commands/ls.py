@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import os
+from ..util.logging import Logger
+from ..formats.NpkArchive import NpkArchive
+from ..formats.NXPKFormatHandler import compression_names
+
+_log = Logger(__name__)
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'List the contents of an archive.'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'ls',
+        description=f'{help} Only the entry and name tables are read.',
+        help=help)
+    parser.add_argument('-l', '--long', action='store_true', help='Include sizes and compression of each entry.')
+    parser.add_argument('-R', '--recursive', action='store_true', help='List every entry beneath PATH, not only its immediate children.')
+    parser.add_argument('ARCHIVE', help='the `.npk` file')
+    parser.add_argument('PATH', nargs='?', default='', help='a directory (or entry) within the archive')
+
+def execute(args: argparse.Namespace):
+    if not os.path.isfile(args.ARCHIVE):
+        _log.error(f'File not found: {args.ARCHIVE}')
+        return False
+    _log.set_progress(False)
+    with NpkArchive(args.ARCHIVE) as archive:
+        path = args.PATH.replace('\\', '/').strip('/')
+        if path in archive:
+            names = [path]
+        elif not archive.isdir(path):
+            _log.error(f'No such entry in `{args.ARCHIVE}`: {args.PATH}')
+            return False
+        elif args.recursive:
+            prefix = f'{path}/' if path else ''
+            names = sorted(name for name in archive.names() if name.startswith(prefix))
+        else:
+            names = [f'{path}/{name}' if path else name for name in archive.listdir(path)]
+        for name in names:
+            if not args.long or name.endswith('/'):
+                print(name)
+                continue
+            entry = archive.stat(name)
+            print(f'{entry["uncompressed_data_size"]:>12} {entry["data_size"]:>12} {compression_names.get(entry["compression_type"], entry["compression_type"]):<5} {name}')
+    return True
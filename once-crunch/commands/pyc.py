@@ -0,0 +1,235 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from ..util.containers import ContainerReader, default_output_directory, is_container
+from ..util.filtering import PathFilter
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+_path_pycdo = shutil.which('pycdo')
+_path_pycdas = shutil.which('pycdas')
+_path_pycdc = shutil.which('pycdc')
+# outputs written next to each `.pyc`, in the order they are produced
+_output_exts = [
+    '.pycdo',
+    '.pyasm',
+    '.py'
+]
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'Deobfuscate, disassemble, and decompile pyc files.'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'pyc',
+        description=f'{help} Each `.pyc` is left untouched, `pycdo` output is written to `.pycdo`, `pycdas` output to `.pyasm`, and `pycdc` output to `.py`. Results are cached by the content of the `.pyc` and the rules file, unchanged bytecode is never reprocessed.',
+        help=help)
+    parser.add_argument('--rules', default='pycdo/once-human.pycrules', help='the `.pycrules` file passed to `pycdo`')
+    parser.add_argument('--cache', help='the result cache directory, defaults to `__pyc_cache` beneath TARGET')
+    parser.add_argument('--restore-pycbak', action='store_true', help='Restore `.pycbak` files left by earlier versions of `process-pycfiles` over the `.pyc` they deobfuscated in place, by default those `.pyc` are skipped.')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='Number of files processed concurrently, `0` (the default) uses all cores.')
+    parser.add_argument('-o', '--output', help='When TARGET is a container, the directory outputs are written to, defaults to the container path without its extension.')
+    parser.add_argument('TARGET', help='the directory to scan for `.pyc` files, or a container written by `unpack --output-format`')
+
+def execute(args: argparse.Namespace):
+    if is_container(args.TARGET):
+        with ContainerReader(args.TARGET) as container:
+            return process(args, container, args.output if None != args.output else default_output_directory(args.TARGET))
+    if not os.path.isdir(args.TARGET):
+        _log.error(f'Directory not found: {args.TARGET}')
+        return False
+    return process(args, None, args.TARGET)
+
+def process(args: argparse.Namespace, container:ContainerReader, output_directory:str):
+    """
+    processes the `.pyc` files beneath `args.TARGET`, or in `container`. outputs, the index and
+    (by default) the cache are written beneath `output_directory`.
+    """
+    if not os.path.isfile(args.rules):
+        _log.error(f'Rules file is missing or inaccessible: {args.rules}')
+        return False
+    for tool_name, tool_path in (('pycdo', _path_pycdo), ('pycdas', _path_pycdas), ('pycdc', _path_pycdc)):
+        if None == tool_path:
+            _log.error(f'`{tool_name}` was not found on PATH, aborting.')
+            return False
+    start_time = time.time()
+    cache_directory = args.cache if None != args.cache else os.path.join(output_directory, '__pyc_cache')
+    index_filepath = os.path.join(output_directory, '__pyc_index.json')
+    index = {} if args.force else _load_index(index_filepath)
+    with open(args.rules, 'rb') as rules_file:
+        rules_digest = hashlib.sha256(rules_file.read()).digest()
+    path_filter = PathFilter.from_args(args)
+    pyc_filepaths = []
+    cache_abspath = os.path.abspath(cache_directory)
+    if None != container:
+        # entry names, relative to the container
+        pyc_filepaths = [name for name in container.names() if name.endswith('.pyc') and (not path_filter or path_filter.accepts(name))]
+        os.makedirs(output_directory, exist_ok=True)
+    # `.pyc` deobfuscated in place by earlier versions of `process-pycfiles`, their originals are in `.pycbak`
+    pycbak_filepaths = []
+    for dname, dlist, flist in os.walk(args.TARGET) if None == container else []:
+        dname_abspath = os.path.abspath(dname)
+        if dname_abspath == cache_abspath or dname_abspath.startswith(cache_abspath + os.sep):
+            continue
+        for fname in flist:
+            filepath = os.path.join(dname, fname)
+            if fname.endswith('.pycbak'):
+                filepath = filepath[:-len('.pycbak')] + '.pyc'
+                if args.restore_pycbak:
+                    _log.info(f'..restoring `{filepath}` from `.pycbak`')
+                    os.replace(filepath + 'bak', filepath)
+                else:
+                    pycbak_filepaths.append(filepath)
+                    continue
+            elif not fname.endswith('.pyc'):
+                continue
+            if path_filter and not path_filter.accepts(os.path.relpath(filepath, args.TARGET)):
+                continue
+            pyc_filepaths.append(filepath)
+    pyc_filepaths = sorted(set(pyc_filepaths) - set(pycbak_filepaths))
+    if 0 < len(pycbak_filepaths):
+        _log.warn(f'Skipping `{len(pycbak_filepaths)}` pyc files which have a `.pycbak` (use `--restore-pycbak` to restore and process them.)')
+    jobs = args.jobs if 0 < args.jobs else (os.cpu_count() or 1)
+    _log.info(f'..processing {len(pyc_filepaths)} pyc files in `{args.TARGET}` using {jobs} worker(s)')
+    counts = { 'unchanged': 0, 'cached': 0, 'processed': 0, 'failed': 0 }
+    try:
+        # the tools are external processes, threads are enough to keep every core busy
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='pyc') as executor:
+            futures = {}
+            for filepath in pyc_filepaths:
+                if None == container:
+                    relpath = os.path.relpath(filepath, args.TARGET)
+                    read = functools.partial(_read_file, filepath)
+                    output_noext = os.path.splitext(filepath)[0]
+                else:
+                    relpath = filepath
+                    read = functools.partial(container.read, filepath)
+                    output_noext = os.path.join(output_directory, os.path.splitext(filepath)[0])
+                    filepath = None
+                futures[executor.submit(_process_file, read, filepath, output_noext, index.get(relpath), rules_digest, args.rules, cache_directory, args.force)] = relpath
+            for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                relpath = futures[future]
+                try:
+                    state, key = future.result()
+                except Exception as ex:
+                    state, key = 'failed', None
+                    _log.error(f'Failed to process `{relpath}`: {type(ex).__name__}: {ex}')
+                counts[state] += 1
+                if None != key:
+                    index[relpath] = key
+                else:
+                    index.pop(relpath, None)
+                _log.progress(f'({state}) {relpath}', i+1, len(futures))
+    finally:
+        _save_index(index, index_filepath)
+    elapsed_time = time.time() - start_time
+    _log.activity(f'Done. `{len(pyc_filepaths)}` pyc files took `{elapsed_time:.1f}` seconds, `{counts["processed"]}` processed, `{counts["cached"]}` from cache, `{counts["unchanged"]}` unchanged, `{counts["failed"]}` failed.')
+    return 0 == counts['failed']
+
+def _read_file(filepath:str):
+    with open(filepath, 'rb') as pyc_file:
+        return pyc_file.read()
+
+def _process_file(read, filepath:str, output_noext:str, indexed_key:str, rules_digest:bytes, rules_filepath:str, cache_directory:str, force:bool):
+    """
+    returns `(state, key)`, where state is one of `unchanged`, `cached`, `processed`, or `failed`.
+
+    `read()` returns the bytecode, `filepath` is `None` when it only exists in a container.
+    """
+    data = read()
+    digest = hashlib.sha256(rules_digest)
+    digest.update(data)
+    key = digest.hexdigest()
+    output_filepaths = [f'{output_noext}{output_ext}' for output_ext in _output_exts]
+    if not force and key == indexed_key and all(os.path.isfile(output_filepath) for output_filepath in output_filepaths):
+        return 'unchanged', key
+    cache_prefix = os.path.join(cache_directory, key[:2], key)
+    cache_filepaths = [f'{cache_prefix}{output_ext}' for output_ext in _output_exts]
+    state = 'cached'
+    if force or not all(os.path.isfile(cache_filepath) for cache_filepath in cache_filepaths):
+        tools_filepath = filepath
+        if None == filepath:
+            # the tools only read files, bytecode from a container is spilled next to the cache entry
+            os.makedirs(os.path.dirname(cache_prefix), exist_ok=True)
+            tools_filepath = f'{cache_prefix}.{os.getpid()}.{id(data)}.pyc'
+            with open(tools_filepath, 'wb') as pyc_file:
+                pyc_file.write(data)
+        try:
+            if not _run_tools(tools_filepath, rules_filepath, cache_prefix):
+                _log.warn(f'Failed to deobfuscate: {output_noext}.pyc')
+                return 'failed', None
+        finally:
+            if None == filepath:
+                os.remove(tools_filepath)
+        state = 'processed'
+    if None == filepath:
+        os.makedirs(os.path.dirname(output_noext), exist_ok=True)
+    for cache_filepath, output_filepath in zip(cache_filepaths, output_filepaths):
+        _link(cache_filepath, output_filepath)
+    return state, key
+
+def _run_tools(filepath:str, rules_filepath:str, cache_prefix:str):
+    os.makedirs(os.path.dirname(cache_prefix), exist_ok=True)
+    # written under temporary names and renamed into the cache once complete, an interrupted run leaves no partial results
+    tmp_prefix = f'{cache_prefix}.{os.getpid()}.{id(filepath)}.tmp'
+    tmp_pycdo = f'{tmp_prefix}.pycdo'
+    tmp_pyasm = f'{tmp_prefix}.pyasm'
+    tmp_py = f'{tmp_prefix}.py'
+    try:
+        subprocess.run([
+            _path_pycdo,
+            '--rules', rules_filepath,
+            filepath, tmp_pycdo,
+            '--force', '--silent'
+        ], stdin=subprocess.DEVNULL)
+        if not os.path.isfile(tmp_pycdo):
+            return False
+        # disassembly and decompilation both only read the deobfuscated file
+        with open(tmp_pyasm, 'wb') as pyasm_file, open(tmp_py, 'wb') as py_file:
+            pycdas = subprocess.Popen([_path_pycdas, tmp_pycdo], stdin=subprocess.DEVNULL, stdout=pyasm_file, stderr=pyasm_file)
+            pycdc = subprocess.Popen([_path_pycdc, tmp_pycdo], stdin=subprocess.DEVNULL, stdout=py_file, stderr=py_file)
+            pycdas.wait()
+            pycdc.wait()
+        for tmp_filepath, output_ext in ((tmp_pyasm, '.pyasm'), (tmp_py, '.py'), (tmp_pycdo, '.pycdo')):
+            os.replace(tmp_filepath, f'{cache_prefix}{output_ext}')
+        return True
+    finally:
+        for tmp_filepath in (tmp_pycdo, tmp_pyasm, tmp_py):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_filepath)
+
+def _link(cache_filepath:str, filepath:str):
+    if os.path.isfile(filepath) and os.path.samefile(cache_filepath, filepath):
+        return
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(filepath)
+    try:
+        os.link(cache_filepath, filepath)
+    except OSError:
+        # filesystems without hardlinks, or a cache on another device, get a copy
+        shutil.copyfile(cache_filepath, filepath)
+
+def _load_index(index_filepath:str):
+    if not os.path.isfile(index_filepath):
+        return {}
+    try:
+        with open(index_filepath, 'rt') as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError) as ex:
+        _log.warn(f'Ignoring unreadable index `{index_filepath}`: {ex}')
+        return {}
+
+def _save_index(index:dict, index_filepath:str):
+    tmp_filepath = f'{index_filepath}.tmp'
+    with open(tmp_filepath, 'wt') as index_file:
+        json.dump(index, index_file, indent='\t', sort_keys=True)
+    os.replace(tmp_filepath, index_filepath)
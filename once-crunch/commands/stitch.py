@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import os
+import time
+from ..util.logging import Logger
+from ..util import imgtools, tiling
+
+_log = Logger(__name__)
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'Stitch map tiles into a single map image.'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'stitch',
+        description=f'{help} Tiles are named `X_Y.png` with (0,0) at the bottom-left, and are composited one row-band at a time.',
+        help=help)
+    parser.add_argument('--tile-ext', default='.png', help='File extension of the tile images.')
+    parser.add_argument('--pyramid', choices=['xyz','dzi'], help='Also emit a downsampled tile pyramid, in XYZ (`z/x/y.png`) or Deep Zoom layout.')
+    parser.add_argument('--pyramid-dir', help='Output directory for the tile pyramid, defaults to OUTPUT without its extension.')
+    parser.add_argument('--pyramid-tile-size', type=int, default=256, help='Size of pyramid tiles, in pixels.')
+    parser.add_argument('--no-image', action='store_true', help='Only emit the tile pyramid, do not write OUTPUT.')
+    parser.add_argument('SOURCE', help='the directory containing map tiles')
+    parser.add_argument('OUTPUT', help='the output image file')
+
+def execute(args: argparse.Namespace):
+    if not os.path.isdir(args.SOURCE):
+        _log.error(f'Directory not found: {args.SOURCE}')
+        return False
+    tile_ext = args.tile_ext if args.tile_ext.startswith('.') else f'.{args.tile_ext}'
+    tiles = tiling.discover_tiles(args.SOURCE, tile_ext.lower())
+    if 0 == len(tiles):
+        _log.warn(f'No `X_Y{tile_ext}` tiles found in: {args.SOURCE}')
+        return False
+    noext, ext = os.path.splitext(args.OUTPUT)
+    output_filepath = None if args.no_image else args.OUTPUT
+    if None != output_filepath and os.path.isfile(output_filepath):
+        if not args.force:
+            _log.info(f'Output `{output_filepath}` exists, skipping (use `--force` to replace).')
+            output_filepath = None
+        else:
+            os.remove(output_filepath)
+    pyramid_directory = None
+    if None != args.pyramid:
+        pyramid_directory = args.pyramid_dir if None != args.pyramid_dir else noext
+    if None == output_filepath and None == pyramid_directory:
+        return True
+    if None != output_filepath and '.png' != ext.lower():
+        # only PNG is encoded as a stream, other formats are handed to ImageMagick whole
+        _log.warn(f'`{ext}` output is not streamed, falling back to `montage` for: {output_filepath}')
+        max_x = max(x for x, y in tiles) + 1
+        max_y = max(y for x, y in tiles) + 1
+        if len(tiles) < max_x * max_y:
+            _log.error(f'`montage` requires a complete {max_x}x{max_y} grid of tiles, {len(tiles)} were found.')
+            return False
+        ordered_images = [tiles[(x, y)] for y in range(max_y - 1, -1, -1) for x in range(max_x)]
+        imgtools.stitch(ordered_images, max_x, output_filepath, args.force)
+        output_filepath = None
+        if None == pyramid_directory:
+            return True
+    start_time = time.time()
+    _log.info(f'..stitching {len(tiles)} tiles from `{args.SOURCE}`')
+    width, height = tiling.stitch_tiles(
+        tiles,
+        output_filepath,
+        pyramid_directory,
+        args.pyramid,
+        args.pyramid_tile_size,
+        lambda value, max_value: _log.progress('(stitch)', value, max_value))
+    elapsed_time = time.time() - start_time
+    _log.activity(f'Done. `{width}x{height}` took `{elapsed_time:.1f}` seconds.')
+    return True
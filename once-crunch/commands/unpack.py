@@ -2,10 +2,18 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import concurrent.futures
+import copy
 import importlib
 import json
 import os
+import time
+from ..formats.NXPKFormatHandler import verify_archives
+from ..util import metrics
+from ..util.containers import container_formats
+from ..util.filtering import PathFilter
 from ..util.logging import Logger
+from ..util.metrics import Metrics
 from ..formats import *
 
 _log = Logger(__name__)
@@ -37,26 +45,95 @@ def configure_help(subparsers: argparse._SubParsersAction):
                 continue
             _formatters[formatter_class.__format_id__] = formatter_class
     parser.add_argument('--format', required=True, choices=_formatters, dest='fileformat')
-    parser.add_argument('SOURCE', help='the input file')
+    parser.add_argument('--mmap', action='store_true', help='Memory-map the input file and decode entries without intermediate copies.')
+    parser.add_argument('--dedup', action='store_true', help='Extract and post-process identical payloads once into a content-addressed store under DESTINATION, named outputs become hardlinks to it.')
+    parser.add_argument('--stream-threshold', type=int, default=32 * 1024 * 1024, help='Entries larger than this many bytes are extracted in fixed-size chunks to bound memory use (stored and zlib entries only).')
+    parser.add_argument('--read-window', type=int, default=16 * 1024 * 1024, help='Payloads are read in data offset order, neighbouring payloads are coalesced into single reads of up to this many bytes. `0` reads every payload on its own.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes, `0` uses all cores. Workers extract entries of SOURCE, or whole archives when SOURCE is a directory.')
+    parser.add_argument('--output-format', choices=['dir'] + list(container_formats), default='dir', help='Write entries as loose files (dir), or into one tar/zip/sqlite container per archive, named after the archive and keyed by entry name. Containers are rebuilt on every run, and do not support image post-processing or `--dedup`.')
+    parser.add_argument('--write-threads', type=int, default=2, help='Number of threads writing extracted files, `0` writes on the extracting thread. Worker processes (`--jobs`) always write on their own thread.')
+    parser.add_argument('--atomic-writes', action='store_true', help='Write each file under a temporary name and rename it into place, an interrupted run never leaves truncated files.')
+    parser.add_argument('--img-jobs', type=int, default=1, help='Number of concurrent image post-processing workers (pvr2png/magick), `0` uses all cores.')
+    parser.add_argument('--verify', action='store_true', help='Check every entry of every archive against its CRCs before unpacking, nothing is unpacked if any entry mismatches (nxpk only).')
+    parser.add_argument('--metrics-out', help='Write per-archive, per-stage timing and byte counts to this file, as CSV when it ends in `.csv`, otherwise JSON.')
+    parser.add_argument('--profile', choices=metrics.stage_names, help='Capture a cProfile of every run of this stage.')
+    parser.add_argument('--profile-memory', action='store_true', help='Capture peak traced memory (tracemalloc) of the `--profile` stage instead of a cProfile, reported with the metrics.')
+    parser.add_argument('--profile-out', help='The cProfile output file, defaults to `once-crunch-<stage>.prof`.')
+    parser.add_argument('SOURCE', help='the input file, or a directory to unpack every archive beneath')
     parser.add_argument('DESTINATION', help='the output directory')
 
 def execute(args: argparse.Namespace):
-    _log.info(f'..unpacking: {args.SOURCE}')
-    # check SOURCE exists
-    if not os.path.isfile(args.SOURCE):
+    if not args.fileformat in _formatters:
+        _log.error(f'Format not supported: {args.fileformat}')
+        return False
+    if 'dir' != args.output_format and (None != args.img_format or args.recolor or args.dedup):
+        _log.error(f'`--output-format {args.output_format}` does not support `--img-format`, `--recolor`, or `--dedup`.')
+        return False
+    # a directory SOURCE unpacks every compatible archive beneath it
+    if not os.path.isdir(args.SOURCE) and not os.path.isfile(args.SOURCE):
         _log.error(f'File not found: {args.SOURCE}')
         return False
+    if os.path.isfile(args.DESTINATION) and not args.force:
+        _log.error(f'Destination is not a directory, aborting.')
+        return False
+    # nothing is written, not even DESTINATION, until verification passes
+    if getattr(args, 'verify', False) and not verify_source(args):
+        return False
     # check DESTINATION exists, and is not a file, create directory if missing
     if os.path.isfile(args.DESTINATION):
-        if not args.force:
-            _log.error(f'Destination is not a directory, aborting.')
-            return False
-        else:
-            os.remove(args.DESTINATION)
+        os.remove(args.DESTINATION)
     os.makedirs(args.DESTINATION, exist_ok=True)
-    if not args.fileformat in _formatters:
-        _log.error(f'Format not supported: {args.fileformat}')
+    reports = None
+    if _collect_metrics(args):
+        reports = {}
+        if None != args.profile and None == args.profile_out:
+            args.profile_out = f'once-crunch-{args.profile}.prof'
+        metrics.configure_profiling(args.profile, args.profile_memory, args.profile_out)
+    try:
+        if os.path.isdir(args.SOURCE):
+            return unpack_directory(args, reports)
+        return unpack_file(args, reports)
+    finally:
+        if None != reports:
+            _report_metrics(args, reports)
+
+def verify_source(args: argparse.Namespace):
+    """
+    verifies the archives of SOURCE, see `verify`, so a corrupt install is found before hours of
+    extraction rather than after.
+    """
+    # imported here, `verify` reuses `discover_archives()` of this module
+    from .verify import report
+    if 'nxpk' != args.fileformat:
+        _log.error(f'`--verify` does not support format: {args.fileformat}')
+        return False
+    path_filter = PathFilter.from_args(args)
+    if os.path.isdir(args.SOURCE):
+        filepaths = sorted(filepath for filepath, size in discover_archives(args.SOURCE, _formatters[args.fileformat], path_filter))
+    else:
+        filepaths = [args.SOURCE]
+    jobs = args.jobs if 0 < args.jobs else (os.cpu_count() or 1)
+    _log.info(f'..verifying {len(filepaths)} archive(s) in `{args.SOURCE}` using {jobs} worker(s)')
+    results, seconds = verify_archives(filepaths, jobs, False, args.mmap, path_filter)
+    if not report(results, seconds):
+        _log.error('Verification failed, nothing was unpacked.')
         return False
+    return True
+
+def _collect_metrics(args: argparse.Namespace):
+    return None != getattr(args, 'metrics_out', None) or None != getattr(args, 'profile', None)
+
+def _report_metrics(args: argparse.Namespace, reports:dict):
+    if None != args.metrics_out:
+        total = metrics.save_report(args.metrics_out, reports)
+    else:
+        total = metrics.totals(reports)
+    metrics.log_summary(total)
+    if None != args.profile and not args.profile_memory:
+        metrics.merge_profiles(args.profile_out)
+
+def unpack_file(args: argparse.Namespace, reports:dict = None):
+    _log.info(f'..unpacking: {args.SOURCE}')
     # open input file for processing
     with open(args.SOURCE, 'rb') as source_file:
         # check formatter is compatible
@@ -67,10 +144,96 @@ def execute(args: argparse.Namespace):
             return False
         header_data = formatter.extract_header()
         ## write header chunk to disk, skipping if already exists
-        header_filename = f'__{args.fileformat}_header.json'
-        header_filepath = os.path.join(args.DESTINATION, header_filename)
-        if os.path.exists(header_filepath) and args.force:
-            os.remove(header_filepath)
-        if not os.path.exists(header_filepath):
-            formatter.save_json(header_data, header_filepath, args.force)
-        return formatter.decode(args)
+        header_filepath = formatter.metadata_filepath(args, 'header.json')
+        # packed outputs carry their own copy, see `NXPKFormatHandler.decode()`
+        if 'dir' == getattr(args, 'output_format', 'dir'):
+            if args.force or not os.path.exists(header_filepath):
+                formatter.save_json(header_data, header_filepath, True)
+        if args.mmap:
+            formatter.map_file()
+        if None != reports:
+            formatter._metrics = Metrics()
+        try:
+            with metrics.stage(formatter._metrics, 'unpack'):
+                return formatter.decode(args)
+        finally:
+            formatter.unmap_file()
+            if None != reports:
+                reports[args.SOURCE] = formatter._metrics.snapshot()
+
+def unpack_directory(args: argparse.Namespace, reports:dict = None):
+    start_time = time.time()
+    archives = discover_archives(args.SOURCE, _formatters[args.fileformat], PathFilter.from_args(args))
+    if 0 == len(archives):
+        _log.warn(f'No `{args.fileformat}` archives found in: {args.SOURCE}')
+        return False
+    # largest first, so the long tail is made of small archives
+    archives.sort(key=lambda e: e[1], reverse=True)
+    total_size = sum(size for filepath, size in archives)
+    jobs = args.jobs if 0 < args.jobs else (os.cpu_count() or 1)
+    _log.info(f'..unpacking {len(archives)} archives ({total_size} bytes) from `{args.SOURCE}` using {jobs} worker(s)')
+    results = []
+    if 1 == jobs:
+        for filepath, size in archives:
+            results.append(_unpack_archive(args, filepath, size, None != reports))
+            _log.progress(f'(unpacked) {filepath}', len(results), len(archives))
+    else:
+        # archives are scheduled across one pool, each archive is unpacked serially by its worker
+        profile = None if None == metrics._profiler else (metrics._profiler.stage, metrics._profiler.memory, metrics._profiler.filepath)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_unpack_worker_init, initargs=(profile,)) as executor:
+            futures = [executor.submit(_unpack_archive, args, filepath, size, None != reports) for filepath, size in archives]
+            for future in concurrent.futures.as_completed(futures):
+                results.append(future.result())
+                filepath, size, elapsed, error, report = results[-1]
+                _log.progress(f'(unpacked) {filepath}', len(results), len(archives))
+    elapsed_time = time.time() - start_time
+    failures = [result for result in results if None != result[3]]
+    for filepath, size, elapsed, error, report in failures:
+        _log.error(f'Failed to unpack `{filepath}`: {error}')
+    for filepath, size, elapsed, error, report in sorted(results, key=lambda e: e[2], reverse=True):
+        _log.debug('`%s` (%d bytes) took `%.1f` seconds.', filepath, size, elapsed)
+        if None != reports:
+            report = report if None != report else { 'seconds': elapsed, 'stages': {}, 'counts': {} }
+            if None != error:
+                report['counts']['failed'] = report['counts'].get('failed', 0) + 1
+                report['error'] = error
+            reports[filepath] = report
+    busy_time = sum(result[2] for result in results)
+    _log.activity(f'Done. `{len(results)}` archives ({total_size} bytes) took `{elapsed_time:.1f}` seconds, `{busy_time:.1f}` seconds of worker time, `{len(failures)}` failed.')
+    return 0 == len(failures)
+
+def discover_archives(path:str, formatter_class:type, path_filter:PathFilter = None):
+    archives = []
+    for dname, dlist, flist in os.walk(path):
+        for fname in flist:
+            filepath = os.path.join(dname, fname)
+            if not os.path.isfile(filepath):
+                continue
+            # excluded archives are not opened at all
+            if None != path_filter and path_filter.excludes(filepath):
+                continue
+            with open(filepath, 'rb') as file:
+                if not formatter_class(file, 0).is_compatible():
+                    continue
+            archives.append((filepath, os.path.getsize(filepath)))
+    return archives
+
+def _unpack_worker_init(profile:tuple = None):
+    # only the orchestrator reports progress
+    _log.set_progress(False)
+    if None != profile:
+        metrics.configure_profiling(*profile, worker=True)
+
+def _unpack_archive(args: argparse.Namespace, filepath:str, size:int, collect_metrics:bool = False):
+    start_time = time.time()
+    archive_args = copy.copy(args)
+    archive_args.SOURCE = filepath
+    archive_args.archive_name = os.path.relpath(filepath, args.SOURCE)
+    # parallelism is across archives, not within them
+    archive_args.jobs = 1
+    reports = {} if collect_metrics else None
+    try:
+        error = None if False != unpack_file(archive_args, reports) else 'incompatible or invalid archive'
+    except Exception as ex:
+        error = f'{type(ex).__name__}: {ex}'
+    return filepath, size, time.time() - start_time, error, None if None == reports else reports.get(filepath)
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+
+import argparse
+import json
+import os
+from ..formats.NXPKFormatHandler import NXPKFormatHandler, verify_archives
+from ..util.filtering import PathFilter
+from ..util.logging import Logger
+from .unpack import discover_archives
+
+_log = Logger(__name__)
+
+def configure_help(subparsers: argparse._SubParsersAction):
+    help = 'Verify archive entries against their CRCs.'
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        'verify',
+        description=f'{help} Every entry is read (in large sequential batches) and checked against the compressed CRC of the entry table, then decompressed and checked against its uncompressed size and CRC. Nothing is written.',
+        help=help)
+    parser.add_argument('--quick', action='store_true', help='Only check compressed CRCs, entries are not decompressed.')
+    parser.add_argument('--mmap', action='store_true', help='Memory-map archives rather than reading them.')
+    parser.add_argument('--report', help='Write per-archive results, and every mismatch, to this JSON file.')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='Number of worker processes, `0` (the default) uses all cores.')
+    parser.add_argument('SOURCE', help='an `.npk` file, or a directory to verify every archive beneath')
+
+def execute(args: argparse.Namespace):
+    if not os.path.isdir(args.SOURCE) and not os.path.isfile(args.SOURCE):
+        _log.error(f'File not found: {args.SOURCE}')
+        return False
+    path_filter = PathFilter.from_args(args)
+    if os.path.isdir(args.SOURCE):
+        filepaths = sorted(filepath for filepath, size in discover_archives(args.SOURCE, NXPKFormatHandler, path_filter))
+    else:
+        filepaths = [args.SOURCE]
+    jobs = args.jobs if 0 < args.jobs else (os.cpu_count() or 1)
+    _log.info(f'..verifying {len(filepaths)} archive(s) in `{args.SOURCE}` using {jobs} worker(s)')
+    results, seconds = verify_archives(filepaths, jobs, args.quick, args.mmap, path_filter)
+    return report(results, seconds, args.report)
+
+def report(results:dict, seconds:float, report_filepath:str = None):
+    """logs a summary of `verify_archives()` results (optionally saving them), returns `True` when every entry matched"""
+    entries = sum(result['entries'] for result in results.values())
+    size = sum(result['bytes'] for result in results.values())
+    failed = [filepath for filepath, result in results.items() if 0 < len(result['mismatches']) or None != result['error']]
+    mismatches = sum(len(results[filepath]['mismatches']) for filepath in failed)
+    if None != report_filepath:
+        os.makedirs(os.path.dirname(os.path.abspath(report_filepath)), exist_ok=True)
+        with open(report_filepath, 'wt') as json_file:
+            json.dump({
+                    'seconds': seconds,
+                    'archives': {
+                        filepath: {
+                            'entries': result['entries'],
+                            'bytes': result['bytes'],
+                            'error': result['error'],
+                            'mismatches': [{ 'index': i, 'name': name, 'problems': problems } for i, name, problems in result['mismatches']]
+                        } for filepath, result in results.items()
+                    }
+                },
+                json_file,
+                indent='\t')
+    rate = (size / (1024 * 1024)) / seconds if 0 < seconds else 0.0
+    _log.activity(f'Done. `{entries}` entries ({size} bytes) of `{len(results)}` archives verified in `{seconds:.1f}` seconds at `{rate:.1f}` MB/s, `{mismatches}` mismatched.')
+    if 0 < len(failed):
+        _log.info(f'\nFailed Archives: {len(failed)}')
+        for filepath in failed:
+            result = results[filepath]
+            _log.info(f'\t{filepath} ({result["error"] if None != result["error"] else str(len(result["mismatches"])) + " entries"})')
+    return 0 == len(failed)
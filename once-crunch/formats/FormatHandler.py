@@ -3,6 +3,7 @@
 import argparse
 import io
 import json
+import mmap
 import os
 import shutil
 
@@ -18,10 +19,15 @@ class FormatHandler:
     _file:io.IOBase
     """the offset into `_file` where formatted data begins"""
     _offset:int
+    """optional read-only mapping of `_file`, when set `read_at()` returns zero-copy views"""
+    _map:mmap.mmap
+    """optional packed output (see `util/containers.py`), when set `save_json()` and `save_binary()` write into it"""
+    _sink = None
 
-    def __init__(self, file:io.IOBase, offset:int):
+    def __init__(self, file:io.IOBase, offset:int, map:mmap.mmap = None):
         self._file = file
         self._offset = offset
+        self._map = map
 
     def check_signature(self, buf:bytes):
         raise NotImplementedError
@@ -35,12 +41,47 @@ class FormatHandler:
     def encode(self, input, dest:str):
         raise NotImplementedError
 
+    def map_file(self):
+        if None == self._map:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def unmap_file(self):
+        if None == self._map:
+            return
+        try:
+            self._map.close()
+        except BufferError:
+            # a view is still alive somewhere, the mapping is released once it is collected
+            pass
+        self._map = None
+
+    def read_at(self, offset:int, size:int):
+        if None != self._map:
+            return memoryview(self._map)[offset:offset+size]
+        self._file.seek(offset)
+        return self._file.read(size)
+
     def is_compatible(self):
         self._file.seek(self._offset)
         buf = self._file.read(4)
         return self.check_signature(buf)
+
+    def metadata_filepath(self, args: argparse.Namespace, name:str):
+        """
+        returns the path of the `name` metadata file (ie. `header.json`) of the archive being unpacked. a
+        single archive writes `__nxpk_header.json` to DESTINATION, archives beneath a directory SOURCE are
+        kept apart beneath one directory per format, ie. `__nxpk/sub/a.npk.header.json`.
+        """
+        archive_name = getattr(args, 'archive_name', None)
+        if None == archive_name:
+            return os.path.join(args.DESTINATION, f'__{self.__format_id__}_{name}')
+        return os.path.join(args.DESTINATION, f'__{self.__format_id__}', f'{archive_name}.{name}')
     
     def save_json(self, data:dict, dest:str, force:bool = False):
+        if None != self._sink:
+            self._sink.write(json.dumps(data, indent='\t').encode('utf-8'), dest, True)
+            return
         dest = os.path.abspath(dest)
         if os.path.isdir(dest):
             if force:
@@ -54,7 +95,14 @@ class FormatHandler:
         with open(dest, 'wt') as json_file:
             json_file.write(json_data)
         
-    def save_binary(self, data:bytes, dest:str, force:bool = False):
+    def save_binary(self, data:bytes|memoryview, dest:str, force:bool = False):
+        if None != self._sink:
+            self._sink.write(data, dest, True)
+            return
+        with self.open_binary(dest, force) as binary_file:
+            binary_file.write(data)
+
+    def open_binary(self, dest:str, force:bool = False):
         dest = os.path.abspath(dest)
         if os.path.isdir(dest):
             if force:
@@ -64,5 +112,4 @@ class FormatHandler:
         elif os.path.isfile(dest) and not force:
             raise Exception(f'File exists {dest}.')
         os.makedirs(os.path.dirname(dest), exist_ok=True)
-        with open(dest, 'wb') as binary_file:
-            binary_file.write(data)
+        return open(dest, 'wb')
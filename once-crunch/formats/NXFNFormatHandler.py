@@ -21,27 +21,34 @@ class NXFNFormatHandler(FormatHandler):
         # read nxfn header
         self._header, header_size = self.extract_header()
         # if file exists skip, unless force
-        header_filepath = os.path.join(args.DESTINATION, f'__nxfn_header.json')
-        if os.path.exists(header_filepath) and args.force:
-            os.remove(header_filepath)
-        if not os.path.exists(header_filepath):
+        header_filepath = self.metadata_filepath(args, 'header.json')
+        if args.force or not os.path.exists(header_filepath):
             self.save_json(
                 self._header,
                 header_filepath,
-                args.force)
+                True)
         # read nxfn data
         self._file.seek(self._offset + header_size)
         nxfn_data:bytes = self._file.read(self._header['data_size'])
         # if file exists skip, unless force
-        data_filepath = os.path.join(args.DESTINATION, f'__nxfn_data.bin')
-        if os.path.exists(data_filepath) and args.force:
-            os.remove(data_filepath)
-        if not os.path.exists(data_filepath):
+        data_filepath = self.metadata_filepath(args, 'data.bin')
+        if args.force or not os.path.exists(data_filepath):
             self.save_binary(
                 nxfn_data,
                 data_filepath,
-                args.force)
+                True)
         return nxfn_data.split(b'\0')
+
+    def read_data(self, header_size:int = None):
+        if None == header_size:
+            self._header, header_size = self.extract_header()
+        return bytes(self.read_at(self._offset + header_size, self._header['data_size']))
+
+    def read_names(self):
+        """
+        returns the entry names without writing anything to disk, in table order.
+        """
+        return [name.replace(b'\\', b'/').decode('utf-8') for name in self.read_data().split(b'\0')]
     
     def encode(self, input, dest:str):
         raise NotImplementedError
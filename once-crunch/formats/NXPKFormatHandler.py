@@ -1,21 +1,37 @@
 # SPDX-FileCopyrightText: © 2024 Shaun Wilson
 # SPDX-License-Identifier: MIT
 import argparse
+import array
+import concurrent.futures
+import contextlib
 import io
+import json
 import lz4.block
 import os
+import shutil
 import struct
+import sys
 import time
 import zlib
 import zstd
 from .FormatHandler import FormatHandler
 from .NXFNFormatHandler import NXFNFormatHandler
+from ..util import metrics
 from ..util.logging import Logger
-from ..util.imgtools import pvr2png, magick
+from ..util.filtering import PathFilter
+from ..util.containers import container_formats, open_sink
+from ..util.metrics import Metrics
+from ..util.outputwriter import OutputWriter
+from ..util.imgtools import ImagePipeline, pvr2png, magick
 
 _log = Logger(__name__)
 
-_args_exclude = []
+_stream_chunk_size = 1024 * 1024
+# gaps between payloads up to this size are read through rather than starting a new read window,
+# on a spinning disk or network volume a seek costs about as much as reading this many bytes
+_read_window_gap = 1024 * 1024
+# display names of the `compression_type` of table entries
+compression_names = { 0: 'none', 1: 'zlib', 2: 'lz4', 3: 'zstd' }
 _image_file_types = [
     '.pvr',
     '.png',
@@ -27,55 +43,224 @@ _image_file_types = [
     '.jpeg'
 ]
 
-def _is_excluded(args: argparse.Namespace, target:str):
-    global _args_exclude
-    if 0 == len(_args_exclude) and None != args.exclude:
-        _args_exclude = args.exclude.split(',')
-    for exclusion in _args_exclude:
-        if 0 <= target.find(exclusion):
-            _log.debug(f'`{target}` is excluded by `{exclusion}`.')
-            return True
-    return False
+def _content_key(entry_table:'NXPKEntryTable', index:int):
+    return f'{entry_table.uncompressed_data_crc[index]:08x}{entry_table.uncompressed_data_size[index]:08x}'
+
+def _cas_link(cas_filepath:str, filepath:str):
+    """links a content-addressed file to the named path of an entry, keeping the extension of the stored file"""
+    noext, ext = os.path.splitext(filepath)
+    cas_noext, cas_ext = os.path.splitext(cas_filepath)
+    link_filepath = f'{noext}{cas_ext}'
+    if os.path.isfile(link_filepath) and os.path.samefile(cas_filepath, link_filepath):
+        return link_filepath
+    os.makedirs(os.path.dirname(link_filepath), exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(link_filepath)
+    try:
+        os.link(cas_filepath, link_filepath)
+    except OSError:
+        # filesystems without hardlinks, or a store on another device, get a copy
+        shutil.copyfile(cas_filepath, link_filepath)
+    return link_filepath
+
+def _manifest_matches(record:dict, entry_table:'NXPKEntryTable', index:int):
+    return record.get('checksum') == entry_table.checksum[index] \
+        and record.get('data_crc') == entry_table.data_crc[index] \
+        and record.get('uncompressed_data_crc') == entry_table.uncompressed_data_crc[index]
+
+def _schedule_reads(extents:list, window_size:int, alone = None):
+    """
+    groups payloads, `(offset, size)` per entry, into read windows of up to `window_size` bytes and
+    returns them as `(offset, size, indices)` in offset order. a payload larger than a window (or for
+    which `alone(index)` is true) gets a window of size `0`, it is read by itself.
+    """
+    windows = []
+    indices = []
+    window_offset = window_end = 0
+    for k in sorted(range(len(extents)), key=lambda k: extents[k][0]):
+        offset, size = extents[k]
+        if size > window_size or (None != alone and alone(k)):
+            windows.append((offset, 0, [k]))
+            continue
+        if 0 < len(indices) and (offset + size - window_offset > window_size or offset > window_end + _read_window_gap):
+            windows.append((window_offset, window_end - window_offset, indices))
+            indices = []
+        if 0 == len(indices):
+            window_offset = window_end = offset
+        window_end = max(window_end, offset + size)
+        indices.append(k)
+    if 0 < len(indices):
+        windows.append((window_offset, window_end - window_offset, indices))
+    return windows
+
+def _reorder(order:list, results):
+    """yields `results`, produced for tasks in `order`, in task order. results arriving early are held back."""
+    pending = {}
+    next_task = 0
+    for k, result in zip(order, results):
+        pending[k] = result
+        while next_task in pending:
+            yield pending.pop(next_task)
+            next_task += 1
+
+def _fadvise(file:io.IOBase, offset:int, size:int, advice:str):
+    # hints only, and not every platform has them
+    if not hasattr(os, 'posix_fadvise') or not hasattr(os, advice):
+        return
+    with contextlib.suppress(OSError):
+        os.posix_fadvise(file.fileno(), offset, size, getattr(os, advice))
+
+def _resolve_jobs(args: argparse.Namespace, name:str = 'jobs'):
+    jobs = getattr(args, name, 1)
+    if None == jobs:
+        return 1
+    if 0 >= jobs:
+        return os.cpu_count() or 1
+    return jobs
 
 def _is_imagefile(path:str):
     global _image_file_types
     noext, ext = os.path.splitext(path)
     return ext in _image_file_types
 
+def _converted_name(args: argparse.Namespace, filename:str):
+    """the name post-processing will give an entry, ie. `foo.pvr` becomes `foo.png` with `--img-format png`"""
+    if None == args.img_format or not _is_imagefile(filename):
+        return filename
+    noext, ext = os.path.splitext(filename)
+    return f'{noext}.{args.img_format}'
+
+class NXPKEntryTable:
+    """
+    columnar view of an NXPK entry table, decoded in bulk.
+
+    every column is an `array.array` indexed by table entry index, so the
+    whole table costs one read and a handful of slicing operations rather
+    than one seek/read/unpack per entry.
+    """
+    entry_size:int = 28
+    checksum:array.array
+    data_offset:array.array
+    data_size:array.array
+    uncompressed_data_size:array.array
+    data_crc:array.array
+    uncompressed_data_crc:array.array
+    compression_type:array.array
+    encryption_type:array.array
+
+    def __init__(self, buf:bytes):
+        count = len(buf) // self.entry_size
+        # each entry is `<IIIIIIHH`, which is seven 32-bit words where the
+        # last word packs `compression_type` (lo) and `encryption_type` (hi)
+        words = array.array('I')
+        words.frombytes(memoryview(buf)[:count * self.entry_size])
+        if 'big' == sys.byteorder:
+            words.byteswap()
+        self.checksum = words[0::7]
+        self.data_offset = words[1::7]
+        self.data_size = words[2::7]
+        self.uncompressed_data_size = words[3::7]
+        self.data_crc = words[4::7]
+        self.uncompressed_data_crc = words[5::7]
+        types = array.array('H')
+        types.frombytes(words[6::7].tobytes())
+        lo, hi = (1, 0) if 'big' == sys.byteorder else (0, 1)
+        self.compression_type = types[lo::2]
+        self.encryption_type = types[hi::2]
+
+    def __len__(self):
+        return len(self.checksum)
+
+    def __getitem__(self, index:int):
+        return {
+             'checksum': self.checksum[index],
+             'data_offset': self.data_offset[index],
+             'data_size': self.data_size[index],
+             'uncompressed_data_size': self.uncompressed_data_size[index],
+             'data_crc': self.data_crc[index],
+             'uncompressed_data_crc': self.uncompressed_data_crc[index],
+             'compression_type': self.compression_type[index],
+             'encryption_type': self.encryption_type[index]
+        }
+
 class NXPKFormatHandler(FormatHandler):
     __format_id__ = 'nxpk'
     __format_desc__ = 'NeoX Package (.npk) Data Format'
     _header:dict
     _table_entry_size:int
     _table_size:int
+    """the compiled `--include`/`--exclude` filter, see `decode()`"""
+    _filter:PathFilter = PathFilter()
+    """entries larger than this (compressed or not) are extracted in chunks, see `extract_entry_streaming()`"""
+    _stream_threshold:int = 32 * 1024 * 1024
+    """payloads are read in offset order, coalesced into windows of up to this many bytes, see `_extract_scheduled()`"""
+    _read_window_size:int = 16 * 1024 * 1024
+    """per-stage timing and counters, only collected when set by the caller (see `unpack --metrics-out`)"""
+    _metrics:Metrics = None
+    """writes extracted entries during `decode()`, when `None` entries are written with `save_binary()`"""
+    _writer:OutputWriter = None
 
     def check_signature(self, buf:bytes):
         return buf.startswith(b'NXPK')
     
     def decode(self, args: argparse.Namespace):
         start_time = time.time()
-        if _is_excluded(args, args.SOURCE):
+        self._filter = PathFilter.from_args(args)
+        if self._filter.excludes(args.SOURCE):
             return
         source_filename = args.SOURCE.replace(f'{os.path.dirname(args.SOURCE)}{os.path.sep}', '')
+        # archives beneath a directory SOURCE are identified by their relative path, basenames may repeat
+        archive_name = getattr(args, 'archive_name', source_filename)
         dest = args.DESTINATION
         self._header = self.extract_header()
         self._table_entry_size = 28
         self._table_size = self._table_entry_size * self._header['table_entry_count']
-        _log.debug({
+        _log.debug(lambda: {
             'header': self._header,
             'table_entry_size': self._table_entry_size,
             'table_size': self._table_size
         })
-        entry_table = {}
-        entry_index = 0
-        progress_msg = f'(indexing) {source_filename}'
-        for entry_offset in range(self._header['table_offset'], self._table_size + self._header['table_offset'], self._table_entry_size):
-            table_entry = self.read_entry(entry_offset)
-            entry_table[entry_index] = table_entry
-            entry_index += 1
-            _log.progress(progress_msg, entry_index, self._header['table_entry_count'], False)
-        nxfn = self.decode_nxfn(self._header['table_offset'] + self._table_size, args)
+        # packed output formats write one container per archive, rebuilt on every run
+        output_format = getattr(args, 'output_format', 'dir')
+        packed = 'dir' != output_format
+        if packed:
+            container_filepath = os.path.join(args.DESTINATION, f'{archive_name}{container_formats[output_format]}')
+            if not args.force and os.path.exists(container_filepath):
+                _log.info(f'`{container_filepath}` exists, skipping (use `--force` to rebuild it.)')
+                return
+            self._sink = open_sink(output_format, container_filepath, args.DESTINATION, self._metrics)
+            self.save_json(self._header, self.metadata_filepath(args, 'header.json'), True)
+        _log.activity(f'(indexing) {source_filename}')
+        with metrics.stage(self._metrics, 'index', self._table_size):
+            entry_table = self.read_table()
+            nxfn = self.decode_nxfn(self._header['table_offset'] + self._table_size, args)
+        # entries whose table values match the manifest of a previous run are left untouched
+        manifest_filepath = self.metadata_filepath(args, 'manifest.json')
+        manifest = {} if args.force or packed else self.load_manifest(manifest_filepath)
+        manifest_options = {
+            'img_format': args.img_format,
+            'recolor': True == args.recolor
+        }
+        # post-processing options changed, derived files of unchanged entries may need converting
+        options_changed = manifest.get('options', manifest_options) != manifest_options
+        manifest_entries = manifest.get('entries', {})
+        # with `--dedup` each unique payload is extracted and post-processed once into a
+        # content-addressed store, and named outputs are linked to it
+        dedup = True == getattr(args, 'dedup', False)
+        cas_planned = set()
+        cas_processed = {}
+        # existence checks during planning are answered from one listing per directory
+        if packed:
+            self._writer = self._sink
+        else:
+            self._writer = OutputWriter(
+                getattr(args, 'write_threads', 2),
+                True == getattr(args, 'atomic_writes', False),
+                metrics=self._metrics)
         # TODO: add support for "map" files
+        # plan the unpack in table order, entries which need extracting are queued as tasks
+        plan = []
+        tasks = []
         for i in range(len(entry_table)):
             filename = None
             if nxfn != None:
@@ -88,76 +273,405 @@ class NXPKFormatHandler(FormatHandler):
                 filename = os.path.join(
                     source_filename, 
                     f'{i}')
-            filepath = os.path.join(args.DESTINATION, filename)
-            if _is_excluded(args, filepath):
+            # filtered by name before anything is read, rejected entries are never seeked, read or decompressed
+            if self._filter and not self._filter.accepts(filename, _converted_name(args, filename)):
+                if None != self._metrics:
+                    self._metrics.count('excluded')
                 continue
+            filepath = os.path.join(args.DESTINATION, filename)
             short_filename = filename.replace(f'{os.path.dirname(filename)}/', '')
-            if not args.force and os.path.exists(filepath):
-                # if file exists (and not args.force) skip unpacking (would-be file will still be post-processed)
-                _log.progress(f'(cached) {short_filename}', i+1, self._header["table_entry_count"], False)
-                pass
+            force = args.force
+            record = manifest_entries.get(filename)
+            if None == record:
+                # no manifest record, if file exists (and not args.force) skip unpacking (would-be file will still be post-processed)
+                state = 'cached' if not force and self._writer.exists(filepath) else 'extract'
+            elif _manifest_matches(record, entry_table, i) and all(self._writer.exists(os.path.join(args.DESTINATION, output)) for output in record['outputs']):
+                state = 'cached' if options_changed else 'unchanged'
             else:
-                _log.progress(f'(extract) {short_filename}', i+1, self._header["table_entry_count"])
-                entry = entry_table[i]
-                self._file.seek(entry['data_offset'])
-                data = self._file.read(entry['data_size'])
-                match (entry['encryption_type']):
+                # the entry changed since it was last unpacked, replace it and everything derived from it
+                state = 'extract'
+                force = True
+            cas_filepath = None
+            extract_filepath = filepath
+            if dedup and 'unchanged' != state:
+                key = _content_key(entry_table, i)
+                noext, ext = os.path.splitext(filename)
+                # the source extension is part of the name, files derived from one payload must not collide with another
+                cas_filepath = os.path.join(args.DESTINATION, '__cas', key[:2], f'{key}{ext.replace(".", "-")}{ext}')
+                if cas_filepath in cas_planned or (not args.force and self._writer.exists(cas_filepath)):
+                    state = 'link'
+                else:
+                    # written under a temporary name, archives unpacked concurrently may share payloads
+                    state = 'extract'
+                    extract_filepath = f'{cas_filepath}.{os.getpid()}.tmp'
+                cas_planned.add(cas_filepath)
+            if 'extract' == state:
+                match (entry_table.encryption_type[i]):
                     case 0: # none
                         pass
                     case _:
-                        raise NotImplementedError(f'nxpk encryption type: {entry["encryption_type"]}')
-                match (entry['compression_type']):
-                    case 0: # none
-                        pass
-                    case 1: # zlib
-                        data = zlib.decompress(data)
-                    case 2: # lz4
-                        data = lz4.block.decompress(data, uncompressed_size=entry['uncompressed_data_size'])
-                    case 3: # zstd
-                        data = zstd.decompress(data)
+                        raise NotImplementedError(f'nxpk encryption type: {entry_table.encryption_type[i]}')
+                tasks.append((
+                    entry_table.data_offset[i],
+                    entry_table.data_size[i],
+                    entry_table.compression_type[i],
+                    entry_table.uncompressed_data_size[i],
+                    extract_filepath,
+                    force))
+            plan.append((i, filename, filepath, short_filename, state, force, cas_filepath))
+        # the whole output tree is created up front, writers never stat or create directories
+        self._writer.prepare(task[4] for task in tasks)
+        # extract, either inline or fanned out to worker processes which open the archive themselves,
+        # results are consumed in table order so output and progress remain deterministic
+        # image post-processing runs as a separate stage, overlapping extraction
+        pipeline = ImagePipeline(_resolve_jobs(args, 'img_jobs'))
+        def finish_entry(i:int, filename:str, outputs:list):
+            manifest_entries[filename] = {
+                'checksum': entry_table.checksum[i],
+                'data_crc': entry_table.data_crc[i],
+                'uncompressed_data_crc': entry_table.uncompressed_data_crc[i],
+                'outputs': [os.path.relpath(output, args.DESTINATION) for output in outputs]
+            }
+        def postprocess_entry(i:int, filename:str, filepath:str, short_filename:str, force:bool, cas_filepath:str = None):
+            if None == cas_filepath:
+                self._writer.wait(filepath)
+                finish_entry(i, filename, self.postprocess_image(filepath, short_filename, i, args, force))
+                return
+            # post-process the stored payload once per run, then link every output under the entry name
+            cas_outputs = self.postprocess_image(cas_filepath, short_filename, i, args, force)
+            finish_entry(i, filename, [_cas_link(cas_output, filepath) for cas_output in cas_outputs])
+            return cas_outputs
+        def link_entry(i:int, filename:str, filepath:str, cas_future:concurrent.futures.Future):
+            finish_entry(i, filename, [_cas_link(cas_output, filepath) for cas_output in cas_future.result()])
+        self._stream_threshold = getattr(args, 'stream_threshold', self._stream_threshold)
+        self._read_window_size = getattr(args, 'read_window', self._read_window_size)
+        # payloads are read in offset order (see `_schedule_reads()`), results are still consumed in table order
+        windows = _schedule_reads(
+            [(task[0], task[1]) for task in tasks],
+            self._read_window_size,
+            lambda k: self._streams(tasks[k][0], tasks[k][1], tasks[k][2], tasks[k][3]))
+        order = [k for window_offset, window_size, indices in windows for k in indices]
+        # a container has a single writer, entries are extracted in this process
+        jobs = 1 if packed else _resolve_jobs(args)
+        executor = None
+        if jobs > 1 and len(tasks) > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=_extract_worker_init,
+                initargs=(
+                    os.path.abspath(args.SOURCE),
+                    self._offset,
+                    True == getattr(args, 'mmap', False),
+                    self._stream_threshold,
+                    None != self._metrics,
+                    self._writer.directories,
+                    self._writer.atomic,
+                    None if None == metrics._profiler else (metrics._profiler.stage, metrics._profiler.memory, metrics._profiler.filepath)))
+            # each chunk is a run of neighbouring payloads, so every worker reads forward through the archive
+            extracted = _reorder(order, executor.map(_extract_worker, [tasks[k] for k in order], chunksize=max(1, min(64, len(tasks) // (jobs * 4)))))
+        else:
+            extracted = _reorder(order, self._extract_scheduled(tasks, windows))
+        try:
+            for i, filename, filepath, short_filename, state, force, cas_filepath in plan:
+                if None != self._metrics:
+                    self._metrics.count(state)
+                match (state):
+                    case 'unchanged':
+                        _log.progress(f'(unchanged) {short_filename}', i+1, self._header["table_entry_count"], False)
+                        continue
+                    case 'cached':
+                        _log.progress(f'(cached) {short_filename}', i+1, self._header["table_entry_count"], False)
+                    case 'link':
+                        _log.progress(f'(dedup) {short_filename}', i+1, self._header["table_entry_count"], False)
                     case _:
-                        raise NotImplementedError(f'nxpk compression type: {entry["compression_type"]}')
-                self.save_binary(data, filepath, args.force)
-            noext, ext = os.path.splitext(filepath)
-            # image post-processing
-            if _is_imagefile(filepath):
-                out_ext = ext if None == args.img_format else f'.{args.img_format}'
-                out_filepath = f'{noext}{out_ext}'
-                if _is_excluded(args, out_filepath):
-                    continue
-                existing_img = None != args.img_format and os.path.isfile(out_filepath)
-                # skip existing unless `--force`, this also means recoloring without changing file format requires `--force`
-                if args.force or not existing_img:
-                    # convert pvr to png (sometimes only as intermediary format since imagemagick can't process PVR files.)
-                    pvr_file = '.pvr' == ext
-                    if pvr_file and None != args.img_format:
-                        _log.progress(f'(pvr2png) {short_filename}', i+1, self._header["table_entry_count"])
-                        filepath = pvr2png(filepath, args.force)
-                        noext, ext = os.path.splitext(filepath)
-                    # optionally process image files by recoloring, converting, or some custom operation
-                    if '.png' == ext or '.webp' == ext or '.jpg' == ext: # TODO: supported file extensions should be a list, not a hardcoded conditional expression
-                        magick_options = {
-                            'custom_args': [],
-                            'img_format': args.img_format,
-                            'force': True == args.force,
-                            'existing_img': True == existing_img,
-                            'recolor': True == args.recolor
-                        }
-                        _log.progress(f'(magick) {short_filename}', i+1, self._header["table_entry_count"])
-                        filepath = magick(filepath, magick_options)
-                        noext, ext = os.path.splitext(filepath)
-                    # if extract was a PVR file, and target format is not PNG, remove intermediary PNG file to save on space
-                    if pvr_file and None != args.img_format and 'png' != args.img_format:
-                        # only remove if the target image format was created
-                        if os.path.isfile(out_filepath) and os.path.isfile(f'{noext}.png'):
-                            # removing intermediary 'png' file
-                            os.remove(f'{noext}.png')
-            # TODO: pyc -> py
+                        _log.progress(f'(extract) {short_filename}', i+1, self._header["table_entry_count"])
+                        size, worker_metrics = next(extracted)
+                        if None != executor:
+                            self._writer.record(size)
+                        if None != worker_metrics:
+                            self._metrics.merge(worker_metrics)
+                        if None != cas_filepath:
+                            self._writer.wait(f'{cas_filepath}.{os.getpid()}.tmp')
+                            os.replace(f'{cas_filepath}.{os.getpid()}.tmp', cas_filepath)
+                if not _is_imagefile(filepath):
+                    outputs = [filepath] if None == cas_filepath else [_cas_link(cas_filepath, filepath)]
+                    finish_entry(i, filename, outputs)
+                elif None == cas_filepath:
+                    pipeline.submit(postprocess_entry, i, filename, filepath, short_filename, force)
+                elif cas_filepath in cas_processed:
+                    # the stored payload is (being) post-processed by an earlier entry
+                    pipeline.submit(link_entry, i, filename, filepath, cas_processed[cas_filepath])
+                else:
+                    cas_processed[cas_filepath] = pipeline.submit(postprocess_entry, i, filename, filepath, short_filename, force, cas_filepath)
+                # TODO: pyc -> py
+            self._writer.join()
+            pipeline.join()
+        finally:
+            if None != executor:
+                executor.shutdown(cancel_futures=True)
+            self._writer.cancel()
+            pipeline.cancel()
+            writer = self._writer
+            self._writer = None
+            self._sink = None
+            # also persisted when interrupted, so completed entries are not redone
+            if not packed:
+                self.save_json({
+                        'options': manifest_options,
+                        'entries': manifest_entries
+                    },
+                    manifest_filepath,
+                    True)
         elapsed_time = time.time() - start_time
-        _log.activity(f'Done. `{len(entry_table)}` entries took `{elapsed_time}` seconds.')
+        written_files, written_bytes, write_seconds = writer.throughput()
+        write_rate = (written_bytes / (1024 * 1024)) / write_seconds if 0 < write_seconds else 0.0
+        _log.activity(f'Done. `{len(entry_table)}` entries took `{elapsed_time}` seconds, wrote `{written_files}` files ({written_bytes} bytes) at `{write_rate:.1f}` MiB/s.')
+
+    def load_manifest(self, manifest_filepath:str):
+        if not os.path.isfile(manifest_filepath):
+            return {}
+        try:
+            with open(manifest_filepath, 'rt') as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError) as ex:
+            _log.warn(f'Ignoring unreadable manifest `{manifest_filepath}`: {ex}')
+            return {}
+
+    def _streams(self, data_offset:int, data_size:int, compression_type:int, uncompressed_data_size:int):
+        return self._stream_threshold < max(data_size, uncompressed_data_size) and compression_type in (0, 1)
+
+    def _extract_scheduled(self, tasks:list, windows:list):
+        """
+        extracts `tasks` window by window, see `_schedule_reads()`, and yields `(size, None)` per task in
+        window order. each window is one read, and the kernel is asked to prefetch the next one while
+        the current one is decompressed and written.
+        """
+        _fadvise(self._file, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        for n, (window_offset, window_size, indices) in enumerate(windows):
+            if n + 1 < len(windows) and 0 < windows[n+1][1]:
+                _fadvise(self._file, windows[n+1][0], windows[n+1][1], 'POSIX_FADV_WILLNEED')
+            window = None
+            if 0 < window_size:
+                with metrics.stage(self._metrics, 'read', window_size):
+                    window = memoryview(self.read_at(window_offset, window_size))
+            for k in indices:
+                data_offset, data_size, compression_type, uncompressed_data_size, filepath, force = tasks[k]
+                data = None if None == window else window[data_offset - window_offset:data_offset - window_offset + data_size]
+                if 0 == compression_type and None != data and None == self._map:
+                    # a queued slice would keep its whole window alive, while the writer budget only counts the slice
+                    data = bytes(data)
+                yield self.extract_entry(data_offset, data_size, compression_type, uncompressed_data_size, filepath, force, data), None
+
+    def extract_entry(self, data_offset:int, data_size:int, compression_type:int, uncompressed_data_size:int, filepath:str, force:bool, data:bytes|memoryview = None):
+        """extracts an entry to `filepath`, `data` is its payload when the caller already read it"""
+        if None == data and self._streams(data_offset, data_size, compression_type, uncompressed_data_size):
+            return self.extract_entry_streaming(data_offset, data_size, compression_type, filepath, force)
+        data = self.decompress_entry(data_offset, data_size, compression_type, uncompressed_data_size, data)
+        if None != self._writer:
+            self._writer.write(data, filepath, force)
+            return len(data)
+        with metrics.stage(self._metrics, 'write', len(data)):
+            self.save_binary(data, filepath, force)
+        return len(data)
+
+    def decompress_entry(self, data_offset:int, data_size:int, compression_type:int, uncompressed_data_size:int, data:bytes|memoryview = None):
+        # when mapped this is a zero-copy view, stored entries are written straight from the mapping
+        # (and page faults are then counted against whichever stage first touches the data)
+        if None == data:
+            with metrics.stage(self._metrics, 'read', data_size):
+                data = self.read_at(data_offset, data_size)
+        if 0 != compression_type and None != self._metrics:
+            with self._metrics.stage(f'decompress:{compression_names.get(compression_type, compression_type)}', uncompressed_data_size):
+                return self._decompress(data, compression_type, uncompressed_data_size)
+        return self._decompress(data, compression_type, uncompressed_data_size)
+
+    def _decompress(self, data:bytes|memoryview, compression_type:int, uncompressed_data_size:int):
+        match (compression_type):
+            case 0: # none
+                pass
+            case 1: # zlib
+                data = zlib.decompress(data)
+            case 2: # lz4
+                data = lz4.block.decompress(data, uncompressed_size=uncompressed_data_size)
+            case 3: # zstd
+                # `zstd.decompress()` only accepts `bytes`
+                data = zstd.decompress(bytes(data))
+            case _:
+                raise NotImplementedError(f'nxpk compression type: {compression_type}')
+        return data
+
+    def extract_entry_streaming(self, data_offset:int, data_size:int, compression_type:int, filepath:str, force:bool):
+        """
+        extracts an entry in fixed-size chunks, so peak memory is bounded by the chunk size rather than the entry size.
+
+        only stored and zlib entries can be streamed, lz4 block and zstd payloads are decoded in one shot.
+        """
+        decompressor = zlib.decompressobj() if 1 == compression_type else None
+        written = 0
+        with self.open_binary(filepath, force) if None == self._writer else self._writer.open(filepath, force) as binary_file:
+            for chunk_offset in range(data_offset, data_offset + data_size, _stream_chunk_size):
+                chunk_size = min(_stream_chunk_size, data_offset + data_size - chunk_offset)
+                with metrics.stage(self._metrics, 'read', chunk_size):
+                    chunk = self.read_at(chunk_offset, chunk_size)
+                if None == decompressor:
+                    with metrics.stage(self._metrics, 'write', chunk_size):
+                        written += binary_file.write(chunk)
+                    continue
+                # cap output per call, highly compressible input would otherwise inflate to an unbounded buffer
+                while 0 < len(chunk):
+                    with metrics.stage(self._metrics, 'decompress:zlib'):
+                        out = decompressor.decompress(chunk, _stream_chunk_size)
+                    with metrics.stage(self._metrics, 'write', len(out)):
+                        written += binary_file.write(out)
+                    chunk = decompressor.unconsumed_tail
+            if None != decompressor:
+                written += binary_file.write(decompressor.flush())
+        return written
+
+    def verify_entry(self, data_offset:int, data_size:int, compression_type:int, uncompressed_data_size:int, data_crc:int, uncompressed_data_crc:int, quick:bool = False, data:bytes|memoryview = None):
+        """
+        checks an entry against its table values, returns a list of problems (empty when it matches.)
+
+        `data_crc` is always checked, unless `quick` the entry is also decompressed and its size and
+        `uncompressed_data_crc` checked. `data` is the payload when the caller already read it.
+        """
+        if None == data and self._streams(data_offset, data_size, compression_type, uncompressed_data_size):
+            return self._verify_entry_streaming(data_offset, data_size, compression_type, uncompressed_data_size, data_crc, uncompressed_data_crc, quick)
+        if None == data:
+            data = self.read_at(data_offset, data_size)
+        if len(data) != data_size:
+            return [f'truncated, `{len(data)}` of `{data_size}` bytes']
+        problems = []
+        if zlib.crc32(data) != data_crc:
+            problems.append('data_crc')
+        if quick:
+            return problems
+        try:
+            data = self._decompress(data, compression_type, uncompressed_data_size)
+        except Exception as ex:
+            problems.append(f'{type(ex).__name__}: {ex}')
+            return problems
+        if len(data) != uncompressed_data_size:
+            problems.append('uncompressed_data_size')
+        if zlib.crc32(data) != uncompressed_data_crc:
+            problems.append('uncompressed_data_crc')
+        return problems
+
+    def _verify_entry_streaming(self, data_offset:int, data_size:int, compression_type:int, uncompressed_data_size:int, data_crc:int, uncompressed_data_crc:int, quick:bool):
+        decompressor = zlib.decompressobj() if 1 == compression_type and not quick else None
+        crc = uncompressed_crc = 0
+        size = uncompressed_size = 0
+        try:
+            for chunk_offset in range(data_offset, data_offset + data_size, _stream_chunk_size):
+                chunk = self.read_at(chunk_offset, min(_stream_chunk_size, data_offset + data_size - chunk_offset))
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if None == decompressor:
+                    continue
+                while 0 < len(chunk):
+                    out = decompressor.decompress(chunk, _stream_chunk_size)
+                    uncompressed_crc = zlib.crc32(out, uncompressed_crc)
+                    uncompressed_size += len(out)
+                    chunk = decompressor.unconsumed_tail
+            if None != decompressor:
+                out = decompressor.flush()
+                uncompressed_crc = zlib.crc32(out, uncompressed_crc)
+                uncompressed_size += len(out)
+        except zlib.error as ex:
+            return [f'{type(ex).__name__}: {ex}']
+        if size != data_size:
+            return [f'truncated, `{size}` of `{data_size}` bytes']
+        problems = []
+        if crc != data_crc:
+            problems.append('data_crc')
+        if quick:
+            return problems
+        if 0 == compression_type:
+            uncompressed_crc, uncompressed_size = crc, size
+        if uncompressed_size != uncompressed_data_size:
+            problems.append('uncompressed_data_size')
+        if uncompressed_crc != uncompressed_data_crc:
+            problems.append('uncompressed_data_crc')
+        return problems
+
+    def verify_tasks(self, filepath:str, quick:bool = False, path_filter:PathFilter = None):
+        """
+        returns `(tasks, names)`, the entries of this archive batched for `verify_archives()`.
+
+        batches are the read windows of `_schedule_reads()`, so each is one sequential read. entries
+        larger than a window are a batch of their own and are read in chunks.
+        """
+        entry_table = self.read_table()
+        nxfn_formatter = NXFNFormatHandler(self._file, self._header['table_offset'] + self._table_size, self._map)
+        names = nxfn_formatter.read_names()[:len(entry_table)] if nxfn_formatter.is_compatible() else []
+        source_filename = os.path.basename(filepath)
+        names += [os.path.join(source_filename, f'{i}') for i in range(len(names), len(entry_table))]
+        selected = [i for i in range(len(entry_table)) if not path_filter or path_filter.accepts(names[i])]
+        windows = _schedule_reads([(entry_table.data_offset[i], entry_table.data_size[i]) for i in selected], self._read_window_size)
+        tasks = []
+        for window_offset, window_size, indices in windows:
+            tasks.append((filepath, quick, window_offset, window_size, [(
+                selected[k],
+                entry_table.data_offset[selected[k]],
+                entry_table.data_size[selected[k]],
+                entry_table.compression_type[selected[k]],
+                entry_table.uncompressed_data_size[selected[k]],
+                entry_table.data_crc[selected[k]],
+                entry_table.uncompressed_data_crc[selected[k]],
+                entry_table.encryption_type[selected[k]]) for k in indices]))
+        return tasks, names
+
+    def postprocess_image(self, filepath:str, short_filename:str, i:int, args: argparse.Namespace, force:bool):
+        """
+        post-processes an extracted image, returns the paths of all files that make up the entry.
+
+        `--include`/`--exclude` are not evaluated here, filtered entries never reach post-processing.
+        """
+        outputs = [filepath]
+        if not _is_imagefile(filepath):
+            return outputs
+        noext, ext = os.path.splitext(filepath)
+        out_ext = ext if None == args.img_format else f'.{args.img_format}'
+        out_filepath = f'{noext}{out_ext}'
+        existing_img = None != args.img_format and os.path.isfile(out_filepath)
+        # skip existing unless `--force`, this also means recoloring without changing file format requires `--force`
+        if force or not existing_img:
+            # convert pvr to png (sometimes only as intermediary format since imagemagick can't process PVR files.)
+            pvr_file = '.pvr' == ext
+            if pvr_file and None != args.img_format:
+                _log.progress(f'(pvr2png) {short_filename}', i+1, self._header["table_entry_count"])
+                with metrics.stage(self._metrics, 'pvr2png', os.path.getsize(filepath) if None != self._metrics else 0):
+                    filepath = pvr2png(filepath, force)
+                noext, ext = os.path.splitext(filepath)
+            # optionally process image files by recoloring, converting, or some custom operation
+            if '.png' == ext or '.webp' == ext or '.jpg' == ext: # TODO: supported file extensions should be a list, not a hardcoded conditional expression
+                magick_options = {
+                    'custom_args': [],
+                    'img_format': args.img_format,
+                    'force': True == force,
+                    'existing_img': True == existing_img,
+                    'recolor': True == args.recolor,
+                    'engine': getattr(args, 'img_engine', 'auto')
+                }
+                _log.progress(f'(magick) {short_filename}', i+1, self._header["table_entry_count"])
+                with metrics.stage(self._metrics, 'magick', os.path.getsize(filepath) if None != self._metrics else 0):
+                    filepath = magick(filepath, magick_options)
+                noext, ext = os.path.splitext(filepath)
+            # if extract was a PVR file, and target format is not PNG, remove intermediary PNG file to save on space
+            if pvr_file and None != args.img_format and 'png' != args.img_format:
+                # only remove if the target image format was created
+                if os.path.isfile(out_filepath) and os.path.isfile(f'{noext}.png'):
+                    # removing intermediary 'png' file
+                    os.remove(f'{noext}.png')
+        if filepath not in outputs and os.path.isfile(filepath):
+            outputs.append(filepath)
+        if out_filepath not in outputs and os.path.isfile(out_filepath):
+            outputs.append(out_filepath)
+        return outputs
 
     def decode_nxfn(self, offset:int, args: argparse.Namespace):
-        nfxn_formatter = NXFNFormatHandler(self._file, offset)
+        nfxn_formatter = NXFNFormatHandler(self._file, offset, self._map)
+        nfxn_formatter._sink = self._sink
         return nfxn_formatter.decode(args)
 
     def extract_header(self):
@@ -179,17 +693,138 @@ class NXPKFormatHandler(FormatHandler):
             'table_offset': table_offset
         }
 
-    def read_entry(self, entry_offset:int):
-        self._file.seek(entry_offset, io.SEEK_SET)
-        buf = self._file.read(self._table_entry_size)
-        checksum, data_offset, data_size, uncompressed_data_size, data_crc, uncompressed_data_crc, compression_type, encryption_type = struct.unpack('<IIIIIIHH', buf)
-        return {
-             'checksum': checksum,
-             'data_offset': data_offset,
-             'data_size': data_size,
-             'uncompressed_data_size': uncompressed_data_size,
-             'data_crc': data_crc,
-             'uncompressed_data_crc': uncompressed_data_crc,
-             'compression_type': compression_type,
-             'encryption_type': encryption_type
-        }
+    def read_table(self):
+        if not hasattr(self, '_header'):
+            self._header = self.extract_header()
+        self._table_entry_size = NXPKEntryTable.entry_size
+        self._table_size = self._table_entry_size * self._header['table_entry_count']
+        self._file.seek(self._header['table_offset'], io.SEEK_SET)
+        buf = self._file.read(self._table_size)
+        if len(buf) < self._table_size:
+            raise ValueError(f'Insuffucient table data, expected `{self._table_size}`, found `{len(buf)}`, aborting.')
+        return NXPKEntryTable(buf)
+
+# per-process state for `--jobs`, each worker opens (and optionally maps) the archive itself
+_worker_handler:NXPKFormatHandler = None
+
+def _extract_worker_init(source:str, offset:int, use_mmap:bool, stream_threshold:int, collect_metrics:bool = False, directories:frozenset = None, atomic:bool = False, profile:tuple = None):
+    global _worker_handler
+    _worker_handler = NXPKFormatHandler(open(source, 'rb'), offset)
+    # tasks arrive in offset order, see `decode()`
+    _fadvise(_worker_handler._file, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+    _worker_handler._stream_threshold = stream_threshold
+    if collect_metrics:
+        _worker_handler._metrics = Metrics()
+    # workers write on their own thread, the orchestrator already created the output tree
+    _worker_handler._writer = OutputWriter(0, atomic, metrics=_worker_handler._metrics, directories=directories)
+    if None != profile:
+        metrics.configure_profiling(*profile, worker=True)
+    if use_mmap:
+        _worker_handler.map_file()
+
+def _extract_worker(task:tuple):
+    # metrics are returned as increments, the orchestrator merges them into its own
+    size = _worker_handler.extract_entry(*task)
+    return size, None if None == _worker_handler._metrics else _worker_handler._metrics.take()
+
+# per-process state of `verify_archives()` workers, the most recently verified archive stays open
+_verify_use_mmap:bool = False
+_verify_handler:NXPKFormatHandler = None
+_verify_filepath:str = None
+
+def _verify_worker_init(use_mmap:bool, worker:bool = True):
+    global _verify_use_mmap
+    if worker:
+        # only the orchestrator reports progress
+        _log.set_progress(False)
+    _verify_use_mmap = use_mmap
+
+def _verify_close():
+    global _verify_handler, _verify_filepath
+    if None != _verify_handler:
+        _verify_handler.unmap_file()
+        _verify_handler._file.close()
+    _verify_handler = None
+    _verify_filepath = None
+
+def _verify_worker(task:tuple):
+    global _verify_handler, _verify_filepath
+    filepath, quick, window_offset, window_size, entries = task
+    if filepath != _verify_filepath:
+        _verify_close()
+        _verify_handler = NXPKFormatHandler(open(filepath, 'rb'), 0)
+        _verify_filepath = filepath
+        _fadvise(_verify_handler._file, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        if _verify_use_mmap:
+            _verify_handler.map_file()
+    handler = _verify_handler
+    window = None if 0 == window_size else memoryview(handler.read_at(window_offset, window_size))
+    mismatches = []
+    size = 0
+    for i, data_offset, data_size, compression_type, uncompressed_data_size, data_crc, uncompressed_data_crc, encryption_type in entries:
+        size += data_size
+        data = None if None == window else window[data_offset - window_offset:data_offset - window_offset + data_size]
+        # encrypted payloads can only be checked as stored
+        problems = handler.verify_entry(data_offset, data_size, compression_type, uncompressed_data_size, data_crc, uncompressed_data_crc, quick or 0 != encryption_type, data)
+        if 0 < len(problems):
+            mismatches.append((i, problems))
+    return filepath, len(entries), size, mismatches
+
+def verify_archives(filepaths:list, jobs:int = 1, quick:bool = False, use_mmap:bool = False, path_filter:PathFilter = None):
+    """
+    checks every entry of every archive in `filepaths` against its CRCs, batches of entries are
+    verified across `jobs` worker processes. returns `(results, seconds)` where results maps each
+    archive to `{ 'entries', 'bytes', 'mismatches': [(index, name, problems)], 'error' }`, `error` is
+    set when the archive could not be indexed at all (ie. a truncated entry table.)
+    """
+    start_time = time.perf_counter()
+    tasks = []
+    names = {}
+    results = {}
+    for filepath in filepaths:
+        results[filepath] = { 'entries': 0, 'bytes': 0, 'mismatches': [], 'error': None }
+        try:
+            with open(filepath, 'rb') as archive_file:
+                handler = NXPKFormatHandler(archive_file, 0)
+                if not handler.is_compatible():
+                    raise ValueError(f'File `{filepath}` is not compatible with format `{NXPKFormatHandler.__format_id__}`.')
+                archive_tasks, names[filepath] = handler.verify_tasks(filepath, quick, path_filter)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError) as ex:
+            results[filepath]['error'] = f'{type(ex).__name__}: {ex}'
+            _log.warn(f'Unreadable archive `{filepath}`: {results[filepath]["error"]}')
+            continue
+        tasks += archive_tasks
+    total_size = sum(entry[2] for task in tasks for entry in task[4])
+    verified_size = 0
+    def collect(result:tuple):
+        nonlocal verified_size
+        filepath, count, size, mismatches = result
+        archive_result = results[filepath]
+        archive_result['entries'] += count
+        archive_result['bytes'] += size
+        for i, problems in mismatches:
+            archive_result['mismatches'].append((i, names[filepath][i], problems))
+            _log.warn(f'CRC mismatch in `{filepath}`: {names[filepath][i]} (entry {i}), {", ".join(problems)}')
+        verified_size += size
+        seconds = time.perf_counter() - start_time
+        _log.progress(f'(verify) {(verified_size / (1024 * 1024)) / seconds if 0 < seconds else 0.0:.1f} MB/s {os.path.basename(filepath)}', verified_size, total_size, False)
+    if 1 >= jobs or 1 >= len(tasks):
+        _verify_worker_init(use_mmap, False)
+        try:
+            for task in tasks:
+                collect(_verify_worker(task))
+        finally:
+            _verify_close()
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_verify_worker_init, initargs=(use_mmap,)) as executor:
+            futures = [executor.submit(_verify_worker, task) for task in tasks]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    collect(future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    for archive_result in results.values():
+        archive_result['mismatches'].sort()
+    return results, time.perf_counter() - start_time
@@ -0,0 +1,186 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+import collections
+import fnmatch
+import io
+import os
+import threading
+from .NXFNFormatHandler import NXFNFormatHandler
+from .NXPKFormatHandler import NXPKFormatHandler, NXPKEntryTable
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+class NpkArchive:
+    """
+    random access to the entries of an `.npk` archive, without unpacking it.
+
+    entries are addressed by their NXFN name (`/` separated), or by their table index when the
+    archive has no name table. payloads are decompressed on first `read()` and kept in an LRU
+    cache bounded by `cache_size` bytes, entries larger than the cache are never cached.
+
+    `read()` may be called from several threads. without `use_mmap` reads of the shared file are
+    serialized, decompression runs concurrently either way.
+    """
+    filepath:str
+    _file:io.IOBase
+    _handler:NXPKFormatHandler
+    _entry_table:NXPKEntryTable
+    _names:list
+    _index:dict
+    _directories:dict
+    _cache:collections.OrderedDict
+    _cache_size:int
+    _cached_size:int
+    _lock:threading.Lock
+    """held around `seek()`/`read()` of `_file`, only taken when the archive is not mapped"""
+    _read_lock:threading.Lock
+
+    def __init__(self, filepath:str, cache_size:int = 64 * 1024 * 1024, use_mmap:bool = True):
+        self.filepath = filepath
+        self._file = open(filepath, 'rb')
+        try:
+            self._handler = NXPKFormatHandler(self._file, 0)
+            if not self._handler.is_compatible():
+                raise ValueError(f'File `{filepath}` is not compatible with format `{NXPKFormatHandler.__format_id__}`.')
+            if use_mmap:
+                self._handler.map_file()
+            self._entry_table = self._handler.read_table()
+            self._names = self._read_names()
+        except:
+            self.close()
+            raise
+        self._index = { name: i for i, name in enumerate(self._names) }
+        # every directory, mapped to the names of its immediate children
+        self._directories = { '': set() }
+        for name in self._names:
+            parent = ''
+            for part in name.split('/')[:-1]:
+                directory = f'{parent}/{part}' if parent else part
+                self._directories.setdefault(parent, set()).add(f'{part}/')
+                self._directories.setdefault(directory, set())
+                parent = directory
+            self._directories.setdefault(parent, set()).add(os.path.basename(name))
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._cached_size = 0
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name:str):
+        return self._normalize(name) in self._index
+
+    def close(self):
+        if None != self._file:
+            self._handler.unmap_file()
+            self._file.close()
+            self._file = None
+        self._cache = collections.OrderedDict()
+        self._cached_size = 0
+
+    def names(self):
+        return list(self._names)
+
+    def listdir(self, path:str = ''):
+        """
+        returns the sorted immediate children of directory `path`, subdirectory names end with `/`.
+        """
+        path = self._normalize(path)
+        if not path in self._directories:
+            raise FileNotFoundError(f'No such directory in `{self.filepath}`: {path}')
+        return sorted(self._directories[path])
+
+    def isdir(self, path:str):
+        return self._normalize(path) in self._directories
+
+    def glob(self, pattern:str):
+        """
+        returns the names matching `pattern` (`fnmatch` syntax, `*` also matches `/`), in table order.
+        """
+        pattern = self._normalize(pattern)
+        return [name for name in self._names if fnmatch.fnmatchcase(name, pattern)]
+
+    def stat(self, name:str):
+        i = self._lookup(name)
+        entry = self._entry_table[i]
+        entry['index'] = i
+        entry['name'] = self._names[i]
+        return entry
+
+    def read(self, name:str):
+        i = self._lookup(name)
+        with self._lock:
+            data = self._cache.get(i)
+            if None != data:
+                self._cache.move_to_end(i)
+                return data
+        data = self._decompress(i)
+        if len(data) <= self._cache_size:
+            with self._lock:
+                if not i in self._cache:
+                    self._cache[i] = data
+                    self._cached_size += len(data)
+                while self._cached_size > self._cache_size:
+                    evicted_index, evicted = self._cache.popitem(last=False)
+                    self._cached_size -= len(evicted)
+        return data
+
+    def open(self, name:str):
+        return io.BytesIO(self.read(name))
+
+    def extract(self, name:str, dest:str, force:bool = False):
+        """
+        writes entry `name` to `dest`, returns the number of bytes written.
+        """
+        data = self.read(name)
+        self._handler.save_binary(data, dest, force)
+        return len(data)
+
+    def _read_names(self):
+        offset = self._handler._header['table_offset'] + self._handler._table_size
+        nxfn_formatter = NXFNFormatHandler(self._file, offset, self._handler._map)
+        if not nxfn_formatter.is_compatible():
+            # no name table, entries are named by their table index
+            return [str(i) for i in range(len(self._entry_table))]
+        names = nxfn_formatter.read_names()
+        if len(names) < len(self._entry_table):
+            raise ValueError(f'NXFN table of `{self.filepath}` names `{len(names)}` of `{len(self._entry_table)}` entries.')
+        return names[:len(self._entry_table)]
+
+    def _lookup(self, name:str):
+        i = self._index.get(self._normalize(name))
+        if None == i:
+            raise FileNotFoundError(f'No such entry in `{self.filepath}`: {name}')
+        return i
+
+    def _normalize(self, name:str):
+        return name.replace('\\', '/').strip('/')
+
+    def _decompress(self, i:int):
+        table = self._entry_table
+        match (table.encryption_type[i]):
+            case 0: # none
+                pass
+            case _:
+                raise NotImplementedError(f'nxpk encryption type: {table.encryption_type[i]}')
+        data = None
+        if None == self._handler._map:
+            # `read_at()` seeks then reads the shared file object
+            with self._read_lock:
+                data = self._handler.read_at(table.data_offset[i], table.data_size[i])
+        # a `bytes` copy, cached data must not pin the mapping
+        return bytes(self._handler.decompress_entry(
+            table.data_offset[i],
+            table.data_size[i],
+            table.compression_type[i],
+            table.uncompressed_data_size[i],
+            data))
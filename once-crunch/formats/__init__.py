@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: © 2024 Shaun Wilson
 # SPDX-License-Identifier: MIT
 __all__ = [
+    'NpkArchive',
     'NXFNFormatHandler',
     'NXPKFormatHandler'
 ]
\ No newline at end of file
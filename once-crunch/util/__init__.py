@@ -1,6 +1,16 @@
 # SPDX-FileCopyrightText: © 2024 Shaun Wilson
 # SPDX-License-Identifier: MIT
 __all__ = [
+    'bindict',
+    'bindictindex',
+    'containers',
+    'filtering',
     'logging',
-    'imgtools'
+    'imgtools',
+    'lazyimport',
+    'metrics',
+    'outputwriter',
+    'pvr',
+    'synth',
+    'tiling'
 ]
@@ -0,0 +1,303 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# bindict.py
+#
+# extraction and decoding of `bindict(b'...')` blobs from decompiled python files
+##
+
+import array
+import codecs
+import mmap
+import os
+import re
+import struct
+import sys
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+_bindict_marker = b'bindict('
+_re_bindict = re.compile(rb"bindict\(b'(.*)'\)\n", re.MULTILINE)
+_re_bindict_str = re.compile(r"bindict\(b'(.*)'\)\n", re.MULTILINE)
+# the escapes understood by `_decode_literal_slow()`
+_escapes = {
+    ord('\\'): ord('\\'),
+    ord("'"): ord("'"),
+    ord('"'): ord('"'),
+    ord('a'): ord('\a'),
+    ord('b'): ord('\b'),
+    ord('n'): ord('\n'),
+    ord('r'): ord('\r'),
+    ord('t'): ord('\t')
+}
+
+def decode_literal(literal:bytes):
+    """
+    decodes the escaped body of a `b'...'` literal into the bytes it represents.
+    """
+    try:
+        # the C implementation behind `b'...'` literals themselves
+        data, consumed = codecs.escape_decode(literal)
+        return data
+    except ValueError:
+        return _decode_literal_slow(literal)
+
+def _decode_literal_slow(literal:bytes):
+    # fallback for input `escape_decode()` rejects, eg. a truncated `\x` escape
+    arr = bytearray()
+    i = 0
+    n = len(literal)
+    while i < n:
+        j = literal.find(b'\\', i)
+        if -1 == j:
+            arr += literal[i:]
+            break
+        arr += literal[i:j]
+        c = literal[j+1] if j+1 < n else None
+        if c in _escapes:
+            arr.append(_escapes[c])
+            i = j + 2
+        elif ord('x') == c and j+4 <= n:
+            arr.append(int(literal[j+2:j+4], base=16))
+            i = j + 4
+        else:
+            raise ValueError(f'unsupported escape at position {j} ({literal[j:j+10]})')
+    return bytes(arr)
+
+def find_literal(buf:bytes|mmap.mmap):
+    """
+    returns the escaped body of the first `bindict(b'...')` literal in `buf`, or `None`.
+    """
+    # a plain byte scan rejects most files before the regex runs
+    if -1 == buf.find(_bindict_marker):
+        if -1 == buf.find(_bindict_marker.decode('ascii').encode('utf-16-le')):
+            return None
+        # a utf-16 source file
+        match = _re_bindict_str.search(bytes(buf).decode('utf-16'))
+        return None if None == match else match.group(1).encode('latin-1')
+    match = _re_bindict.search(buf)
+    return None if None == match else match.group(1)
+
+def extract_file(filepath:str, out_filepath:str):
+    """
+    writes the bindict blob of `filepath` to `out_filepath`, returns the blob size or `None` if there was no blob.
+    """
+    with open(filepath, 'rb') as in_file:
+        if 0 == os.fstat(in_file.fileno()).st_size:
+            return None
+        # mapped rather than read, most files are rejected by the marker scan
+        with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            literal = find_literal(buf)
+    return _save_literal(literal, out_filepath)
+
+def extract_data(buf:bytes, out_filepath:str):
+    """
+    `extract_file()` for source already in memory, ie. read from a container.
+    """
+    return _save_literal(find_literal(buf), out_filepath)
+
+def _save_literal(literal:bytes, out_filepath:str):
+    if None == literal:
+        return None
+    data = decode_literal(literal)
+    os.makedirs(os.path.dirname(os.path.abspath(out_filepath)), exist_ok=True)
+    with open(out_filepath, 'wb') as out_file:
+        out_file.write(data)
+    return len(data)
+
+# `.bindict.tab` layout, all little-endian:
+#   header            '<4sIIII' magic, entry count, table offset, table size, footer size
+#   source offsets    uint32[count + 1], entry bounds relative to the table offset of the `.bindict`
+#   value offsets     uint32[count + 1], entry bounds within the value blob
+#   encodings         uint8[count], see `_encodings`
+#   (padding to a multiple of 4)
+#   value blob        every value, utf-8 encoded
+_tab_magic = b'BDT1'
+_tab_header = struct.Struct('<4sIIII')
+# how each value was decoded from the `.bindict`, values which are neither utf-8 nor utf-16 are stored as `str(bytes)`
+_encodings = [
+    'utf8',
+    'utf16',
+    'bytes'
+]
+
+def _decode_str(b:bytes|memoryview):
+    try:
+        return 0, str(b, 'utf8')
+    except UnicodeDecodeError:
+        pass
+    try:
+        return 1, str(b, 'utf16')
+    except UnicodeDecodeError:
+        pass
+    return 2, str(bytes(b))
+
+class BindictTable:
+    """
+    the decoded entry table of a bindict blob.
+
+    `source_offsets` and `value_offsets` are `array('I')` columns of `count + 1` entry bounds, entry
+    `i` is `values[value_offsets[i]:value_offsets[i+1]]` (utf-8), decoded from the source bytes at
+    `table_offset + source_offsets[i]`. no per-entry objects are created until an entry is indexed.
+    """
+    count:int
+    table_offset:int
+    table_size:int
+    footer_size:int
+    source_offsets:array.array|memoryview
+    value_offsets:array.array|memoryview
+    encodings:bytes|memoryview
+    values:bytes|memoryview
+    """the mapping of a loaded `.bindict.tab`, every column is a view over it, see `load()`"""
+    _map:mmap.mmap = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i:int):
+        if i < 0 or i >= self.count:
+            raise IndexError(i)
+        b = self.table_offset + self.source_offsets[i]
+        e = self.table_offset + self.source_offsets[i+1]
+        return {
+            'v': str(self.values[self.value_offsets[i]:self.value_offsets[i+1]], 'utf8'),
+            'z': e - b,
+            'b': b,
+            'e': e
+        }
+
+    @staticmethod
+    def decode(buf:bytes|memoryview):
+        """
+        decodes a `.bindict` blob, raises `ValueError` if it is malformed.
+
+        the blob is an entry count, `count + 1` uint32 entry bounds (the last is the table blob size),
+        the table blob, then a footer blob which is not decoded.
+        """
+        buf = memoryview(buf)
+        if len(buf) < 8:
+            raise ValueError(f'Insufficient bindict data, found `{len(buf)}` bytes.')
+        count, = struct.unpack_from('<I', buf, 0)
+        table_offset = 4 + (count * 4) + 4
+        if table_offset > len(buf):
+            raise ValueError(f'Entry table of `{count}` entries exceeds bindict size `{len(buf)}`.')
+        source_offsets = array.array('I')
+        source_offsets.frombytes(buf[4:table_offset])
+        if 'big' == sys.byteorder:
+            source_offsets.byteswap()
+        table_size = source_offsets[-1]
+        if table_offset + table_size > len(buf):
+            raise ValueError(f'Entry table blob of `{table_size}` bytes exceeds bindict size `{len(buf)}`.')
+        table = buf[table_offset:table_offset + table_size]
+        self = BindictTable()
+        self.count = count
+        self.table_offset = table_offset
+        self.table_size = table_size
+        self.footer_size = len(buf) - table_offset - table_size
+        self.source_offsets = source_offsets
+        # when the whole table is utf-8 and no entry boundary splits a character, every entry is valid
+        # utf-8 on its own and the table blob already is the value blob
+        try:
+            str(table, 'utf8')
+            utf8 = not any(0x80 == (table[offset] & 0xC0) for offset in source_offsets if offset < table_size) \
+                and 0 == source_offsets[0] \
+                and all(source_offsets[i] <= source_offsets[i+1] for i in range(count))
+        except UnicodeDecodeError:
+            utf8 = False
+        if utf8:
+            self.value_offsets = source_offsets
+            self.encodings = bytes(count)
+            self.values = table
+            return self
+        encodings = bytearray(count)
+        value_offsets = array.array('I', [0])
+        values = []
+        size = 0
+        for i in range(count):
+            encodings[i], value = _decode_str(table[source_offsets[i]:source_offsets[i+1]])
+            value = value.encode('utf8')
+            values.append(value)
+            size += len(value)
+            value_offsets.append(size)
+        self.value_offsets = value_offsets
+        self.encodings = bytes(encodings)
+        self.values = b''.join(values)
+        return self
+
+    @staticmethod
+    def load(filepath:str):
+        """
+        maps a `.bindict.tab` file, the columns are views over the mapping. the mapping is held by
+        the table, it is released once neither the table nor any of its columns are referenced.
+        """
+        with open(filepath, 'rb') as tab_file:
+            if os.fstat(tab_file.fileno()).st_size < _tab_header.size:
+                raise ValueError(f'Not a bindict table file: {filepath}')
+            map = mmap.mmap(tab_file.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(map)
+        magic, count, table_offset, table_size, footer_size = _tab_header.unpack_from(buf, 0)
+        offset = _tab_header.size
+        if _tab_magic != magic or len(buf) < offset + (count + 1) * 8 + count:
+            raise ValueError(f'Not a bindict table file: {filepath}')
+        self = BindictTable()
+        self._map = map
+        self.count = count
+        self.table_offset = table_offset
+        self.table_size = table_size
+        self.footer_size = footer_size
+        self.source_offsets = buf[offset:offset + (count + 1) * 4].cast('I')
+        offset += (count + 1) * 4
+        self.value_offsets = buf[offset:offset + (count + 1) * 4].cast('I')
+        offset += (count + 1) * 4
+        if 'big' == sys.byteorder:
+            # stored little-endian, copied rather than viewed on big-endian hosts
+            self.source_offsets = array.array('I', self.source_offsets)
+            self.value_offsets = array.array('I', self.value_offsets)
+            self.source_offsets.byteswap()
+            self.value_offsets.byteswap()
+        self.encodings = buf[offset:offset + count]
+        offset += count + (-count % 4)
+        self.values = buf[offset:]
+        return self
+
+    def save(self, filepath:str):
+        source_offsets, value_offsets = self.source_offsets, self.value_offsets
+        if 'big' == sys.byteorder:
+            source_offsets, value_offsets = array.array('I', source_offsets), array.array('I', value_offsets)
+            source_offsets.byteswap()
+            value_offsets.byteswap()
+        with open(filepath, 'wb') as tab_file:
+            tab_file.write(_tab_header.pack(_tab_magic, self.count, self.table_offset, self.table_size, self.footer_size))
+            tab_file.write(source_offsets)
+            tab_file.write(value_offsets)
+            tab_file.write(self.encodings)
+            tab_file.write(bytes(-self.count % 4))
+            tab_file.write(self.values)
+
+    def summary(self, buf:bytes|memoryview):
+        """
+        a JSON-friendly view of the table, `buf` is the `.bindict` blob it was decoded from.
+        """
+        footer_offset = self.table_offset + self.table_size
+        return {
+            'size': len(buf),
+            'tab': { i: self[i] for i in range(self.count) },
+            '_header': {
+                'offset': 0,
+                'size': self.table_offset,
+                'table_entry_count': self.count,
+                'table_blob_size': self.table_size
+            },
+            '_table': {
+                'offset': self.table_offset,
+                'size': self.table_size
+            },
+            '_footer': {
+                'offset': footer_offset,
+                'size': self.footer_size,
+                # two samples directly following the entry table, suspected secondary headers
+                'bin1': bytes(buf[footer_offset:footer_offset + 5]).hex(),
+                'bin2': bytes(buf[footer_offset + 5:footer_offset + 10]).hex()
+            }
+        }
@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# bindictindex.py
+#
+# a cross-file SQLite index of decoded bindict table entries
+##
+
+import os
+import sqlite3
+from ..util.bindict import BindictTable
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+# files are committed in batches, a single transaction per file is dominated by fsync
+_commit_interval = 256
+
+_schema = [
+    'CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, file_id INTEGER NOT NULL, i INTEGER NOT NULL, v TEXT NOT NULL, z INTEGER NOT NULL, b INTEGER NOT NULL, e INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS entries_file_id ON entries (file_id)',
+    'CREATE INDEX IF NOT EXISTS entries_v ON entries (v)'
+]
+# substring search, when the SQLite build provides FTS5 with the trigram tokenizer
+_schema_fts = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (v, content='entries', content_rowid='id', tokenize='trigram')",
+    'CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN INSERT INTO entries_fts (rowid, v) VALUES (new.id, new.v); END',
+    "CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN INSERT INTO entries_fts (entries_fts, rowid, v) VALUES ('delete', old.id, old.v); END"
+]
+
+def _like_escape(term:str):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+class BindictIndex:
+    """
+    an on-disk index of every entry (`v`, `z`, `b`, `e`) of every `.bindict` beneath `root`.
+
+    `update()` is incremental, only files whose mtime or size changed are re-read. `query()`
+    answers exact lookups from a b-tree index, and substring lookups from an FTS5 trigram index
+    (falling back to `LIKE` when FTS5 is unavailable, or the term is shorter than a trigram.)
+    """
+    root:str
+    _db:sqlite3.Connection
+    _fts:bool
+
+    def __init__(self, root:str, index_filepath:str = None):
+        self.root = root
+        if None == index_filepath:
+            index_filepath = os.path.join(root, '__bindicts.sqlite')
+        self._db = sqlite3.connect(index_filepath)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        for statement in _schema:
+            self._db.execute(statement)
+        try:
+            for statement in _schema_fts:
+                self._db.execute(statement)
+            self._fts = True
+        except sqlite3.OperationalError as ex:
+            _log.debug(f'FTS5 trigram index unavailable, substring queries use `LIKE`: {ex}')
+            self._fts = False
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if None != self._db:
+            self._db.close()
+            self._db = None
+
+    def update(self, force:bool = False, progress = None):
+        """
+        indexes new and changed `.bindict` files, and forgets removed ones. returns `(indexed, unchanged, removed, failed)`.
+        """
+        known = { path: (file_id, mtime_ns, size) for file_id, path, mtime_ns, size in self._db.execute('SELECT id, path, mtime_ns, size FROM files') }
+        filepaths = [os.path.join(dname, fname) for dname, dlist, flist in os.walk(self.root) for fname in flist if fname.endswith('.bindict')]
+        indexed = unchanged = failed = 0
+        self._db.execute('PRAGMA synchronous=OFF')
+        try:
+            for n, filepath in enumerate(filepaths):
+                path = os.path.relpath(filepath, self.root)
+                st = os.stat(filepath)
+                record = known.pop(path, None)
+                if not force and None != record and record[1] == st.st_mtime_ns and record[2] == st.st_size:
+                    unchanged += 1
+                    continue
+                try:
+                    table = self._load_table(filepath, st)
+                except (OSError, ValueError) as ex:
+                    _log.warn(f'Failed to index `{filepath}`: {ex}')
+                    failed += 1
+                    continue
+                if None != record:
+                    self._db.execute('DELETE FROM entries WHERE file_id = ?', (record[0],))
+                    self._db.execute('DELETE FROM files WHERE id = ?', (record[0],))
+                file_id = self._db.execute('INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)', (path, st.st_mtime_ns, st.st_size)).lastrowid
+                self._db.executemany(
+                    'INSERT INTO entries (file_id, i, v, z, b, e) VALUES (?, ?, ?, ?, ?, ?)',
+                    ((file_id, i, entry['v'], entry['z'], entry['b'], entry['e']) for i, entry in enumerate(table)))
+                indexed += 1
+                if 0 == indexed % _commit_interval:
+                    self._db.commit()
+                if None != progress:
+                    progress(path, n+1, len(filepaths))
+            # anything left in `known` no longer exists
+            for path, (file_id, mtime_ns, size) in known.items():
+                self._db.execute('DELETE FROM entries WHERE file_id = ?', (file_id,))
+                self._db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+            self._db.commit()
+        finally:
+            self._db.execute('PRAGMA synchronous=FULL')
+        if 0 < indexed and self._fts:
+            self._db.execute("INSERT INTO entries_fts (entries_fts) VALUES ('optimize')")
+            self._db.commit()
+        return indexed, unchanged, len(known), failed
+
+    def query(self, term:str, exact:bool = False, limit:int = 100):
+        """
+        returns `(path, i, v, z, b, e)` rows whose value equals (`exact`) or contains `term`.
+
+        substring lookups are case-insensitive.
+        """
+        select = 'SELECT files.path, entries.i, entries.v, entries.z, entries.b, entries.e FROM entries JOIN files ON files.id = entries.file_id'
+        if exact:
+            rows = self._db.execute(f'{select} WHERE entries.v = ? LIMIT ?', (term, limit))
+        elif self._fts and 3 <= len(term):
+            # a quoted FTS5 string is a phrase, with the trigram tokenizer that is a substring match
+            phrase = '"' + term.replace('"', '""') + '"'
+            rows = self._db.execute(f'{select} WHERE entries.id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?) LIMIT ?', (phrase, limit))
+        else:
+            rows = self._db.execute(f"{select} WHERE entries.v LIKE ? ESCAPE '\\' LIMIT ?", (f'%{_like_escape(term)}%', limit))
+        return rows.fetchall()
+
+    def _load_table(self, filepath:str, st:os.stat_result):
+        # a `.bindict.tab` at least as new as its `.bindict` is already decoded
+        tab_filepath = f'{filepath}.tab'
+        if os.path.isfile(tab_filepath) and os.stat(tab_filepath).st_mtime_ns >= st.st_mtime_ns:
+            return BindictTable.load(tab_filepath)
+        with open(filepath, 'rb') as in_file:
+            return BindictTable.decode(in_file.read())
@@ -0,0 +1,278 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# containers.py
+#
+# packed unpack outputs, one tar/zip/sqlite container per archive, and a reader for them
+##
+
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from ..util import metrics
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+# `--output-format` values and the extension of the container each one writes
+container_formats = {
+    'tar': '.tar',
+    'zip': '.zip',
+    'sqlite': '.sqlite'
+}
+_sqlite_magic = b'SQLite format 3\0'
+# entries larger than this are spooled to disk rather than memory by `ContainerSink.open()`
+_spool_size = 64 * 1024 * 1024
+
+class ContainerSink:
+    """
+    writes files into a single container instead of a directory tree, keyed by their path
+    relative to `root` (with `/` separators.) the surface matches `OutputWriter`, so a format
+    handler can write through either.
+
+    entries are appended in the order they are written, on the calling thread. the container is
+    built under a temporary name and only renamed into place by `join()`, so an interrupted run
+    never leaves a partial container behind.
+    """
+    filepath:str
+    root:str
+    atomic:bool = True
+    directories:frozenset = frozenset()
+    files:int
+    bytes:int
+    _tmp_filepath:str
+    _lock:threading.Lock
+    _metrics:metrics.Metrics
+    _start_time:float
+
+    def __init__(self, filepath:str, root:str, metrics:metrics.Metrics = None):
+        self.filepath = filepath
+        self.root = os.path.abspath(root)
+        self.files = 0
+        self.bytes = 0
+        self._tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+        self._lock = threading.Lock()
+        self._metrics = metrics
+        self._start_time = None
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        self._open(self._tmp_filepath)
+
+    def name(self, filepath:str):
+        return os.path.relpath(os.path.abspath(filepath), self.root).replace(os.sep, '/')
+
+    def prepare(self, filepaths):
+        pass
+
+    def exists(self, filepath:str):
+        # every run builds a new container
+        return False
+
+    def write(self, data:bytes|memoryview, filepath:str, force:bool = False):
+        if None == self._start_time:
+            self._start_time = time.perf_counter()
+        with metrics.stage(self._metrics, 'write', len(data)):
+            with self._lock:
+                self._add(self.name(filepath), data)
+        self.record(len(data))
+
+    @contextlib.contextmanager
+    def open(self, filepath:str, force:bool = False):
+        """a file to stream one (large) entry into, added to the container when closed"""
+        with tempfile.SpooledTemporaryFile(_spool_size, dir=os.path.dirname(os.path.abspath(self.filepath))) as spool_file:
+            yield spool_file
+            size = spool_file.tell()
+            spool_file.seek(0)
+            if None == self._start_time:
+                self._start_time = time.perf_counter()
+            with self._lock:
+                self._add_file(self.name(filepath), spool_file, size)
+        self.record(size)
+
+    def wait(self, filepath:str):
+        pass
+
+    def flush(self):
+        pass
+
+    def join(self):
+        """completes the container and moves it into place"""
+        with self._lock:
+            self._close()
+        os.replace(self._tmp_filepath, self.filepath)
+
+    def cancel(self):
+        with self._lock:
+            with contextlib.suppress(Exception):
+                self._close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._tmp_filepath)
+
+    def record(self, size:int, files:int = 1):
+        with self._lock:
+            if None == self._start_time:
+                self._start_time = time.perf_counter()
+            self.files += files
+            self.bytes += size
+
+    def throughput(self):
+        """`(files, bytes, seconds)` since the first write"""
+        seconds = 0.0 if None == self._start_time else time.perf_counter() - self._start_time
+        return self.files, self.bytes, seconds
+
+    def _open(self, filepath:str):
+        raise NotImplementedError
+
+    def _add(self, name:str, data:bytes|memoryview):
+        raise NotImplementedError
+
+    def _add_file(self, name:str, fileobj:io.IOBase, size:int):
+        self._add(name, fileobj.read())
+
+    def _close(self):
+        raise NotImplementedError
+
+class TarSink(ContainerSink):
+    _tar:tarfile.TarFile
+
+    def _open(self, filepath:str):
+        self._tar = tarfile.open(filepath, 'w', format=tarfile.PAX_FORMAT)
+
+    def _add(self, name:str, data:bytes|memoryview):
+        self._add_file(name, io.BytesIO(data), len(data))
+
+    def _add_file(self, name:str, fileobj:io.IOBase, size:int):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        self._tar.addfile(info, fileobj)
+
+    def _close(self):
+        self._tar.close()
+
+class ZipSink(ContainerSink):
+    _zip:zipfile.ZipFile
+
+    def _open(self, filepath:str):
+        # entries are already decompressed, recompressing them is left to whoever ships the container
+        self._zip = zipfile.ZipFile(filepath, 'w', zipfile.ZIP_STORED, allowZip64=True)
+
+    def _add(self, name:str, data:bytes|memoryview):
+        self._zip.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data)
+
+    def _add_file(self, name:str, fileobj:io.IOBase, size:int):
+        with self._zip.open(zipfile.ZipInfo(name, time.localtime()[:6]), 'w', force_zip64=True) as entry_file:
+            shutil.copyfileobj(fileobj, entry_file, 1024 * 1024)
+
+    def _close(self):
+        self._zip.close()
+
+class SqliteSink(ContainerSink):
+    """a `files (name TEXT PRIMARY KEY, size INTEGER, data BLOB)` table, written in one transaction"""
+    _db:sqlite3.Connection
+
+    def _open(self, filepath:str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(filepath)
+        self._db = sqlite3.connect(filepath, check_same_thread=False)
+        # the file is renamed into place once complete, a journal protects nothing
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE files (name TEXT PRIMARY KEY, size INTEGER NOT NULL, data BLOB NOT NULL)')
+
+    def _add(self, name:str, data:bytes|memoryview):
+        self._db.execute('INSERT OR REPLACE INTO files (name, size, data) VALUES (?, ?, ?)', (name, len(data), data))
+
+    def _close(self):
+        self._db.commit()
+        self._db.close()
+
+def open_sink(format:str, filepath:str, root:str, metrics:metrics.Metrics = None):
+    match (format):
+        case 'tar':
+            return TarSink(filepath, root, metrics)
+        case 'zip':
+            return ZipSink(filepath, root, metrics)
+        case 'sqlite':
+            return SqliteSink(filepath, root, metrics)
+    raise NotImplementedError(f'output format: {format}')
+
+def is_container(filepath:str):
+    if not os.path.isfile(filepath):
+        return False
+    with open(filepath, 'rb') as container_file:
+        if container_file.read(len(_sqlite_magic)) == _sqlite_magic:
+            return True
+    return zipfile.is_zipfile(filepath) or tarfile.is_tarfile(filepath)
+
+class ContainerReader:
+    """
+    reads entries of a container written by a `ContainerSink`, without extracting it.
+
+    `read()` may be called from several threads.
+    """
+    filepath:str
+    _lock:threading.Lock
+    _tar:tarfile.TarFile = None
+    _members:dict = None
+    _zip:zipfile.ZipFile = None
+    _db:sqlite3.Connection = None
+
+    def __init__(self, filepath:str):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        with open(filepath, 'rb') as container_file:
+            sqlite = container_file.read(len(_sqlite_magic)) == _sqlite_magic
+        if sqlite:
+            self._db = sqlite3.connect(f'file:{filepath}?mode=ro', uri=True, check_same_thread=False)
+        elif zipfile.is_zipfile(filepath):
+            self._zip = zipfile.ZipFile(filepath, 'r')
+        elif tarfile.is_tarfile(filepath):
+            self._tar = tarfile.open(filepath, 'r:')
+            # one pass over the headers, data is skipped by seeking
+            self._members = { member.name: member for member in self._tar.getmembers() if member.isfile() }
+        else:
+            raise ValueError(f'Not a tar, zip, or sqlite container: {filepath}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for handle in (self._db, self._zip, self._tar):
+            if None != handle:
+                handle.close()
+        self._db = self._zip = self._tar = None
+
+    def names(self):
+        if None != self._db:
+            with self._lock:
+                return [row[0] for row in self._db.execute('SELECT name FROM files ORDER BY rowid')]
+        if None != self._zip:
+            return [name for name in self._zip.namelist() if not name.endswith('/')]
+        return list(self._members)
+
+    def read(self, name:str):
+        with self._lock:
+            if None != self._db:
+                row = self._db.execute('SELECT data FROM files WHERE name = ?', (name,)).fetchone()
+                if None == row:
+                    raise KeyError(name)
+                return bytes(row[0])
+            if None != self._zip:
+                return self._zip.read(name)
+            with self._tar.extractfile(self._members[name]) as entry_file:
+                return entry_file.read()
+
+def default_output_directory(container_filepath:str):
+    """where commands reading a container write their outputs, ie. `out/script.npk` for `out/script.npk.tar`"""
+    noext, ext = os.path.splitext(container_filepath)
+    return noext
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# filtering.py
+#
+# include/exclude path matching, compiled once per run
+##
+
+import fnmatch
+import re
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+def _parse_patterns(value:str|list):
+    if None == value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    patterns = []
+    for pattern in value:
+        if pattern.startswith('@'):
+            # a list file, one pattern per line, ie. written by `diff --include-out`
+            with open(pattern[1:], 'rt', encoding='utf-8') as list_file:
+                patterns.extend(line.rstrip('\r\n') for line in list_file if not line.startswith('#'))
+        else:
+            patterns.append(pattern)
+    # an empty pattern would otherwise match every path
+    return [pattern for pattern in patterns if 0 < len(pattern)]
+
+# leading inline flags, ie. `(?i)`, which are only valid at the start of a whole expression
+_re_global_flags = re.compile(r'\A\(\?([aiLmsux]+)\)')
+
+def _translate(pattern:str):
+    if pattern.startswith('re:'):
+        expression = pattern[3:]
+        try:
+            re.compile(expression)
+        except re.error as ex:
+            raise ValueError(f'Invalid pattern `{pattern}`, {ex}') from ex
+        # scoped to this pattern, the patterns of a list are joined into one expression
+        match = _re_global_flags.match(expression)
+        if None != match:
+            return f'(?{match.group(1)}:{expression[match.end():]})'
+        return f'(?:{expression})'
+    if any(c in pattern for c in '*?['):
+        # globs match whole paths, `*` also matches `/`
+        return f'(?:\\A{fnmatch.translate(pattern)})'
+    # anything else is a substring, as `--exclude` has always been
+    return re.escape(pattern)
+
+class _Patterns:
+    """
+    a compiled pattern list, `=` items are whole paths looked up in a set so that long lists of
+    exact paths cost the same as one.
+    """
+    _exact:frozenset
+    _regex:re.Pattern
+
+    def __init__(self, patterns:list):
+        self._exact = frozenset(pattern[1:] for pattern in patterns if pattern.startswith('='))
+        patterns = [pattern for pattern in patterns if not pattern.startswith('=')]
+        self._regex = None if 0 == len(patterns) else re.compile('|'.join(_translate(pattern) for pattern in patterns))
+
+    def matches(self, path:str):
+        return path in self._exact or (None != self._regex and None != self._regex.search(path))
+
+def _compile(patterns:list):
+    if 0 == len(patterns):
+        return None
+    return _Patterns(patterns)
+
+class PathFilter:
+    """
+    a compiled `--include`/`--exclude` matcher.
+
+    patterns are CSV lists where each item is a substring (`mipmap.png`), a glob (`*.pvr`,
+    `ui/*`), a regular expression prefixed with `re:` (`re:_(normal|albedo)\\.`), or a whole
+    path prefixed with `=` (`=ui/icon.png`). an item prefixed with `@` names a file of patterns,
+    one per line. every pattern of a list is combined into one regular expression, so a path is
+    scanned once no matter how many patterns there are.
+    """
+    _include:_Patterns
+    _exclude:_Patterns
+
+    def __init__(self, include:str|list = None, exclude:str|list = None):
+        self._include = _compile(_parse_patterns(include))
+        self._exclude = _compile(_parse_patterns(exclude))
+
+    @staticmethod
+    def from_args(args):
+        return PathFilter(getattr(args, 'include', None), getattr(args, 'exclude', None))
+
+    def __bool__(self):
+        return None != self._include or None != self._exclude
+
+    def excludes(self, path:str):
+        """
+        `True` if `path` matches an exclusion, inclusions are not considered.
+        """
+        if None != self._exclude and self._exclude.matches(path):
+            _log.debug('`%s` is excluded.', path)
+            return True
+        return False
+
+    def accepts(self, *paths:str):
+        """
+        `True` if no path is excluded, and (when inclusions are given) at least one path is included.
+        """
+        for path in paths:
+            if self.excludes(path):
+                return False
+        if None == self._include:
+            return True
+        for path in paths:
+            if self._include.matches(path):
+                return True
+        _log.debug('`%s` is not included.', paths[0])
+        return False
@@ -6,28 +6,89 @@
 # image processing tools
 ##
 
+import concurrent.futures
 import os
 import shutil
 import subprocess
+import threading
+from ..util import pvr
+from ..util.lazyimport import LazyModule
 from ..util.logging import Logger
 
+numpy = LazyModule('numpy')
+Image = LazyModule('PIL.Image')
+
 _path_PVRTexToolCLI = shutil.which('PVRTexToolCLI')
 _path_im_convert = shutil.which('convert')
 _path_im_montage = shutil.which('montage')
 
 _log = Logger(__name__)
 
+# the in-process equivalents of the `--recolor` chains passed to ImageMagick by `magick()`,
+# as (brightness, saturation) for `-modulate` and (black, white) for `-level`
+_recolor_presets = {
+    '.webp': {
+        'modulate': None,
+        'level': (0.45, 0.95)
+    },
+    '.png': {
+        'modulate': (1.05, 1.50),
+        'level': (0.30, 0.95)
+    }
+}
+_recolor_luts = {}
+# rows per slice when modulating, bounds the float working set for large textures
+_modulate_rows = 256
+
+class ImagePipeline:
+    """
+    a post-processing stage with a bounded work queue, fed by the extractor as entries land.
+
+    work runs on `jobs` threads, which mostly wait on external tools. `submit()` blocks once
+    `depth` items are pending so the extractor cannot run arbitrarily far ahead.
+    """
+    _executor:concurrent.futures.ThreadPoolExecutor
+    _slots:threading.BoundedSemaphore
+    _errors:list
+
+    def __init__(self, jobs:int, depth:int = None):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='imgtools')
+        self._slots = threading.BoundedSemaphore(depth if None != depth else jobs * 4)
+        self._errors = []
+
+    def submit(self, fn, *args):
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def join(self):
+        self._executor.shutdown(wait=True)
+        if 0 < len(self._errors):
+            raise self._errors[0]
+
+    def cancel(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _on_done(self, future:concurrent.futures.Future):
+        self._slots.release()
+        if not future.cancelled() and None != future.exception():
+            self._errors.append(future.exception())
+
 def pvr2png(filepath:str, force:bool):
     global _path_PVRTexToolCLI
-    tool_path = _path_PVRTexToolCLI
-    if None == tool_path or 0 >= len(tool_path):
-        return filepath
     png_filepath = filepath.replace('.pvr', '.png')
     if os.path.isfile(png_filepath):
         if force:
             os.remove(png_filepath)
         else:
             return png_filepath
+    # decode in-process when possible, PVRTexToolCLI remains the fallback for unsupported formats
+    if _pvr2png_inprocess(filepath, png_filepath):
+        return png_filepath
+    tool_path = _path_PVRTexToolCLI
+    if None == tool_path or 0 >= len(tool_path):
+        return filepath
     proc = subprocess.Popen(
         [
             tool_path,
@@ -40,18 +101,28 @@ def pvr2png(filepath:str, force:bool):
     proc.wait()
     if not os.path.isfile(png_filepath):
         _log.warn(f'pvr2png() did not produce any output for: {filepath}')
-        # TODO: sometimes when this happens it's because the file is a PNG file (possibly others) with an incorrect 'pvr' file extension
         return filepath
     return png_filepath
 
+def _pvr2png_inprocess(filepath:str, png_filepath:str):
+    with open(filepath, 'rb') as pvr_file:
+        buf = pvr_file.read()
+    # some files are PNG files with an incorrect 'pvr' file extension
+    if pvr.is_png(buf):
+        with open(png_filepath, 'wb') as png_file:
+            png_file.write(buf)
+        return True
+    pixels = pvr.decode(buf)
+    if pixels is None:
+        _log.trace('pvr2png() in-process decode not supported for: %s', filepath)
+        return False
+    Image.fromarray(pixels, 'RGBA').save(png_filepath)
+    return True
+
 def magick(filepath:str, options:dict):
     global _path_im_convert
-    tool_path = _path_im_convert
-    if None == tool_path or 0 >= len(tool_path):
-        _log.debug(f'magick[1]: {filepath}, {options}')
-        return filepath
     if options['existing_img'] and not options['force']:
-        _log.debug(f'magick[2]: {filepath}, {options}')
+        _log.debug('magick[2]: %s, %s', filepath, options)
         return filepath
     noext, ext = os.path.splitext(filepath)
     if options['img_format']:
@@ -61,8 +132,17 @@ def magick(filepath:str, options:dict):
         if options['force']:
             os.remove(out_filepath)
         else:
-            _log.debug(f'magick[4]: {filepath}, {options}')
+            _log.debug('magick[4]: %s, %s', filepath, options)
+            return out_filepath
+    # `custom_args` are ImageMagick arguments, everything else is handled in-process when possible
+    if 'magick' != options.get('engine', 'auto') and 0 == len(options['custom_args']):
+        if _magick_inprocess(filepath, out_filepath, ext, options):
+            _log.debug('magick[0]: %s, %s', filepath, options)
             return out_filepath
+    tool_path = _path_im_convert
+    if None == tool_path or 0 >= len(tool_path):
+        _log.debug('magick[1]: %s, %s', filepath, options)
+        return filepath
     magick_args = [
         tool_path,
         filepath,
@@ -94,7 +174,7 @@ def magick(filepath:str, options:dict):
     # removed, we still perform `-strip` in this case
     # elif filepath == out_filepath and (0 == len(options['custom_args']) or not options['recolor']):
     #     # no `--recolor`, no `custom_args`, and file extensions are identical, nothing to do
-    #     _log.debug(f'magick[5]: {filepath}, {options}')
+    #     _log.debug('magick[5]: %s, %s', filepath, options)
     #     return out_filepath
     magick_args += [
         '-quality', '100',
@@ -105,9 +185,79 @@ def magick(filepath:str, options:dict):
     if not os.path.isfile(out_filepath):
         _log.warn(f'magick() did not produce an output file for: {filepath}')
         return filepath
-    _log.debug(f'magick[6]: {filepath}, {options}')
+    _log.debug('magick[6]: %s, %s', filepath, options)
     return out_filepath
 
+def _magick_inprocess(filepath:str, out_filepath:str, ext:str, options:dict):
+    try:
+        with Image.open(filepath) as image:
+            image.load()
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            # `-strip`, no metadata is carried over
+            image = image.convert('RGBA' if has_alpha and '.jpg' != ext else 'RGB')
+    except (OSError, ValueError) as ex:
+        _log.trace('magick() in-process decode failed for: %s, %s', filepath, ex)
+        return False
+    if options['recolor'] and ext in _recolor_presets:
+        image = _recolor(image, _recolor_presets[ext])
+    match (ext):
+        case '.png':
+            image.save(out_filepath, 'PNG', compress_level=9)
+        case '.webp':
+            image.save(out_filepath, 'WEBP', lossless=True, quality=100)
+        case '.jpg':
+            image.save(out_filepath, 'JPEG', quality=100)
+        case _:
+            image.save(out_filepath)
+    return True
+
+def _recolor(image, preset:dict):
+    pixels = numpy.array(image)
+    rgb = pixels[:, :, :3]
+    if None != preset['modulate']:
+        brightness, saturation = preset['modulate']
+        for row in range(0, rgb.shape[0], _modulate_rows):
+            rgb[row:row + _modulate_rows] = _modulate_hsl(rgb[row:row + _modulate_rows], brightness, saturation)
+    # `-level` followed by `-colorspace RGB` is a per-channel mapping, applied as one lookup table
+    rgb[...] = _recolor_lut(*preset['level'])[rgb]
+    return Image.fromarray(pixels, image.mode)
+
+def _recolor_lut(black:float, white:float):
+    lut = _recolor_luts.get((black, white))
+    if lut is None:
+        value = numpy.clip((numpy.arange(256, dtype=numpy.float64) / 255.0 - black) / (white - black), 0.0, 1.0)
+        # sRGB -> linear RGB
+        value = numpy.where(value <= 0.04045, value / 12.92, ((value + 0.055) / 1.055) ** 2.4)
+        lut = numpy.round(value * 255.0).astype(numpy.uint8)
+        _recolor_luts[(black, white)] = lut
+    return lut
+
+def _modulate_hsl(rgb, brightness:float, saturation:float):
+    rgb = rgb.astype(numpy.float32) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    high = rgb.max(axis=-1)
+    low = rgb.min(axis=-1)
+    delta = high - low
+    l = (high + low) / 2.0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        s = numpy.where(0 == delta, 0.0, numpy.where(l <= 0.5, delta / (high + low), delta / (2.0 - high - low)))
+        h = numpy.where(0 == delta, 0.0,
+            numpy.where(high == r, ((g - b) / delta) % 6.0,
+            numpy.where(high == g, (b - r) / delta + 2.0, (r - g) / delta + 4.0)))
+    # like ImageMagick, lightness and saturation are scaled without clamping, the result is clamped
+    l = l * brightness
+    s = s * saturation
+    c = (1.0 - numpy.abs(2.0 * l - 1.0)) * s
+    x = c * (1.0 - numpy.abs(h % 2.0 - 1.0))
+    m = l - c / 2.0
+    sector = numpy.floor(h).astype(numpy.int32) % 6
+    zero = numpy.zeros_like(c)
+    out = numpy.stack([
+        numpy.choose(sector, [c, x, zero, zero, x, c]),
+        numpy.choose(sector, [x, c, c, x, zero, zero]),
+        numpy.choose(sector, [zero, zero, x, c, c, x])], axis=-1) + m[..., None]
+    return numpy.round(numpy.clip(out, 0.0, 1.0) * 255.0).astype(numpy.uint8)
+
 def stitch(ordered_images:list, scan_width:int, output_filepath:str, force:bool):
     if os.path.isfile(output_filepath):
         if not force:
@@ -0,0 +1,25 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# lazyimport.py
+#
+# deferred imports of dependencies which are slow to load
+##
+
+import importlib
+
+class LazyModule:
+    """
+    stands in for the module `name`, which is imported on first attribute access. every command
+    imports every module, so `numpy` and `PIL.Image` are only loaded by commands that use them.
+    """
+    _name:str
+
+    def __init__(self, name:str):
+        self._name = name
+
+    def __getattr__(self, attr:str):
+        # only reached for attributes not yet copied onto this object
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value)
+        return value
@@ -1,6 +1,10 @@
 # SPDX-FileCopyrightText: © 2024 Shaun Wilson
 # SPDX-License-Identifier: MIT
 
+import os
+import sys
+import threading
+import time
 from enum import IntEnum
 
 class LogLevel(IntEnum):
@@ -10,32 +14,164 @@ class LogLevel(IntEnum):
     WARNING = 4
     ERROR = 8
 
+_styles = {
+    LogLevel.TRACE: ('\x1b[3;2;37m', '\x1b[23m'),
+    LogLevel.DEBUG: ('\x1b[2;37m', ''),
+    LogLevel.INFORMATION: ('\x1b[0;39m', ''),
+    LogLevel.WARNING: ('\x1b[1;33m', ''),
+    LogLevel.ERROR: ('\x1b[1;31m', '')
+}
+_level_names = {
+    LogLevel.TRACE: 'trace',
+    LogLevel.DEBUG: 'debug',
+    LogLevel.INFORMATION: 'info',
+    LogLevel.WARNING: 'warn',
+    LogLevel.ERROR: 'error'
+}
+# progress redraws per second, on a terminal and otherwise
+_progress_rate = 10.0
+_progress_rate_plain = 0.2
+# serializes everything written to stdout, so progress redraws never interleave with log lines
+_output_lock = threading.Lock()
+
+def _format(message, args:tuple):
+    # only called once the level check passed, callables and `%`-style args defer the work until here
+    if callable(message):
+        message = message()
+    if 0 < len(args):
+        return message % args
+    return message
+
+class _ProgressRenderer:
+    """
+    draws the most recent progress state at most `rate` times a second, from a background thread.
+
+    `update()` only stores the state, so a hot loop reporting every entry pays for a tuple rather
+    than a formatted string and terminal I/O.
+    """
+    _state:tuple = None
+    _drawn:tuple = None
+    _thread:threading.Thread = None
+
+    def update(self, state:tuple):
+        self._state = state
+        if None == self._thread:
+            self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+            self._thread.start()
+
+    def discard(self):
+        # the line was overwritten by something else, the pending state is stale
+        self._state = self._drawn = None
+
+    def _run(self):
+        while True:
+            time.sleep(1.0 / (_progress_rate_plain if Logger._plain else _progress_rate))
+            state = self._state
+            if None == state or state is self._drawn or not Logger._progress:
+                continue
+            with _output_lock:
+                if state is not self._state:
+                    # superseded while waiting on the lock, the next tick draws the newer state
+                    continue
+                self._drawn = state
+                context, message, value, max_value = state
+                percent = round((value / max_value) * 100.0, 1) if 0 < max_value else 100.0
+                if Logger._plain:
+                    Logger._writeline('progress', context, f'[{value}/{max_value}] {percent}% {message}')
+                else:
+                    sys.stdout.write(f'\x1b[0m[{value}/{max_value}] {percent}% {message}\x1b[0J\r')
+                    sys.stdout.flush()
+
+_renderer = _ProgressRenderer()
+
+def _after_fork():
+    # a lock or renderer thread captured mid-use by `fork()` is unusable in the child
+    global _output_lock, _renderer
+    _output_lock = threading.Lock()
+    _renderer = _ProgressRenderer()
+
+os.register_at_fork(after_in_child=_after_fork)
+
 class Logger:
-    _logLevel: LogLevel
+    _logLevel: LogLevel = LogLevel.INFORMATION
     _context: str
+    _progress: bool = True
+    """when set, lines are written without escape codes and prefixed with a timestamp and level, see `set_format()`"""
+    _plain: bool = not sys.stdout.isatty()
     def __init__(self, context: str = ""):
         self._context = context
-        Logger._logLevel = LogLevel.INFORMATION
     def set_loglevel(self, level: LogLevel):
         Logger._logLevel = level
-    def write(self, level: LogLevel, message: str):
-        if level >= Logger._logLevel:
+    def set_progress(self, enabled: bool):
+        Logger._progress = enabled
+    def set_format(self, format: str):
+        """`ansi` for a terminal, `plain` for logs and pipes, or `auto` to choose by whether stdout is a terminal"""
+        match (format):
+            case 'ansi':
+                Logger._plain = False
+            case 'plain':
+                Logger._plain = True
+            case _:
+                Logger._plain = not sys.stdout.isatty()
+    def is_enabled(self, level: LogLevel):
+        return level >= Logger._logLevel
+    def write(self, level: LogLevel, message, *args):
+        if level < Logger._logLevel:
+            return
+        message = _format(message, args)
+        with _output_lock:
+            if Logger._plain:
+                Logger._writeline(_level_names.get(level, str(int(level))), self._context, message)
+                return
+            style, unstyle = _styles.get(level, ('', ''))
             if len(self._context) > 0:
-                print(f'\x1b[0m[{self._context}] {message}')
+                print(f'\x1b[0m[{self._context}] {style}{message}{unstyle}')
             else:
-                print(message)
-    def trace(self, message: str):
-        self.write(LogLevel.TRACE, f'\x1b[3;2;37m{message}\x1b[23m')
-    def debug(self, message: str):
-        self.write(LogLevel.DEBUG, f'\x1b[2;37m{message}')
-    def info(self, message: str):
-        self.write(LogLevel.INFORMATION, f'\x1b[0;39m{message}')
-    def warn(self, message: str):
-        self.write(LogLevel.WARNING, f'\x1b[1;33m{message}')
-    def error(self, message: str):
-        self.write(LogLevel.ERROR, f'\x1b[1;31m{message}')
+                print(f'{style}{message}{unstyle}')
+    def trace(self, message, *args):
+        self.write(LogLevel.TRACE, message, *args)
+    def debug(self, message, *args):
+        self.write(LogLevel.DEBUG, message, *args)
+    def info(self, message, *args):
+        self.write(LogLevel.INFORMATION, message, *args)
+    def warn(self, message, *args):
+        self.write(LogLevel.WARNING, message, *args)
+    def error(self, message, *args):
+        self.write(LogLevel.ERROR, message, *args)
     def activity(self, message: str):
-        print(f'\x1b[0m{message}\x1b[0J', end = '\r')
+        if not Logger._progress:
+            return
+        with _output_lock:
+            _renderer.discard()
+            if Logger._plain:
+                message = message.strip()
+                if 0 < len(message):
+                    Logger._writeline('info', self._context, message)
+                return
+            sys.stdout.write(f'\x1b[0m{message}\x1b[0J\r')
+            sys.stdout.flush()
     def progress(self, message: str, value: float, max_value: float, force:bool = True):
-        if force or (0 == value % 47):
-            print(f'\x1b[0m[{value}/{max_value}] {round((value/max_value)*100.0,1)}% {message}\x1b[0J', end = '\r')
+        """
+        reports progress, drawn by a background thread at a fixed rate. `force` is accepted for
+        compatibility, every update is coalesced regardless.
+        """
+        if not Logger._progress:
+            return
+        _renderer.update((self._context, message, value, max_value))
+    @staticmethod
+    def _writeline(kind: str, context: str, message: str):
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+        if len(context) > 0:
+            line = f'{timestamp} {kind:<8} [{context}] {message}\n'
+        else:
+            line = f'{timestamp} {kind:<8} {message}\n'
+        # worker processes share stdout, the whole line goes out in one `write()` so lines never interleave
+        sys.stdout.flush()
+        try:
+            fd = sys.stdout.fileno()
+        except (AttributeError, OSError):
+            sys.stdout.write(line)
+            return
+        data = line.encode(sys.stdout.encoding or 'utf-8', 'replace')
+        while 0 < len(data):
+            data = data[os.write(fd, data):]
@@ -0,0 +1,243 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# metrics.py
+#
+# per-stage timing and byte counters, and optional profiling of a single stage
+##
+
+import contextlib
+import cProfile
+import csv
+import glob
+import json
+import multiprocessing.util
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+# the stage names recorded by `NXPKFormatHandler`, `decompress` is recorded per codec as `decompress:<codec>`
+stage_names = [
+    'unpack',
+    'index',
+    'read',
+    'decompress',
+    'write',
+    'pvr2png',
+    'magick'
+]
+_no_stage = contextlib.nullcontext()
+
+class StageProfiler:
+    """
+    cProfile (or with `memory`, tracemalloc) capture around every run of one stage.
+
+    one run is captured at a time, runs of the stage on other threads while one is being captured
+    are timed but not profiled. `stage` also matches its sub-stages, ie. `decompress` covers
+    `decompress:zlib`.
+    """
+    stage:str
+    memory:bool
+    filepath:str
+    _lock:threading.Lock
+    _profile:cProfile.Profile
+    _baseline:int
+
+    def __init__(self, stage:str, memory:bool = False, filepath:str = None):
+        self.stage = stage
+        self.memory = memory
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._profile = None if memory else cProfile.Profile()
+        self._baseline = 0
+
+    def matches(self, name:str):
+        return self.stage == name or name.startswith(f'{self.stage}:')
+
+    def enter(self):
+        if not self._lock.acquire(blocking=False):
+            return False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        else:
+            self._profile.enable()
+        return True
+
+    def exit(self):
+        """returns the peak traced memory of the run in bytes, when capturing memory"""
+        try:
+            if self.memory:
+                return max(0, tracemalloc.get_traced_memory()[1] - self._baseline)
+            self._profile.disable()
+            return None
+        finally:
+            self._lock.release()
+
+    def dump(self, filepath:str = None):
+        if None == self._profile:
+            return
+        filepath = filepath if None != filepath else self.filepath
+        if None != filepath:
+            self._profile.dump_stats(filepath)
+
+# the profiler of this process, see `configure_profiling()`
+_profiler:StageProfiler = None
+
+def configure_profiling(stage:str, memory:bool = False, filepath:str = None, worker:bool = False):
+    """
+    profiles `stage` in this process. a `worker` process writes its stats to `{filepath}.{pid}` as it
+    exits, for `merge_profiles()` to collect.
+    """
+    global _profiler
+    if None == stage:
+        _profiler = None
+        return
+    _profiler = StageProfiler(stage, memory, filepath)
+    if worker and not memory:
+        # runs as a pool worker process exits normally, `atexit` does not
+        multiprocessing.util.Finalize(None, _profiler.dump, args=(f'{filepath}.{os.getpid()}',), exitpriority=10)
+
+def merge_profiles(filepath:str):
+    """
+    writes the stats of this process to `filepath`, combined with any stats left by worker processes.
+    """
+    if None == _profiler or _profiler.memory:
+        return
+    _profiler.dump(filepath)
+    parts = glob.glob(f'{glob.escape(filepath)}.*')
+    stats = None
+    for part in [filepath] + parts:
+        try:
+            stats = pstats.Stats(part) if None == stats else stats.add(part)
+        except TypeError:
+            # `pstats` rejects a profile without any calls, ie. a process which never ran the stage
+            pass
+    for part in parts:
+        os.remove(part)
+    if None == stats:
+        os.remove(filepath)
+        _log.warn(f'Stage `{_profiler.stage}` never ran, no profile written.')
+        return
+    stats.dump_stats(filepath)
+    _log.info(f'Profile of stage `{_profiler.stage}` written to: {filepath}')
+
+class Metrics:
+    """
+    time, bytes and runs per stage, plus named entry counters, for one unit of work (an archive.)
+
+    stages may run on several threads at once, the seconds of a stage are then the sum over its
+    threads and may exceed wall time. snapshots are plain dicts so they can cross process boundaries.
+    """
+    _lock:threading.Lock
+    _stages:dict
+    _counts:dict
+    _start_time:float
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counts = {}
+        self._start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name:str, nbytes:int = 0):
+        profiling = None != _profiler and _profiler.matches(name) and _profiler.enter()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            peak_bytes = _profiler.exit() if profiling else None
+            self.add(name, seconds, nbytes, 1, peak_bytes)
+
+    def add(self, name:str, seconds:float, nbytes:int = 0, runs:int = 1, peak_bytes:int = None):
+        with self._lock:
+            stage = self._stages.get(name)
+            if None == stage:
+                stage = self._stages[name] = { 'runs': 0, 'bytes': 0, 'seconds': 0.0 }
+            stage['runs'] += runs
+            stage['bytes'] += nbytes
+            stage['seconds'] += seconds
+            if None != peak_bytes:
+                stage['peak_bytes'] = max(stage.get('peak_bytes', 0), peak_bytes)
+
+    def count(self, name:str, n:int = 1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def merge(self, snapshot:dict):
+        for name, stage in snapshot.get('stages', {}).items():
+            self.add(name, stage['seconds'], stage['bytes'], stage['runs'], stage.get('peak_bytes'))
+        for name, n in snapshot.get('counts', {}).items():
+            self.count(name, n)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'seconds': time.perf_counter() - self._start_time,
+                'stages': { name: dict(stage) for name, stage in self._stages.items() },
+                'counts': dict(self._counts)
+            }
+
+    def take(self):
+        """returns a snapshot and resets, for workers reporting increments"""
+        with self._lock:
+            snapshot = { 'stages': self._stages, 'counts': self._counts }
+            self._stages = {}
+            self._counts = {}
+            return snapshot
+
+def stage(metrics:Metrics, name:str, nbytes:int = 0):
+    """`metrics.stage()`, or a no-op when `metrics` is `None`"""
+    return _no_stage if None == metrics else metrics.stage(name, nbytes)
+
+def totals(reports:dict):
+    metrics = Metrics()
+    seconds = 0.0
+    for report in reports.values():
+        metrics.merge(report)
+        seconds += report.get('seconds', 0.0)
+    snapshot = metrics.snapshot()
+    snapshot['seconds'] = seconds
+    return snapshot
+
+def save_report(filepath:str, reports:dict):
+    """
+    writes per-archive snapshots (and their totals) as JSON, or as CSV when `filepath` ends in `.csv`.
+    """
+    total = totals(reports)
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    if filepath.endswith('.csv'):
+        with open(filepath, 'wt', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['archive', 'kind', 'name', 'runs', 'bytes', 'seconds', 'mb_per_s', 'peak_bytes'])
+            for archive, report in [('*', total)] + list(reports.items()):
+                writer.writerow([archive, 'archive', '', '', '', f'{report.get("seconds", 0.0):.6f}', '', ''])
+                for name, stage in report.get('stages', {}).items():
+                    writer.writerow([archive, 'stage', name, stage['runs'], stage['bytes'], f'{stage["seconds"]:.6f}', f'{_mb_per_s(stage):.2f}', stage.get('peak_bytes', '')])
+                for name, n in report.get('counts', {}).items():
+                    writer.writerow([archive, 'count', name, n, '', '', '', ''])
+    else:
+        with open(filepath, 'wt') as json_file:
+            json.dump({ 'totals': total, 'archives': reports }, json_file, indent='\t')
+    _log.info(f'Metrics written to: {filepath}')
+    return total
+
+def log_summary(snapshot:dict):
+    _log.info(f'{"stage":<18} {"runs":>8} {"MB":>10} {"seconds":>10} {"MB/s":>9}')
+    for name, stage in sorted(snapshot.get('stages', {}).items(), key=lambda e: e[1]['seconds'], reverse=True):
+        _log.info(f'{name:<18} {stage["runs"]:>8} {stage["bytes"] / (1024 * 1024):>10.1f} {stage["seconds"]:>10.3f} {_mb_per_s(stage):>9.1f}')
+    counts = snapshot.get('counts', {})
+    if 0 < len(counts):
+        _log.info(', '.join(f'{name}={n}' for name, n in sorted(counts.items())))
+
+def _mb_per_s(stage:dict):
+    return (stage['bytes'] / (1024 * 1024)) / stage['seconds'] if 0 < stage['seconds'] else 0.0
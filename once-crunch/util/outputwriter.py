@@ -0,0 +1,236 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# outputwriter.py
+#
+# background writing of extracted files, with cached directory and existence checks
+##
+
+import contextlib
+import os
+import queue
+import threading
+import time
+from ..util import metrics
+from ..util.logging import Logger
+
+_log = Logger(__name__)
+
+class OutputWriter:
+    """
+    writes extracted files on `threads` background threads. writes are handed over in batches of up
+    to `batch_size` files, and at most `max_pending_bytes` may be queued, so extraction continues
+    while the filesystem catches up without the handover costing more than the write.
+
+    parent directories are created once and remembered, and existence checks are answered from a
+    single listing per directory, which leaves the open/write/close of each file as the only
+    per-file filesystem traffic. with `threads` of `0` files are written on the calling thread.
+    with `atomic` every file is written under a temporary name and renamed into place, so an
+    interrupted run never leaves a truncated file under its final name.
+    """
+    atomic:bool
+    files:int
+    bytes:int
+    _threads:list
+    _queue:queue.SimpleQueue
+    _batch:list
+    _batch_bytes:int
+    _batch_size:int
+    _max_pending_bytes:int
+    _pending_bytes:int
+    _pending:set
+    _condition:threading.Condition
+    _directories:set
+    _listings:dict
+    _errors:dict
+    _metrics:metrics.Metrics
+    _start_time:float
+
+    def __init__(self, threads:int = 2, atomic:bool = False, max_pending_bytes:int = 256 * 1024 * 1024, metrics:metrics.Metrics = None, directories:set = None, batch_size:int = 64):
+        self.atomic = atomic
+        self.files = 0
+        self.bytes = 0
+        self._queue = queue.SimpleQueue()
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_size = batch_size
+        self._max_pending_bytes = max_pending_bytes
+        self._pending_bytes = 0
+        self._pending = set()
+        self._condition = threading.Condition()
+        self._directories = set(directories) if None != directories else set()
+        self._listings = {}
+        self._errors = {}
+        self._metrics = metrics
+        self._start_time = None
+        self._threads = [threading.Thread(target=self._run, name=f'writer_{n}', daemon=True) for n in range(max(0, threads))]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def directories(self):
+        return frozenset(self._directories)
+
+    def prepare(self, filepaths):
+        """creates the parent directory of every path in `filepaths`, once each"""
+        for dirpath in sorted({os.path.dirname(os.path.abspath(filepath)) for filepath in filepaths}):
+            self.ensure_directory(dirpath)
+
+    def ensure_directory(self, dirpath:str):
+        if dirpath in self._directories:
+            return
+        os.makedirs(dirpath, exist_ok=True)
+        # every ancestor exists now too
+        while 0 < len(dirpath) and dirpath not in self._directories:
+            self._directories.add(dirpath)
+            dirpath = os.path.dirname(dirpath)
+
+    def exists(self, filepath:str):
+        """
+        whether `filepath` existed when its directory was first listed, files written since are not seen.
+        """
+        dirpath, name = os.path.split(os.path.abspath(filepath))
+        listing = self._listings.get(dirpath)
+        if None == listing:
+            try:
+                listing = frozenset(os.listdir(dirpath))
+            except (FileNotFoundError, NotADirectoryError):
+                listing = frozenset()
+            self._listings[dirpath] = listing
+        return name in listing
+
+    def write(self, data:bytes|memoryview, filepath:str, force:bool = False):
+        """
+        queues `data` to be written to `filepath`, blocking while the queue is full. `data` must stay
+        valid until the write completes, see `wait()`.
+        """
+        if not force and self.exists(filepath):
+            raise FileExistsError(f'File exists {filepath}.')
+        if None == self._start_time:
+            self._start_time = time.perf_counter()
+        if 0 == len(self._threads):
+            self._write(data, filepath)
+            return
+        size = len(data)
+        if self._pending_bytes + self._batch_bytes + size > self._max_pending_bytes:
+            self.flush()
+            with self._condition:
+                if 0 < len(self._errors):
+                    raise next(iter(self._errors.values()))
+                if 0 < self._pending_bytes and self._pending_bytes + size > self._max_pending_bytes:
+                    # a single entry larger than the whole budget is admitted once the queue drains
+                    with metrics.stage(self._metrics, 'write:wait'):
+                        while 0 < self._pending_bytes and self._pending_bytes + size > self._max_pending_bytes:
+                            self._condition.wait()
+        self._batch.append((data, filepath))
+        self._batch_bytes += size
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """hands the current batch to the writer threads"""
+        if 0 == len(self._batch):
+            return
+        batch, size = self._batch, self._batch_bytes
+        self._batch = []
+        self._batch_bytes = 0
+        with self._condition:
+            self._pending_bytes += size
+            self._pending.update(filepath for data, filepath in batch)
+        self._queue.put(batch)
+
+    def wait(self, filepath:str):
+        """blocks until a queued write of `filepath` completes, raising its error if it failed"""
+        if any(filepath == pending for data, pending in self._batch):
+            self.flush()
+        with self._condition:
+            while filepath in self._pending:
+                self._condition.wait()
+            if filepath in self._errors:
+                raise self._errors[filepath]
+
+    @contextlib.contextmanager
+    def open(self, filepath:str, force:bool = False):
+        """opens `filepath` for writing on the calling thread, for entries too large to queue"""
+        if not force and self.exists(filepath):
+            raise FileExistsError(f'File exists {filepath}.')
+        self.ensure_directory(os.path.dirname(os.path.abspath(filepath)))
+        if None == self._start_time:
+            self._start_time = time.perf_counter()
+        if not self.atomic:
+            with open(filepath, 'wb') as binary_file:
+                yield binary_file
+                size = binary_file.tell()
+            self.record(size)
+            return
+        tmp_filepath = f'{filepath}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_filepath, 'wb') as binary_file:
+                yield binary_file
+                size = binary_file.tell()
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_filepath)
+            raise
+        self.record(size)
+
+    def join(self):
+        """waits for every queued write, raises the first error"""
+        self.flush()
+        self._stop()
+        if 0 < len(self._errors):
+            raise next(iter(self._errors.values()))
+
+    def cancel(self):
+        """discards writes which have not started, and waits for the rest"""
+        self._batch = []
+        self._batch_bytes = 0
+        with contextlib.suppress(queue.Empty):
+            while True:
+                self._queue.get_nowait()
+        self._stop()
+
+    def record(self, size:int, files:int = 1):
+        """counts a write towards `throughput()`, `open()` and `write()` count their own, this is for writes made elsewhere (ie. by worker processes)"""
+        with self._condition:
+            if None == self._start_time:
+                self._start_time = time.perf_counter()
+            self.files += files
+            self.bytes += size
+
+    def throughput(self):
+        """`(files, bytes, seconds)` since the first write"""
+        seconds = 0.0 if None == self._start_time else time.perf_counter() - self._start_time
+        return self.files, self.bytes, seconds
+
+    def _stop(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _write(self, data:bytes|memoryview, filepath:str):
+        with metrics.stage(self._metrics, 'write', len(data)):
+            with self.open(filepath, True) as binary_file:
+                binary_file.write(data)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if None == batch:
+                return
+            size = 0
+            errors = {}
+            for data, filepath in batch:
+                size += len(data)
+                try:
+                    self._write(data, filepath)
+                except Exception as ex:
+                    errors[filepath] = ex
+            with self._condition:
+                self._pending_bytes -= size
+                self._pending.difference_update(filepath for data, filepath in batch)
+                self._errors.update(errors)
+                self._condition.notify_all()
@@ -0,0 +1,352 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# pvr.py
+#
+# in-process PVR v3 texture decoding
+#
+# only the top-level surface (mip 0, surface 0, face 0, slice 0) is decoded,
+# matching what `PVRTexToolCLI -d` produces. supported pixel formats are
+# 8-bit-per-channel and 16-bit packed uncompressed formats, ETC1, ETC2
+# (RGB, RGBA, RGB A1) and BC1/BC2/BC3. anything else (PVRTC, ASTC, float
+# formats, ..) returns `None` so callers can fall back to PVRTexToolCLI.
+##
+
+import struct
+from ..util.lazyimport import LazyModule
+
+numpy = LazyModule('numpy')
+
+PVR3_MAGIC = 0x03525650
+PVR3_HEADER_SIZE = 52
+
+# ETC1/ETC2 modifier tables, indexed by (msb << 1 | lsb) of a pixel index
+_etc_modifiers = [
+    [2, 8, -2, -8],
+    [5, 17, -5, -17],
+    [9, 29, -9, -29],
+    [13, 42, -13, -42],
+    [18, 60, -18, -60],
+    [24, 80, -24, -80],
+    [33, 106, -33, -106],
+    [47, 183, -47, -183]
+]
+# ETC2 T/H mode distances
+_etc_distances = [3, 6, 11, 16, 23, 32, 41, 64]
+# EAC alpha modifier tables
+_eac_modifiers = [
+    [-3, -6, -9, -15, 2, 5, 8, 14],
+    [-3, -7, -10, -13, 2, 6, 9, 12],
+    [-2, -5, -8, -13, 1, 4, 7, 12],
+    [-2, -4, -6, -13, 1, 3, 5, 12],
+    [-3, -6, -8, -12, 2, 5, 7, 11],
+    [-3, -7, -9, -11, 2, 6, 8, 10],
+    [-4, -7, -8, -11, 3, 6, 7, 10],
+    [-3, -5, -8, -11, 2, 4, 7, 10],
+    [-2, -6, -8, -10, 1, 5, 7, 9],
+    [-2, -5, -8, -10, 1, 4, 7, 9],
+    [-2, -4, -8, -10, 1, 3, 7, 9],
+    [-2, -5, -7, -10, 1, 4, 6, 9],
+    [-3, -4, -7, -10, 2, 3, 6, 9],
+    [-1, -2, -3, -10, 0, 1, 2, 9],
+    [-4, -6, -8, -9, 3, 5, 7, 8],
+    [-3, -5, -7, -9, 2, 4, 6, 8]
+]
+
+def is_png(buf:bytes):
+    return buf.startswith(b'\x89PNG\r\n\x1a\n')
+
+def is_pvr3(buf:bytes):
+    return 4 <= len(buf) and PVR3_MAGIC == struct.unpack_from('<I', buf)[0]
+
+def read_header(buf:bytes):
+    if len(buf) < PVR3_HEADER_SIZE or not is_pvr3(buf):
+        return None
+    version, flags, pixel_format, colour_space, channel_type, height, width, depth, surface_count, face_count, mip_count, metadata_size = struct.unpack_from('<IIQIIIIIIIII', buf)
+    return {
+        'flags': flags,
+        'pixel_format': pixel_format,
+        'colour_space': colour_space,
+        'channel_type': channel_type,
+        'height': height,
+        'width': width,
+        'depth': depth,
+        'surface_count': surface_count,
+        'face_count': face_count,
+        'mip_count': mip_count,
+        'metadata_size': metadata_size,
+        'data_offset': PVR3_HEADER_SIZE + metadata_size
+    }
+
+def decode(buf:bytes):
+    """decodes the top-level surface of a PVR v3 texture into an RGBA `numpy` array, or returns `None` if unsupported"""
+    header = read_header(buf)
+    if None == header or 0 == header['width'] or 0 == header['height']:
+        return None
+    width = header['width']
+    height = header['height']
+    data = memoryview(buf)[header['data_offset']:]
+    pixel_format = header['pixel_format']
+    if 0 != (pixel_format >> 32):
+        return _decode_uncompressed(data, pixel_format, width, height)
+    blocks_x = (width + 3) // 4
+    blocks_y = (height + 3) // 4
+    block_count = blocks_x * blocks_y
+    match (pixel_format):
+        case 6: # ETC1
+            blocks = _decode_etc(_read_words(data, block_count, 8, '>u8'), False, False)
+        case 22: # ETC2 RGB
+            blocks = _decode_etc(_read_words(data, block_count, 8, '>u8'), True, False)
+        case 24: # ETC2 RGB A1
+            blocks = _decode_etc(_read_words(data, block_count, 8, '>u8'), True, True)
+        case 23: # ETC2 RGBA
+            words = _read_words(data, block_count * 2, 8, '>u8')
+            if words is None:
+                return None
+            blocks = _decode_etc(words[1::2], True, False)
+            if blocks is not None:
+                blocks[:, :, 3] = _decode_eac_alpha(words[0::2])
+        case 7: # BC1
+            blocks = _decode_bc1(_read_words(data, block_count, 8, '<u8'), True)
+        case 9: # BC2
+            words = _read_words(data, block_count * 2, 8, '<u8')
+            if words is None:
+                return None
+            blocks = _decode_bc1(words[1::2], False)
+            if blocks is not None:
+                blocks[:, :, 3] = _decode_bc2_alpha(words[0::2])
+        case 11: # BC3
+            words = _read_words(data, block_count * 2, 8, '<u8')
+            if words is None:
+                return None
+            blocks = _decode_bc1(words[1::2], False)
+            if blocks is not None:
+                blocks[:, :, 3] = _decode_bc3_alpha(words[0::2])
+        case _:
+            return None
+    if blocks is None:
+        return None
+    # blocks are (n, 16, 4) with pixels in row-major order, tile them into the image
+    image = blocks.reshape(blocks_y, blocks_x, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(blocks_y * 4, blocks_x * 4, 4)
+    return numpy.ascontiguousarray(image[:height, :width])
+
+def _read_words(data:memoryview, count:int, size:int, dtype:str):
+    if len(data) < count * size:
+        return None
+    return numpy.frombuffer(data, dtype=dtype, count=count)
+
+def _decode_uncompressed(data:memoryview, pixel_format:int, width:int, height:int):
+    names = [chr(c) for c in struct.pack('<I', pixel_format & 0xFFFFFFFF) if 0 != c]
+    bits = [b for b in struct.pack('<I', pixel_format >> 32)][:len(names)]
+    if 0 == len(names) or 0 in bits:
+        return None
+    pixel_count = width * height
+    total_bits = sum(bits)
+    if all(8 == b for b in bits):
+        channels = _read_words(data, pixel_count * len(names), 1, 'u1')
+        if channels is None:
+            return None
+        channels = channels.reshape(pixel_count, len(names)).T
+    elif 16 == total_bits:
+        packed = _read_words(data, pixel_count, 2, '<u2')
+        if packed is None:
+            return None
+        # the first channel occupies the most significant bits
+        channels = []
+        shift = 16
+        for b in bits:
+            shift -= b
+            value = (packed >> shift) & ((1 << b) - 1)
+            channels.append(((value.astype(numpy.uint32) * 255 + ((1 << b) - 1) // 2) // ((1 << b) - 1)).astype(numpy.uint8))
+    else:
+        return None
+    rgba = numpy.zeros((pixel_count, 4), dtype=numpy.uint8)
+    rgba[:, 3] = 255
+    for name, channel in zip(names, channels):
+        match (name):
+            case 'r':
+                rgba[:, 0] = channel
+            case 'g':
+                rgba[:, 1] = channel
+            case 'b':
+                rgba[:, 2] = channel
+            case 'a':
+                rgba[:, 3] = channel
+            case 'l':
+                rgba[:, 0:3] = channel[:, None]
+            case 'i':
+                rgba[:, :] = channel[:, None]
+            case 'x':
+                pass
+            case _:
+                return None
+    return rgba.reshape(height, width, 4)
+
+def _bits(words, hi:int, lo:int):
+    return ((words >> numpy.uint64(lo)) & numpy.uint64((1 << (hi - lo + 1)) - 1)).astype(numpy.int32)
+
+def _extend(value, bits:int):
+    return (value << (8 - bits)) | (value >> (2 * bits - 8))
+
+# ETC pixel indices are column-major (p = x*4 + y), this maps them to row-major order
+_etc_to_row_major = [(q % 4) * 4 + (q // 4) for q in range(16)]
+
+def _decode_etc(words, etc2:bool, punchthrough:bool):
+    if words is None:
+        return None
+    n = len(words)
+    pixel = numpy.arange(16, dtype=numpy.uint64)
+    index = (((words[:, None] >> (pixel + numpy.uint64(16))) & numpy.uint64(1)) << numpy.uint64(1) | ((words[:, None] >> pixel) & numpy.uint64(1))).astype(numpy.int32)
+    x = (numpy.arange(16) // 4)[None, :]
+    y = (numpy.arange(16) % 4)[None, :]
+    flip = _bits(words, 32, 32)[:, None]
+    diff_bit = _bits(words, 33, 33)
+    # punchthrough blocks reuse the diff bit as an "opaque" flag and are always differential
+    differential = numpy.ones(n, dtype=bool) if punchthrough else (1 == diff_bit)
+    opaque = (1 == diff_bit) if punchthrough else numpy.ones(n, dtype=bool)
+    # base colours, individual and differential modes
+    base1 = numpy.empty((n, 3), dtype=numpy.int32)
+    base2 = numpy.empty((n, 3), dtype=numpy.int32)
+    overflow = []
+    for c, (hi, dhi) in enumerate([(63, 58), (55, 50), (47, 42)]):
+        c1 = _bits(words, hi, hi - 4)
+        d = _bits(words, dhi, dhi - 2)
+        c2 = c1 + numpy.where(d >= 4, d - 8, d)
+        overflow.append((c2 < 0) | (c2 > 31))
+        c2 = c2 & 0x1F
+        base1[:, c] = numpy.where(differential, _extend(c1, 5), _bits(words, hi, hi - 3) * 17)
+        base2[:, c] = numpy.where(differential, _extend(c2, 5), _bits(words, hi - 4, hi - 7) * 17)
+    table1 = _bits(words, 39, 37)[:, None]
+    table2 = _bits(words, 36, 34)[:, None]
+    second = numpy.where(1 == flip, y >= 2, x >= 2)
+    modifiers = numpy.array(_etc_modifiers, dtype=numpy.int32)[numpy.where(second, table2, table1), index]
+    if punchthrough:
+        # non-opaque blocks have no small modifiers
+        modifiers = numpy.where((~opaque[:, None]) & (0 == index % 2), 0, modifiers)
+    base = numpy.where(second[:, :, None], base2[:, None, :], base1[:, None, :])
+    rgb = numpy.clip(base + modifiers[:, :, None], 0, 255)
+    # ETC2 modes are signalled by an overflowing differential colour
+    if not etc2:
+        overflow = [numpy.zeros(n, dtype=bool)] * 3
+    t_mode = differential & overflow[0]
+    h_mode = differential & ~t_mode & overflow[1]
+    p_mode = differential & ~t_mode & ~h_mode & overflow[2]
+    if t_mode.any():
+        rgb[t_mode] = _decode_etc2_t(words[t_mode], index[t_mode])
+    if h_mode.any():
+        rgb[h_mode] = _decode_etc2_h(words[h_mode], index[h_mode])
+    if p_mode.any():
+        rgb[p_mode] = _decode_etc2_planar(words[p_mode])
+    alpha = numpy.full((n, 16), 255, dtype=numpy.int32)
+    if punchthrough:
+        transparent = (~opaque[:, None]) & (2 == index) & ~p_mode[:, None]
+        rgb[transparent] = 0
+        alpha[transparent] = 0
+    blocks = numpy.concatenate([rgb, alpha[:, :, None]], axis=2).astype(numpy.uint8)
+    return blocks[:, _etc_to_row_major]
+
+def _etc2_paint(c1, c2, distance, index, h_mode:bool):
+    d = distance[:, None]
+    if h_mode:
+        paint = numpy.stack([c1 + d, c1 - d, c2 + d, c2 - d], axis=1)
+    else:
+        paint = numpy.stack([c1, c2 + d, c2, c2 - d], axis=1)
+    paint = numpy.clip(paint, 0, 255)
+    return numpy.take_along_axis(paint, index[:, :, None].repeat(3, axis=2), axis=1)
+
+def _decode_etc2_t(words, index):
+    c1 = numpy.stack([
+        ((_bits(words, 60, 59) << 2) | _bits(words, 57, 56)) * 17,
+        _bits(words, 55, 52) * 17,
+        _bits(words, 51, 48) * 17], axis=1)
+    c2 = numpy.stack([
+        _bits(words, 47, 44) * 17,
+        _bits(words, 43, 40) * 17,
+        _bits(words, 39, 36) * 17], axis=1)
+    distance = numpy.array(_etc_distances, dtype=numpy.int32)[(_bits(words, 35, 34) << 1) | _bits(words, 32, 32)]
+    return _etc2_paint(c1, c2, distance, index, False)
+
+def _decode_etc2_h(words, index):
+    r1 = _bits(words, 62, 59)
+    g1 = (_bits(words, 58, 56) << 1) | _bits(words, 52, 52)
+    b1 = (_bits(words, 51, 51) << 3) | _bits(words, 49, 47)
+    r2 = _bits(words, 46, 43)
+    g2 = _bits(words, 42, 39)
+    b2 = _bits(words, 38, 35)
+    ordering = (((r1 << 8) | (g1 << 4) | b1) >= ((r2 << 8) | (g2 << 4) | b2)).astype(numpy.int32)
+    distance = numpy.array(_etc_distances, dtype=numpy.int32)[(_bits(words, 34, 34) << 2) | (_bits(words, 32, 32) << 1) | ordering]
+    c1 = numpy.stack([r1 * 17, g1 * 17, b1 * 17], axis=1)
+    c2 = numpy.stack([r2 * 17, g2 * 17, b2 * 17], axis=1)
+    return _etc2_paint(c1, c2, distance, index, True)
+
+def _decode_etc2_planar(words):
+    o = numpy.stack([
+        _extend(_bits(words, 62, 57), 6),
+        _extend((_bits(words, 56, 56) << 6) | _bits(words, 54, 49), 7),
+        _extend((_bits(words, 48, 48) << 5) | (_bits(words, 44, 43) << 3) | _bits(words, 41, 39), 6)], axis=1)
+    h = numpy.stack([
+        _extend((_bits(words, 38, 34) << 1) | _bits(words, 32, 32), 6),
+        _extend(_bits(words, 31, 25), 7),
+        _extend(_bits(words, 24, 19), 6)], axis=1)
+    v = numpy.stack([
+        _extend(_bits(words, 18, 13), 6),
+        _extend(_bits(words, 12, 6), 7),
+        _extend(_bits(words, 5, 0), 6)], axis=1)
+    # pixels in column-major order, like the other ETC modes
+    x = (numpy.arange(16) // 4)[None, :, None]
+    y = (numpy.arange(16) % 4)[None, :, None]
+    o = o[:, None, :]
+    return numpy.clip((x * (h[:, None, :] - o) + y * (v[:, None, :] - o) + 4 * o + 2) >> 2, 0, 255)
+
+def _decode_eac_alpha(words):
+    base = _bits(words, 63, 56)[:, None]
+    multiplier = _bits(words, 55, 52)[:, None]
+    table = _bits(words, 51, 48)[:, None]
+    shifts = numpy.array([45 - 3 * p for p in range(16)], dtype=numpy.uint64)
+    index = ((words[:, None] >> shifts) & numpy.uint64(7)).astype(numpy.int32)
+    alpha = numpy.clip(base + numpy.array(_eac_modifiers, dtype=numpy.int32)[table, index] * multiplier, 0, 255)
+    return alpha[:, _etc_to_row_major]
+
+def _rgb565(value):
+    return numpy.stack([
+        _extend((value >> 11) & 0x1F, 5),
+        _extend((value >> 5) & 0x3F, 6),
+        _extend(value & 0x1F, 5)], axis=1)
+
+def _decode_bc1(words, allow_transparent:bool):
+    if words is None:
+        return None
+    c0 = (words & numpy.uint64(0xFFFF)).astype(numpy.int32)
+    c1 = ((words >> numpy.uint64(16)) & numpy.uint64(0xFFFF)).astype(numpy.int32)
+    rgb0 = _rgb565(c0)
+    rgb1 = _rgb565(c1)
+    four_colour = (c0 > c1) | (not allow_transparent)
+    palette = numpy.empty((len(words), 4, 4), dtype=numpy.int32)
+    palette[:, 0, :3] = rgb0
+    palette[:, 1, :3] = rgb1
+    palette[:, 2, :3] = numpy.where(four_colour[:, None], (2 * rgb0 + rgb1) // 3, (rgb0 + rgb1) // 2)
+    palette[:, 3, :3] = numpy.where(four_colour[:, None], (rgb0 + 2 * rgb1) // 3, 0)
+    palette[:, :, 3] = 255
+    palette[:, 3, 3] = numpy.where(four_colour, 255, 0)
+    shifts = numpy.array([32 + 2 * p for p in range(16)], dtype=numpy.uint64)
+    index = ((words[:, None] >> shifts) & numpy.uint64(3)).astype(numpy.int64)
+    return numpy.take_along_axis(palette, index[:, :, None].repeat(4, axis=2), axis=1).astype(numpy.uint8)
+
+def _decode_bc2_alpha(words):
+    shifts = numpy.array([4 * p for p in range(16)], dtype=numpy.uint64)
+    return (((words[:, None] >> shifts) & numpy.uint64(0xF)) * numpy.uint64(17)).astype(numpy.uint8)
+
+def _decode_bc3_alpha(words):
+    a0 = (words & numpy.uint64(0xFF)).astype(numpy.int32)
+    a1 = ((words >> numpy.uint64(8)) & numpy.uint64(0xFF)).astype(numpy.int32)
+    eight = (a0 > a1)[:, None]
+    step = numpy.arange(1, 7, dtype=numpy.int32)[None, :]
+    palette = numpy.empty((len(words), 8), dtype=numpy.int32)
+    palette[:, 0] = a0
+    palette[:, 1] = a1
+    interpolated8 = ((7 - step) * a0[:, None] + step * a1[:, None]) // 7
+    interpolated6 = ((5 - step[:, :4]) * a0[:, None] + step[:, :4] * a1[:, None]) // 5
+    palette[:, 2:8] = numpy.where(eight, interpolated8, numpy.concatenate([interpolated6, numpy.zeros((len(words), 1), dtype=numpy.int32), numpy.full((len(words), 1), 255, dtype=numpy.int32)], axis=1))
+    shifts = numpy.array([16 + 3 * p for p in range(16)], dtype=numpy.uint64)
+    index = ((words[:, None] >> shifts) & numpy.uint64(7)).astype(numpy.int64)
+    return numpy.take_along_axis(palette, index, axis=1).astype(numpy.uint8)
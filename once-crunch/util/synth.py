@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# synth.py
+#
+# synthetic NXPK archives, for benchmarking and verifying the unpack path without game files
+##
+
+import lz4.block
+import math
+import random
+import struct
+import zlib
+import zstd
+from ..util import pvr
+
+_nxpk_magic = 0x4B50584E
+_nxfn_magic = 0x4E46584E
+# uncompressed 8-bit RGBA, channel names in the low word, channel bits in the high word
+_pvr_rgba8888 = struct.unpack('<Q', b'rgba' + bytes([8, 8, 8, 8]))[0]
+_noise_table = bytes(b & 0x3F for b in range(256))
+_words = [
+    b'entity', b'model', b'texture', b'skill', b'item', b'weapon', b'config', b'level',
+    b'=', b'(', b')', b'0', b'1', b'255', b'true', b'false', b'None', b'\n', b'\t', b'.'
+]
+
+def _payload(rng:random.Random, size:int):
+    # roughly half text-like (compressible) and half random bytes, so codecs do real work
+    text = bytearray()
+    while len(text) < size // 2:
+        text += rng.choice(_words)
+        text += b' '
+    return bytes(text[:size // 2]) + rng.randbytes(size - size // 2)
+
+def _image(rng:random.Random, size:int, kind:str):
+    side = max(4, int(math.sqrt(max(size, 64) / 4)) // 4 * 4)
+    # a gradient with some noise, compresses like a texture rather than like noise
+    row = bytes((x * 255 // side) & 0xFF for x in range(side))
+    pixels = bytearray(side * side * 4)
+    for y in range(side):
+        start = y * side * 4
+        end = start + side * 4
+        pixels[start:end:4] = row
+        pixels[start + 1:end:4] = bytes([(y * 255 // side) & 0xFF]) * side
+        pixels[start + 2:end:4] = rng.randbytes(side).translate(_noise_table)
+        pixels[start + 3:end:4] = b'\xff' * side
+    match (kind):
+        case '.pvr':
+            return pvr_texture(_pvr_rgba8888, side, side, bytes(pixels))
+        case '.png':
+            scanlines = b''.join(b'\0' + bytes(pixels[y * side * 4:(y + 1) * side * 4]) for y in range(side))
+            def chunk(kind:bytes, data:bytes):
+                return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)))
+            return b'\x89PNG\r\n\x1a\n' \
+                + chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 6, 0, 0, 0)) \
+                + chunk(b'IDAT', zlib.compress(scanlines)) \
+                + chunk(b'IEND', b'')
+
+def pvr_texture(pixel_format:int, width:int, height:int, data:bytes):
+    """returns a PVR v3 texture of one surface, `data` is the already encoded top-level mip of `pixel_format`"""
+    header = struct.pack('<IIQIIIIIIIII', pvr.PVR3_MAGIC, 0, pixel_format, 0, 0, height, width, 1, 1, 1, 1, 0)
+    return header + data
+
+def _compress(data:bytes, compression_type:int):
+    match (compression_type):
+        case 0:
+            return data
+        case 1:
+            return zlib.compress(data)
+        case 2:
+            return lz4.block.compress(data, store_size=False)
+        case 3:
+            return zstd.compress(data)
+    raise NotImplementedError(f'nxpk compression type: {compression_type}')
+
+def generate_nxpk(filepath:str, count:int = 1000, median_size:int = 16 * 1024, max_size:int = 4 * 1024 * 1024, compression_weights:tuple = (1, 1, 1, 1), image_ratio:float = 0.0, seed:int = 0):
+    """
+    writes a synthetic NXPK archive (with an NXFN name table) and returns its entries as
+    `(name, compression_type, uncompressed_size, uncompressed_crc)` tuples, in table order.
+
+    entry sizes are log-normally distributed around `median_size` (capped at `max_size`),
+    `compression_weights` are relative weights of compression types 0-3 (none/zlib/lz4/zstd),
+    and `image_ratio` of the entries are fake-but-valid PVR (RGBA8888) or PNG textures.
+    """
+    rng = random.Random(seed)
+    entries = []
+    with open(filepath, 'wb') as nxpk_file:
+        # the header is written last, once the table offset is known
+        nxpk_file.write(bytes(24))
+        offset = 24
+        table = bytearray()
+        names = []
+        for i in range(count):
+            size = min(max_size, max(0, int(rng.lognormvariate(math.log(max(1, median_size)), 1.0))))
+            if rng.random() < image_ratio:
+                ext = rng.choice(['.pvr', '.png'])
+                data = _image(rng, size, ext)
+            else:
+                ext = rng.choice(['.txt', '.bin', '.json', '.pyc'])
+                data = _payload(rng, size)
+            compression_type = rng.choices(range(4), compression_weights)[0]
+            compressed = _compress(data, compression_type)
+            name = f'synth/dir{i % 17}/sub{i % 5}/entry{i}{ext}'
+            nxpk_file.write(compressed)
+            table += struct.pack('<IIIIIIHH', zlib.crc32(name.encode('utf-8')), offset, len(compressed), len(data), zlib.crc32(compressed), zlib.crc32(data), compression_type, 0)
+            offset += len(compressed)
+            names.append(name.replace('/', '\\').encode('utf-8'))
+            entries.append((name, compression_type, len(data), zlib.crc32(data)))
+        table_offset = offset
+        nxpk_file.write(table)
+        nxfn_data = b'\0'.join(names) + b'\0'
+        nxpk_file.write(struct.pack('<IIII', _nxfn_magic, 0, len(nxfn_data), len(nxfn_data)))
+        nxpk_file.write(nxfn_data)
+        nxpk_file.seek(0)
+        nxpk_file.write(struct.pack('<IIHHBBHII', _nxpk_magic, count, 0, 0, 0, 0, 0, 0, table_offset))
+    return entries
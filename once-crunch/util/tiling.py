@@ -0,0 +1,298 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# tiling.py
+#
+# streaming mosaic composition, a scanline PNG encoder, and tile pyramid output
+##
+
+import math
+import os
+import re
+import struct
+import zlib
+from ..util.lazyimport import LazyModule
+from ..util.logging import Logger
+
+numpy = LazyModule('numpy')
+Image = LazyModule('PIL.Image')
+
+_log = Logger(__name__)
+
+_tile_name_pattern = re.compile(r'^(\d+)_(\d+)$')
+_png_signature = b'\x89PNG\r\n\x1a\n'
+# PNG color types by channel count
+_png_color_types = { 1: 0, 2: 4, 3: 2, 4: 6 }
+# bytes of compressed output buffered before an IDAT chunk is emitted
+_png_idat_size = 1024 * 1024
+
+def discover_tiles(path:str, ext:str):
+    """
+    returns `{(x,y):filepath}` for tiles named `X_Y{ext}` found in `path`, `(0,0)` is bottom-left.
+    """
+    tiles = {}
+    for fname in os.listdir(path):
+        noext, fext = os.path.splitext(fname)
+        if fext.lower() != ext:
+            continue
+        match = _tile_name_pattern.match(noext)
+        if None == match:
+            continue
+        tiles[(int(match.group(1)), int(match.group(2)))] = os.path.join(path, fname)
+    return tiles
+
+class PngStreamWriter:
+    """
+    a PNG encoder fed one band of scanlines at a time, only the compressor state and the
+    previous scanline are retained between calls.
+    """
+    _file:object
+    _width:int
+    _height:int
+    _channels:int
+    _rows_written:int
+    _compressor:object
+    _pending:list
+    _pending_size:int
+    _previous_row:object
+
+    def __init__(self, filepath:str, width:int, height:int, channels:int, compress_level:int = 9):
+        self._file = open(filepath, 'wb')
+        self._width = width
+        self._height = height
+        self._channels = channels
+        self._rows_written = 0
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_size = 0
+        self._previous_row = numpy.zeros((width * channels,), dtype=numpy.uint8)
+        self._file.write(_png_signature)
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, _png_color_types[channels], 0, 0, 0))
+
+    def write_rows(self, rows):
+        """
+        `rows` is a `(height, width, channels)` uint8 array.
+        """
+        rows = rows.reshape((rows.shape[0], self._width * self._channels))
+        # filter type 2 ("Up"), each scanline is stored as its difference from the previous one
+        previous = numpy.concatenate((self._previous_row[None, :], rows[:-1]), axis=0)
+        filtered = numpy.empty((rows.shape[0], rows.shape[1] + 1), dtype=numpy.uint8)
+        filtered[:, 0] = 2
+        numpy.subtract(rows, previous, out=filtered[:, 1:], dtype=numpy.uint8)
+        self._previous_row = rows[-1].copy()
+        self._rows_written += rows.shape[0]
+        self._append_idat(self._compressor.compress(filtered.tobytes()))
+
+    def close(self):
+        try:
+            if self._rows_written != self._height:
+                raise ValueError(f'PNG expected {self._height} rows, {self._rows_written} were written.')
+            self._append_idat(self._compressor.flush(), True)
+            self._write_chunk(b'IEND', b'')
+        finally:
+            self._file.close()
+
+    def abort(self):
+        """
+        closes and removes an incomplete output file.
+        """
+        self._file.close()
+        os.remove(self._file.name)
+
+    def _append_idat(self, data:bytes, flush:bool = False):
+        if 0 < len(data):
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= _png_idat_size or (flush and 0 < self._pending_size):
+            self._write_chunk(b'IDAT', b''.join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def _write_chunk(self, kind:bytes, data:bytes):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+class TilePyramid:
+    """
+    emits a downsampled tile pyramid from rows fed top-to-bottom, each level holds at most
+    one tile-row of pixels (plus a carry row) at any time.
+
+    `layout` is either `xyz` (`{z}/{x}/{y}.png`, full tiles, `z` of 0 is the whole map in one
+    tile) or `dzi` (Deep Zoom, `{name}_files/{level}/{col}_{row}.png` and a `{name}.dzi` descriptor,
+    edge tiles are cropped, level 0 is a single pixel.)
+    """
+    _levels:list
+    _layout:str
+    _tile_size:int
+    _ext:str
+    _directory:str
+
+    def __init__(self, directory:str, layout:str, width:int, height:int, channels:int, tile_size:int = 256, ext:str = '.png'):
+        self._layout = layout
+        self._tile_size = tile_size
+        self._ext = ext
+        match (layout):
+            case 'xyz':
+                self._directory = directory
+                level_count = max(0, math.ceil(math.log2(max(width, height) / tile_size))) + 1
+            case 'dzi':
+                name = os.path.basename(os.path.normpath(directory))
+                self._directory = os.path.join(directory, f'{name}_files')
+                level_count = math.ceil(math.log2(max(width, height, 1))) + 1
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, f'{name}.dzi'), 'w') as file:
+                    file.write(
+                        '<?xml version="1.0" encoding="UTF-8"?>\n'
+                        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{ext[1:]}" Overlap="0" TileSize="{tile_size}">\n'
+                        f'  <Size Width="{width}" Height="{height}"/>\n'
+                        '</Image>\n')
+            case _:
+                raise ValueError(f'Unsupported pyramid layout: {layout}')
+        self._levels = []
+        for i in range(level_count):
+            self._levels.append(_PyramidLevel(self, level_count - 1 - i, width, height, channels))
+            width = max(1, (width + 1) // 2)
+            height = max(1, (height + 1) // 2)
+
+    def write_rows(self, rows):
+        self._write_rows(0, rows)
+
+    def close(self):
+        for i in range(len(self._levels)):
+            self._levels[i].flush(i)
+
+    def _write_rows(self, index:int, rows):
+        if index < len(self._levels):
+            self._levels[index].write_rows(index, rows)
+
+    def _save_tile(self, level:int, col:int, row:int, pixels):
+        match (self._layout):
+            case 'xyz':
+                if pixels.shape[0] != self._tile_size or pixels.shape[1] != self._tile_size:
+                    padded = numpy.zeros((self._tile_size, self._tile_size, pixels.shape[2]), dtype=numpy.uint8)
+                    padded[:pixels.shape[0], :pixels.shape[1]] = pixels
+                    pixels = padded
+                filepath = os.path.join(self._directory, str(level), str(col), f'{row}{self._ext}')
+            case 'dzi':
+                filepath = os.path.join(self._directory, str(level), f'{col}_{row}{self._ext}')
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        Image.fromarray(pixels).save(filepath)
+
+class _PyramidLevel:
+    _pyramid:TilePyramid
+    _level:int
+    _width:int
+    _height:int
+    _buffer:object
+    _buffered:int
+    _tile_row:int
+    _carry:object
+
+    def __init__(self, pyramid:TilePyramid, level:int, width:int, height:int, channels:int):
+        self._pyramid = pyramid
+        self._level = level
+        self._width = width
+        self._height = height
+        self._buffer = numpy.zeros((pyramid._tile_size, width, channels), dtype=numpy.uint8)
+        self._buffered = 0
+        self._tile_row = 0
+        self._carry = None
+
+    def write_rows(self, index:int, rows):
+        self._downsample(index, rows)
+        while 0 < rows.shape[0]:
+            count = min(rows.shape[0], self._buffer.shape[0] - self._buffered)
+            self._buffer[self._buffered:self._buffered + count] = rows[:count]
+            self._buffered += count
+            rows = rows[count:]
+            if self._buffered == self._buffer.shape[0]:
+                self._emit()
+
+    def flush(self, index:int):
+        if 0 < self._buffered:
+            self._emit()
+        if self._carry is not None:
+            # an odd final row is averaged with itself
+            carry, self._carry = self._carry, None
+            self._downsample(index, numpy.concatenate((carry, carry), axis=0))
+
+    def _emit(self):
+        tile_size = self._pyramid._tile_size
+        for col in range(0, math.ceil(self._width / tile_size)):
+            self._pyramid._save_tile(self._level, col, self._tile_row,
+                self._buffer[:self._buffered, col * tile_size:(col + 1) * tile_size])
+        self._tile_row += 1
+        self._buffered = 0
+
+    def _downsample(self, index:int, rows):
+        if self._carry is not None:
+            rows = numpy.concatenate((self._carry, rows), axis=0)
+            self._carry = None
+        if 1 == rows.shape[0] % 2:
+            self._carry = rows[-1:].copy()
+            rows = rows[:-1]
+        if 0 == rows.shape[0]:
+            return
+        if 1 == rows.shape[1] % 2:
+            rows = numpy.concatenate((rows, rows[:, -1:]), axis=1)
+        total = rows[0::2, 0::2].astype(numpy.uint16)
+        total += rows[0::2, 1::2]
+        total += rows[1::2, 0::2]
+        total += rows[1::2, 1::2]
+        self._pyramid._write_rows(index + 1, ((total + 2) >> 2).astype(numpy.uint8))
+
+def stitch_tiles(tiles:dict, output_filepath:str, pyramid_directory:str = None, pyramid_layout:str = 'xyz', pyramid_tile_size:int = 256, progress = None):
+    """
+    composites `{(x,y):filepath}` tiles one row-band at a time, streaming each band to a
+    PNG at `output_filepath` (when not `None`) and to a tile pyramid (when `pyramid_directory`
+    is not `None`.) peak memory is bounded by one band of tiles.
+
+    missing tiles are left transparent (or black, for tiles without an alpha channel.)
+    returns `(width, height)` of the mosaic.
+    """
+    max_x = max(x for x, y in tiles) + 1
+    max_y = max(y for x, y in tiles) + 1
+    # the first tile decides tile dimensions and the pixel format of the mosaic
+    with Image.open(tiles[min(tiles)]) as image:
+        tile_width, tile_height = image.size
+        mode = 'RGBA' if 'A' in image.getbands() or 'transparency' in image.info or len(tiles) < max_x * max_y else 'RGB'
+    channels = len(mode)
+    width = tile_width * max_x
+    height = tile_height * max_y
+    writer = None if None == output_filepath else PngStreamWriter(output_filepath, width, height, channels)
+    pyramid = None if None == pyramid_directory else TilePyramid(pyramid_directory, pyramid_layout, width, height, channels, pyramid_tile_size)
+    band = numpy.zeros((tile_height, width, channels), dtype=numpy.uint8)
+    completed = False
+    try:
+        # origin is bottom-left, bands are emitted top-down
+        for band_index, y in enumerate(range(max_y - 1, -1, -1)):
+            band[...] = 0
+            for x in range(max_x):
+                filepath = tiles.get((x, y))
+                if None == filepath:
+                    continue
+                with Image.open(filepath) as image:
+                    if image.size != (tile_width, tile_height):
+                        _log.warn(f'Tile `{filepath}` is {image.size[0]}x{image.size[1]}, expected {tile_width}x{tile_height}, cropping/padding.')
+                    pixels = numpy.asarray(image.convert(mode))
+                    h = min(tile_height, pixels.shape[0])
+                    w = min(tile_width, pixels.shape[1])
+                    band[:h, x * tile_width:x * tile_width + w] = pixels[:h, :w]
+            if None != writer:
+                writer.write_rows(band)
+            if None != pyramid:
+                pyramid.write_rows(band)
+            if None != progress:
+                progress(band_index + 1, max_y)
+        if None != pyramid:
+            pyramid.close()
+        completed = True
+    finally:
+        if None != writer:
+            if completed:
+                writer.close()
+            else:
+                writer.abort()
+    return (width, height)
@@ -9,9 +9,7 @@
 # This script accepts a directory path which 
 # will be scanned for map tile images.
 #
-# Tile images are assumed to be in the same
-# format as the output image (ie. expects
-# the same file extension.)
+# Tile images are assumed to be PNG files.
 #
 # Tile images are assumed to have a naming
 # convention "X_Y.png".
@@ -48,55 +46,25 @@ param(
     [Parameter(Mandatory=$true)]
     [string]$Path,
     [Parameter(Mandatory=$true)]
-    [string]$Out
+    [string]$Out,
+    [Parameter(Mandatory=$false)]
+    [ValidateSet("xyz","dzi")]
+    [string]$Pyramid
 )
 $ErrorActionPreference = "Stop"
 
-function Stitch-Images($source, $destination) {
-    if ([System.IO.File]::Exists($destination)) {
-        if (!$Force.IsPresent) {
-            return
-        } else {
-            Remove-Item -Force $destination
-        }
-    }
-    $ext = [System.IO.Path]::GetFileName($destination).Replace([System.IO.Path]::GetFileNameWithoutExtension($destination), "")
-    $max_x = 0
-    $max_y = 0
-    $image_files = @(Get-ChildItem "$source\*_*.png")
-    for ($i = 0; $i -lt $image_files.Count; $i++) {
-        $noext = $image_files[$i].Name.Replace(".png", "")
-        $parts = $noext.Split("_")
-        $x = [int]::Parse($parts[0])
-        $y = [int]::Parse($parts[1])
-        if ($x -gt $max_x) {
-            $max_x = $x
-        }
-        if ($y -gt $max_y) {
-            $max_y = $y
-        }
-    }
-    $max_x++
-    $max_y++
-    $imargs = @()
-    for ($y = $max_y; $y -gt 0; $y--) {
-        for ($x = 0; $x -lt $max_x; $x++) {
-            $imargs += @("$source/$x`_$($y - 1).png")
-        }
-    }
-    $imargs += "-tile"
-    $imargs += "$max_x`x"
-    $imargs += "-geometry"
-    $imargs += "+0+0"
-    if ($ext -eq ".png") {
-        $imargs += "-define"
-        $imargs += "png:compression-level=9"
-    } elseif ($ext -eq ".webp") {
-        $imargs += "-define"
-        $imargs += "webp:lossless=true"
-    }
-    $imargs += "$destination"
-    Start-Process "montage" -ArgumentList $imargs -Wait -NoNewWindow
+# tiles are composited by the `stitch` command one row-band
+# at a time, add `-Pyramid xyz` (or `dzi`) to also emit a
+# tile pyramid next to the output image.
+$pyargs = @("-m", "once-crunch")
+if ($Force.IsPresent) {
+    $pyargs += "-f"
 }
-
-Stitch-Images $Path $Out
+$pyargs += "stitch"
+if ($Pyramid) {
+    $pyargs += "--pyramid"
+    $pyargs += $Pyramid
+}
+$pyargs += $Path
+$pyargs += $Out
+Start-Process "python" -ArgumentList $pyargs -Wait -NoNewWindow
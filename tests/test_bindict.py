@@ -0,0 +1,44 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# `.bindict` decoding and the `.bindict.tab` round trip
+##
+
+import importlib
+import struct
+import pytest
+
+bindict = importlib.import_module('once-crunch.util.bindict')
+BindictTable = bindict.BindictTable
+
+def _blob(values:list, footer:bytes = b'footer'):
+    # entry count, `count + 1` entry bounds (the last is the table blob size), table blob, footer blob
+    bounds = [0]
+    for value in values:
+        bounds.append(bounds[-1] + len(value))
+    return struct.pack(f'<I{len(bounds)}I', len(values), *bounds) + b''.join(values) + footer
+
+def test_decode():
+    table = BindictTable.decode(_blob([b'alpha', 'béta'.encode('utf8'), 'gamma'.encode('utf16')]))
+    assert 3 == len(table)
+    assert ['alpha', 'béta', 'gamma'] == [table[i]['v'] for i in range(3)]
+    assert { 'v': 'alpha', 'z': 5, 'b': 20, 'e': 25 } == table[0]
+    assert 6 == table.footer_size
+
+def test_load_maps_what_save_wrote(tmp_path):
+    table = BindictTable.decode(_blob([b'alpha', 'gamma'.encode('utf16'), b'']))
+    tab_filepath = str(tmp_path / 'x.bindict.tab')
+    table.save(tab_filepath)
+    loaded = BindictTable.load(tab_filepath)
+    assert None != loaded._map
+    assert isinstance(loaded.values, memoryview)
+    assert [table[i] for i in range(len(table))] == [loaded[i] for i in range(len(loaded))]
+    assert (table.table_offset, table.table_size, table.footer_size) == (loaded.table_offset, loaded.table_size, loaded.footer_size)
+    assert bytes(table.encodings) == bytes(loaded.encodings)
+
+def test_load_rejects_other_files(tmp_path):
+    for content in [b'', b'BDT1', b'not a bindict table']:
+        tab_filepath = tmp_path / 'x.bindict.tab'
+        tab_filepath.write_bytes(content)
+        with pytest.raises(ValueError):
+            BindictTable.load(str(tab_filepath))
@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# `--include`/`--exclude` pattern kinds, precedence, and the two-path form used by unpack
+##
+
+import argparse
+import importlib
+import pytest
+
+filtering = importlib.import_module('once-crunch.util.filtering')
+PathFilter = filtering.PathFilter
+
+def _included(pattern:str, path:str):
+    return PathFilter(include=pattern).accepts(path)
+
+def test_substring_matches_anywhere():
+    assert _included('mipmap.png', 'ui/a_mipmap.png')
+    assert _included('mipmap.png', 'mipmap.png.bak')
+    assert not _included('mipmap.png', 'ui/a_normal.png')
+    # `.` is literal, not a regular expression
+    assert not _included('mipmap.png', 'ui/mipmapxpng')
+
+def test_glob_matches_whole_path():
+    assert _included('*.pvr', 'a/b.pvr')
+    assert not _included('*.pvr', 'a/b.pvr.bak')
+    assert _included('ui/*', 'ui/x/y.png')
+    assert not _included('ui/*', 'sub/ui/x.png')
+    assert _included('a?.png', 'ab.png')
+    assert not _included('a?.png', 'abc.png')
+    assert _included('[ab].png', 'b.png')
+    assert not _included('[ab].png', 'c.png')
+
+def test_regex_searches():
+    assert _included(r're:_(normal|albedo)\.', 'x/y_normal.png')
+    assert not _included(r're:_(normal|albedo)\.', 'x/y_control.png')
+    assert _included(r're:^ui/', 'ui/a.png')
+    assert not _included(r're:^ui/', 'x/ui/a.png')
+
+def test_regex_inline_flags_are_scoped_to_their_pattern():
+    path_filter = PathFilter(include=[r're:(?i)\.PNG$', 'Foo'])
+    assert path_filter.accepts('a/b.png')
+    assert path_filter.accepts('a/Foo.json')
+    # `(?i)` of the first item must not leak into the second
+    assert not path_filter.accepts('a/foo.json')
+
+def test_invalid_regex_raises():
+    with pytest.raises(ValueError):
+        PathFilter(include='re:(unclosed')
+
+def test_exact_path():
+    assert _included('=ui/icon.png', 'ui/icon.png')
+    assert not _included('=ui/icon.png', 'ui/icon.png.bak')
+    assert not _included('=ui/icon.png', 'x/ui/icon.png')
+    # `=` items are exact even with glob characters
+    assert _included('=ui/*.png', 'ui/*.png')
+    assert not _included('=ui/*.png', 'ui/a.png')
+
+def test_pattern_kinds_combine():
+    path_filter = PathFilter(include='=a/exact.bin,*.pvr,re:\\.json$,mipmap')
+    assert path_filter.accepts('a/exact.bin')
+    assert path_filter.accepts('b/c.pvr')
+    assert path_filter.accepts('b/c.json')
+    assert path_filter.accepts('b/c_mipmap.png')
+    assert not path_filter.accepts('b/c.png')
+
+def test_list_file(tmp_path):
+    list_filepath = tmp_path / 'changed.txt'
+    list_filepath.write_text('# added and changed entries\n=a/b.json\n\n*.pvr\r\n', encoding='utf-8')
+    path_filter = PathFilter(include=f'@{list_filepath}')
+    assert path_filter.accepts('a/b.json')
+    assert path_filter.accepts('c/d.pvr')
+    # neither the comment nor the blank line became a pattern
+    assert not path_filter.accepts('# added and changed entries')
+    assert not path_filter.accepts('c/d.png')
+
+def test_empty_patterns_are_ignored():
+    path_filter = PathFilter(include=',,', exclude='')
+    assert not path_filter
+    assert path_filter.accepts('anything')
+
+def test_exclude_wins_over_include():
+    path_filter = PathFilter(include='*.png', exclude='mipmap')
+    assert path_filter.accepts('a/b.png')
+    assert not path_filter.accepts('a/b_mipmap.png')
+    assert not path_filter.accepts('a/b.json')
+
+def test_exclude_only():
+    path_filter = PathFilter(exclude='*.pvr')
+    assert path_filter.accepts('a/b.png')
+    assert not path_filter.accepts('a/b.pvr')
+    assert path_filter.excludes('a/b.pvr')
+
+def test_excludes_ignores_include():
+    assert not PathFilter(include='*.png').excludes('a/b.json')
+
+def test_accepts_either_name_included():
+    # an entry and the name post-processing gives it, ie. `--img-format png`
+    path_filter = PathFilter(include='*.png')
+    assert path_filter.accepts('a/b.pvr', 'a/b.png')
+    assert not path_filter.accepts('a/b.pvr', 'a/b.pvr')
+
+def test_accepts_any_name_excluded():
+    path_filter = PathFilter(include='a/*', exclude='*.png')
+    assert not path_filter.accepts('a/b.pvr', 'a/b.png')
+    assert not path_filter.accepts('a/b.png', 'a/b.pvr')
+    assert path_filter.accepts('a/b.pvr', 'a/b.pvr')
+
+def test_from_args():
+    path_filter = PathFilter.from_args(argparse.Namespace(include=None, exclude='*.pvr'))
+    assert path_filter
+    assert not path_filter.accepts('a/b.pvr')
+    assert not PathFilter.from_args(argparse.Namespace())
+
+def test_unpack_filters_on_the_converted_name():
+    nxpk = importlib.import_module('once-crunch.formats.NXPKFormatHandler')
+    args = argparse.Namespace(img_format='png')
+    path_filter = PathFilter(include='*.png')
+    assert path_filter.accepts('a/b.pvr', nxpk._converted_name(args, 'a/b.pvr'))
+    assert not path_filter.accepts('a/b.json', nxpk._converted_name(args, 'a/b.json'))
+    args.img_format = None
+    assert not path_filter.accepts('a/b.pvr', nxpk._converted_name(args, 'a/b.pvr'))
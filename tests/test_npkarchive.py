@@ -0,0 +1,38 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# random access to a synthetic archive, including concurrent reads
+##
+
+import concurrent.futures
+import importlib
+import zlib
+import pytest
+
+NpkArchive = importlib.import_module('once-crunch.formats.NpkArchive').NpkArchive
+synth = importlib.import_module('once-crunch.util.synth')
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory):
+    filepath = str(tmp_path_factory.mktemp('npk') / 'synth.npk')
+    entries = synth.generate_nxpk(filepath, count=200, median_size=16 * 1024, max_size=256 * 1024, seed=1)
+    return filepath, entries
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_read(archive, use_mmap:bool):
+    filepath, entries = archive
+    with NpkArchive(filepath, use_mmap=use_mmap) as npk:
+        assert len(entries) == len(npk)
+        for name, compression_type, size, crc in entries:
+            data = npk.read(name)
+            assert (size, crc) == (len(data), zlib.crc32(data)), name
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_concurrent_read(archive, use_mmap:bool):
+    filepath, entries = archive
+    # no cache, every read goes to the file
+    with NpkArchive(filepath, cache_size=0, use_mmap=use_mmap) as npk:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(20):
+                for (name, compression_type, size, crc), data in zip(entries, executor.map(npk.read, [entry[0] for entry in entries])):
+                    assert (size, crc) == (len(data), zlib.crc32(data)), name
@@ -0,0 +1,156 @@
+# SPDX-FileCopyrightText: © 2024 Shaun Wilson
+# SPDX-License-Identifier: MIT
+#
+# known-answer tests of the in-process PVR decoder, one hand-encoded block per format and mode.
+# expected values are worked out from the format specifications, not from the decoder.
+##
+
+import importlib
+import struct
+
+pvr = importlib.import_module('once-crunch.util.pvr')
+synth = importlib.import_module('once-crunch.util.synth')
+
+_etc1 = 6
+_etc2_rgb = 22
+_etc2_rgba = 23
+_etc2_rgb_a1 = 24
+_bc1 = 7
+_bc2 = 9
+_bc3 = 11
+
+# ETC1 differential block: base colours (165,82,255) and (189,49,255), flipped (top/bottom halves),
+# tables 1 and 2, the pixel index of every pixel is its column
+_etc_differential = bytes.fromhex('a3 54 f8 2b ff 00 f0 f0')
+_etc_differential_expected = [
+    [(170, 87, 255), (182, 99, 255), (160, 77, 250), (148, 65, 238)],
+    [(170, 87, 255), (182, 99, 255), (160, 77, 250), (148, 65, 238)],
+    [(198, 58, 255), (218, 78, 255), (180, 40, 246), (160, 20, 226)],
+    [(198, 58, 255), (218, 78, 255), (180, 40, 246), (160, 20, 226)]
+]
+
+def _decode(pixel_format:int, width:int, height:int, data:bytes):
+    image = pvr.decode(synth.pvr_texture(pixel_format, width, height, data))
+    assert image is not None
+    assert (height, width, 4) == image.shape
+    return image
+
+def _assert_rgb(image, expected:list, alpha:int = 255):
+    for y, row in enumerate(expected):
+        for x, rgb in enumerate(row):
+            assert (*rgb, alpha) == tuple(int(c) for c in image[y, x]), f'pixel ({x},{y})'
+
+def test_etc1_individual():
+    # base colours (170,51,0) left and (85,204,255) right, tables 0 and 7, pixel index is the row
+    image = _decode(_etc1, 4, 4, bytes.fromhex('a5 3c 0f 1c cc cc aa aa'))
+    _assert_rgb(image, [
+        [(172, 53, 2), (172, 53, 2), (132, 251, 255), (132, 251, 255)],
+        [(178, 59, 8), (178, 59, 8), (255, 255, 255), (255, 255, 255)],
+        [(168, 49, 0), (168, 49, 0), (38, 157, 208), (38, 157, 208)],
+        [(162, 43, 0), (162, 43, 0), (0, 21, 72), (0, 21, 72)]
+    ])
+
+def test_etc1_differential():
+    _assert_rgb(_decode(_etc1, 4, 4, _etc_differential), _etc_differential_expected)
+
+def test_etc2_rgb_differential_matches_etc1():
+    _assert_rgb(_decode(_etc2_rgb, 4, 4, _etc_differential), _etc_differential_expected)
+
+def test_etc2_t_mode():
+    # red overflows, colours (187,34,68) and (136,153,170), distance 32, pixel index is the row
+    image = _decode(_etc2_rgb, 4, 4, bytes.fromhex('f3 24 89 ab cc cc aa aa'))
+    paint = [(187, 34, 68), (168, 185, 202), (136, 153, 170), (104, 121, 138)]
+    _assert_rgb(image, [[paint[y]] * 4 for y in range(4)])
+
+def test_etc2_h_mode():
+    # green overflows, colours (51,85,153) and (17,102,204) are ordered so distance is 32, pixel index is the column
+    image = _decode(_etc2_rgb, 4, 4, bytes.fromhex('1a 1c 8b 66 ff 00 f0 f0'))
+    paint = [(83, 117, 185), (19, 53, 121), (49, 134, 236), (0, 70, 172)]
+    _assert_rgb(image, [paint] * 4)
+
+def test_etc2_planar_mode():
+    # blue overflows, origin (130,129,0), horizontal (195,0,255), vertical (65,255,0)
+    image = _decode(_etc2_rgb, 4, 4, bytes.fromhex('41 00 04 62 01 fa 1f c0'))
+    for x, y, rgb in [
+            (0, 0, (130, 129, 0)),
+            (3, 0, (179, 32, 191)),
+            (0, 3, (81, 224, 0)),
+            (3, 3, (130, 127, 191)),
+            (1, 2, (114, 160, 64))]:
+        assert (*rgb, 255) == tuple(int(c) for c in image[y, x]), f'pixel ({x},{y})'
+
+def test_etc2_rgba():
+    # EAC alpha, base 128, multiplier 10, table 13, pixel index is its position modulo 8
+    image = _decode(_etc2_rgba, 4, 4, bytes.fromhex('80 ad 05 39 77 05 39 77') + _etc_differential)
+    for y in range(4):
+        for x in range(4):
+            assert tuple(_etc_differential_expected[y][x]) == tuple(int(c) for c in image[y, x, :3])
+            assert [118, 108, 98, 28, 128, 138, 148, 218][4 * (x % 2) + y] == image[y, x, 3], f'pixel ({x},{y})'
+
+def test_etc2_rgb_a1_opaque():
+    _assert_rgb(_decode(_etc2_rgb_a1, 4, 4, _etc_differential), _etc_differential_expected)
+
+def test_etc2_rgb_a1_punchthrough():
+    # the opaque bit is clear, index 0 is the base colour, 1 and 3 add and subtract the large modifier, 2 is transparent
+    image = _decode(_etc2_rgb_a1, 4, 4, bytes.fromhex('a3 54 f8 29 ff 00 f0 f0'))
+    for y in range(4):
+        top = y < 2
+        assert ((165, 82, 255, 255) if top else (189, 49, 255, 255)) == tuple(int(c) for c in image[y, 0])
+        assert ((182, 99, 255, 255) if top else (218, 78, 255, 255)) == tuple(int(c) for c in image[y, 1])
+        assert (0, 0, 0, 0) == tuple(int(c) for c in image[y, 2])
+        assert ((148, 65, 238, 255) if top else (160, 20, 226, 255)) == tuple(int(c) for c in image[y, 3])
+
+def test_bc1_four_colour():
+    # c0 (132,130,8) > c1 black, pixel index is the column
+    image = _decode(_bc1, 4, 4, bytes.fromhex('01 84 00 00 e4 e4 e4 e4'))
+    _assert_rgb(image, [[(132, 130, 8), (0, 0, 0), (88, 86, 5), (44, 43, 2)]] * 4)
+
+def test_bc1_three_colour():
+    # c0 blue <= c1 red, index 3 is transparent black
+    image = _decode(_bc1, 4, 4, bytes.fromhex('1f 00 00 f8 e4 e4 e4 e4'))
+    for y in range(4):
+        assert [(0, 0, 255, 255), (255, 0, 0, 255), (127, 0, 127, 255), (0, 0, 0, 0)] == [tuple(int(c) for c in image[y, x]) for x in range(4)]
+
+def test_bc2():
+    # explicit alpha is the pixel position, colours always use four-colour mode
+    image = _decode(_bc2, 4, 4, bytes.fromhex('10 32 54 76 98 ba dc fe 1f 00 00 f8 e4 e4 e4 e4'))
+    for y in range(4):
+        for x, rgb in enumerate([(0, 0, 255), (255, 0, 0), (85, 0, 170), (170, 0, 85)]):
+            assert (*rgb, (y * 4 + x) * 17) == tuple(int(c) for c in image[y, x]), f'pixel ({x},{y})'
+
+def test_bc3_eight_alpha():
+    # a0 210 > a1 0, pixel index is its position modulo 8
+    image = _decode(_bc3, 4, 4, bytes.fromhex('d2 00 88 c6 fa 88 c6 fa 01 84 00 00 e4 e4 e4 e4'))
+    alpha = [210, 0, 180, 150, 120, 90, 60, 30]
+    for y in range(4):
+        assert [alpha[(4 * y + x) % 8] for x in range(4)] == [int(a) for a in image[y, :, 3]]
+    assert (88, 86, 5) == tuple(int(c) for c in image[0, 2, :3])
+
+def test_bc3_six_alpha():
+    # a0 0 <= a1 200, indices 6 and 7 are 0 and 255
+    image = _decode(_bc3, 4, 4, bytes.fromhex('00 c8 88 c6 fa 88 c6 fa 01 84 00 00 e4 e4 e4 e4'))
+    alpha = [0, 200, 40, 80, 120, 160, 0, 255]
+    for y in range(4):
+        assert [alpha[(4 * y + x) % 8] for x in range(4)] == [int(a) for a in image[y, :, 3]]
+
+def test_blocks_are_tiled_row_major_and_cropped():
+    # four solid BC1 blocks, red, green, blue, white, cropped to 7x5
+    solid = lambda c: struct.pack('<HH', c, c) + bytes(4)
+    image = _decode(_bc1, 7, 5, solid(0xF800) + solid(0x07E0) + solid(0x001F) + solid(0xFFFF))
+    assert (255, 0, 0, 255) == tuple(int(c) for c in image[0, 0])
+    assert (0, 255, 0, 255) == tuple(int(c) for c in image[3, 6])
+    assert (0, 0, 255, 255) == tuple(int(c) for c in image[4, 3])
+    assert (255, 255, 255, 255) == tuple(int(c) for c in image[4, 4])
+
+def test_uncompressed_rgba8888():
+    image = _decode(synth._pvr_rgba8888, 2, 1, bytes([1, 2, 3, 4, 5, 6, 7, 8]))
+    assert [[1, 2, 3, 4], [5, 6, 7, 8]] == image[0].tolist()
+
+def test_uncompressed_rgb565():
+    rgb565 = struct.unpack('<Q', b'rgb\0' + bytes([5, 6, 5, 0]))[0]
+    image = _decode(rgb565, 2, 2, struct.pack('<4H', 0xF81F, 0x0400, 0x0000, 0xFFFF))
+    assert [[[255, 0, 255, 255], [0, 130, 0, 255]], [[0, 0, 0, 255], [255, 255, 255, 255]]] == image.tolist()
+
+def test_unsupported_format_is_none():
+    # PVRTC 2bpp RGB, left to PVRTexToolCLI
+    assert pvr.decode(synth.pvr_texture(0, 4, 4, bytes(8))) is None